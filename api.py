@@ -0,0 +1,194 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import Blueprint, current_app, jsonify, request, stream_with_context, url_for
+from database import get_db, decode_cursor, encode_cursor, listing_version
+from http_cache import add_validators, is_not_modified, not_modified_response, parse_db_timestamp
+from offline import decode_change_cursor, fetch_changes
+from taxonomy import tags_for_tutorials
+
+# Part of every ETag, so a change to the response format invalidates them
+API_VERSION = 1
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10000
+MAX_CHANGES_LIMIT = 1000
+# Rows read and written to the stream at a time
+STREAM_BATCH_SIZE = 500
+
+SUMMARY_COLUMNS = ('id, slug, title, description, excerpt, image_path, word_count, reading_minutes, '
+                   'created_at, updated_at')
+
+api = Blueprint('api', __name__, url_prefix=f'/api/v{API_VERSION}')
+
+def api_etag(*parts):
+    key = '|'.join(str(part) for part in (API_VERSION,) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+def error(message, status):
+    return jsonify({'error': message}), status
+
+def parse_limit(default, maximum):
+    limit = request.args.get('limit', default, type=int)
+    return min(max(limit, 1), maximum)
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def summarizer():
+    # Returns summary(row, tags). url_for() costs more than the rest of a
+    # row, so tutorial URLs are built from prefixes made once per response
+    # and image URLs (shared between tutorials) are made once per image.
+    page_prefix = url_for('tutorial', slug='x')[:-1]
+    api_prefix = url_for('api.tutorial', slug='x')[:-1]
+    images = {}
+    
+    def summary(row, tags):
+        image_path = row['image_path']
+        if image_path and image_path not in images:
+            images[image_path] = url_for('static', filename=image_path)
+        slug = quote(row['slug'])
+        return {
+            'id': row['id'],
+            'slug': row['slug'],
+            'title': row['title'],
+            'description': row['description'],
+            'excerpt': row['excerpt'],
+            'image': images[image_path] if image_path else None,
+            'word_count': row['word_count'],
+            'reading_minutes': row['reading_minutes'],
+            'tags': [tag['name'] for tag in tags],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'url': page_prefix + slug,
+            'api_url': api_prefix + slug,
+        }
+    
+    return summary
+
+def stream_listing(conn, position, limit):
+    # Yields the page as JSON text one batch of rows at a time, walking the
+    # (created_at, id) keyset, so memory stays flat however large `limit`
+    # is. next_cursor is only known at the end, so it follows the list.
+    summary = summarizer()
+    yield '{"tutorials":['
+    sent = 0
+    last = None
+    has_more = False
+    try:
+        while sent < limit:
+            batch = min(STREAM_BATCH_SIZE, limit - sent)
+            where = 'WHERE (created_at, id) < (?, ?) ' if position else ''
+            rows = conn.execute(
+                f'SELECT {SUMMARY_COLUMNS} FROM tutorials {where}ORDER BY created_at DESC, id DESC LIMIT ?',
+                (*position, batch + 1) if position else (batch + 1,)
+            ).fetchall()
+            has_more = len(rows) > batch
+            rows = rows[:batch]
+            if not rows:
+                break
+            tags = tags_for_tutorials(conn, [row['id'] for row in rows])
+            chunk = ','.join(dumps(summary(row, tags[row['id']])) for row in rows)
+            yield (',' if sent else '') + chunk
+            sent += len(rows)
+            last = rows[-1]
+            position = (last['created_at'], last['id'])
+            if not has_more:
+                break
+    finally:
+        conn.rollback()
+    next_cursor = encode_cursor(last) if has_more and last is not None else None
+    yield f'],"count":{sent},"next_cursor":{dumps(next_cursor)},"has_more":{dumps(has_more)}}}'
+
+@api.route('/tutorials')
+def tutorials():
+    cursor = request.args.get('cursor')
+    position = decode_cursor(cursor)
+    if cursor and position is None:
+        return error('Invalid cursor', 400)
+    limit = parse_limit(DEFAULT_LIMIT, MAX_LIMIT)
+    
+    conn = get_db()
+    # One read transaction, so the ETag and every streamed batch come from
+    # the same snapshot while the app keeps writing
+    conn.execute('BEGIN')
+    count, changed = listing_version(conn)
+    etag = api_etag('tutorials', cursor, limit, count, changed)
+    last_modified = parse_db_timestamp(changed)
+    if is_not_modified(etag, last_modified):
+        conn.rollback()
+        return not_modified_response(etag, last_modified)
+    
+    response = current_app.response_class(stream_with_context(stream_listing(conn, position, limit)),
+                                          mimetype='application/json')
+    return add_validators(response, etag, last_modified)
+
+@api.route('/tutorials/<slug>')
+def tutorial(slug):
+    conn = get_db()
+    row = conn.execute(f'SELECT {SUMMARY_COLUMNS} FROM tutorials WHERE slug = ?', (slug,)).fetchone()
+    if row is None:
+        return error('Tutorial not found', 404)
+    
+    etag = api_etag('tutorial', row['id'], row['updated_at'])
+    last_modified = parse_db_timestamp(row['updated_at'])
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    body = conn.execute('SELECT content, toc_json FROM tutorials WHERE id = ?', (row['id'],)).fetchone()
+    record = summarizer()(row, tags_for_tutorials(conn, [row['id']])[row['id']])
+    record['content'] = body['content']
+    record['toc'] = json.loads(body['toc_json'] or '[]')
+    return add_validators(jsonify(record), etag, last_modified)
+
+@api.route('/changes')
+def changes():
+    # The /changes feed with each changed tutorial's summary inline. A
+    # client passes back `cursor` from the previous response, or starts
+    # from a point in time with `since` (as in `updated_at`); with neither
+    # it gets the current position and no changes.
+    cursor = request.args.get('cursor')
+    since = request.args.get('since')
+    if since and not cursor:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return error('Invalid since; expected an ISO 8601 timestamp', 400)
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        # Sorts before every change at or after that moment, in the format
+        # of updated_at (older rows have no milliseconds)
+        since = since.isoformat(sep=' ', timespec='milliseconds' if since.microsecond else 'seconds')
+        cursor = f'{since}|0|0'
+    if cursor and decode_change_cursor(cursor) is None:
+        return error('Invalid cursor', 400)
+    limit = parse_limit(DEFAULT_LIMIT, MAX_CHANGES_LIMIT)
+    
+    conn = get_db()
+    rows, next_cursor, has_more = fetch_changes(conn, cursor, limit)
+    # The page's rows determine where it ends, so an edit or deletion
+    # inside it moves next_cursor
+    etag = api_etag('changes', cursor, limit, next_cursor, has_more)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    
+    live = [row['id'] for row in rows if not row['deleted']]
+    summaries = {}
+    if live:
+        summary = summarizer()
+        tags = tags_for_tutorials(conn, live)
+        for row in conn.execute(
+            f"SELECT {SUMMARY_COLUMNS} FROM tutorials WHERE id IN ({', '.join('?' * len(live))})", live
+        ):
+            summaries[row['id']] = summary(row, tags[row['id']])
+    
+    changes = []
+    for row in rows:
+        change = {'slug': row['slug'], 'changed_at': row['changed_at'], 'deleted': bool(row['deleted'])}
+        if not row['deleted']:
+            change['tutorial'] = summaries.get(row['id'])
+        changes.append(change)
+    return add_validators(jsonify({'cursor': next_cursor, 'has_more': has_more, 'changes': changes}), etag)
+
+def init_app(app):
+    app.register_blueprint(api)
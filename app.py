@@ -1,8 +1,23 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, g
+import json
 import sqlite3
 import os
-from database import init_db, get_db_connection
-from scraper import scrape_tutorial
+from database import init_db, init_app, get_db, cursor_row_exists, decode_cursor, fetch_tutorials_page, listing_version, LISTING_COLUMNS, NOW_SQL
+from cache import invalidate_listings, invalidate_tutorial, listing_key, tag_key, tutorial_key
+from reading import prepare_content, reading_values
+from sanitizer import sanitize_html
+from search import index_tutorial, search_tutorials
+from taxonomy import fetch_tag_page, get_tag, parse_tags, popular_tags, set_tutorial_tags, suggest_for_tutorial, suggest_tags, tag_cursor_exists, tags_for_tutorials, toc_headings
+from jobs import enqueue_scrape, get_job, list_recent_jobs
+from offline import build_precache_manifest, build_service_worker, fetch_changes, decode_change_cursor
+from images import ImageRejected, image_sources, store_upload, variants_pending
+from content_store import transaction
+import api
+import compression
+import http_cache
+import jobs
+import metrics
+from http_cache import cached_page, is_not_modified, not_modified_response, page_etag, page_response, parse_db_timestamp
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SESSION_SECRET', 'dev-secret-key-change-in-production')
@@ -18,47 +33,172 @@ ALLOWED_DOMAINS = [
     'www.tryhackme.com',
 ]
 
-init_db()
+PAGE_SIZE = 24
+ADMIN_PAGE_SIZE = 50
+FEATURED_LIMIT = 5
+POPULAR_TAGS_LIMIT = 20
+
+def template_image_sources(image_path):
+    sources = image_sources(image_path)
+    if sources is None and variants_pending(image_path):
+        # Keep this render out of the page cache until the resized images exist
+        g.page_incomplete = True
+    return sources
+
+metrics.init_app(app)
+init_app(app)
+http_cache.init_app(app)
+compression.init_app(app)
+api.init_app(app)
+jobs.init_app(app)
+app.jinja_env.globals['image_sources'] = template_image_sources
 
 @app.route('/')
 def index():
-    conn = get_db_connection()
-    tutorials = conn.execute('SELECT * FROM tutorials ORDER BY created_at DESC').fetchall()
-    conn.close()
-    return render_template('index.html', tutorials=tutorials)
+    cursor = request.args.get('cursor')
+    position = decode_cursor(cursor)
+    if cursor and position is None:
+        # Not rendered (or cached) as another copy of the first page
+        return redirect(url_for('index'))
+    key = listing_key(position)
+    response = cached_page(key)
+    if response is not None:
+        return response
+    
+    conn = get_db()
+    
+    # Any insert, edit or delete changes the count and the last change
+    count, changed = listing_version(conn)
+    etag = page_etag('index', key, count, changed)
+    last_modified = parse_db_timestamp(changed)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    # Served, but not stored; see page_response()
+    if position and not cursor_row_exists(conn, position):
+        g.page_incomplete = True
+    tutorials, next_cursor = fetch_tutorials_page(conn, cursor, PAGE_SIZE)
+    featured = []
+    popular = []
+    if not cursor:
+        featured = conn.execute(
+            f'SELECT {LISTING_COLUMNS} FROM tutorials ORDER BY created_at DESC, id DESC LIMIT ?',
+            (FEATURED_LIMIT,)
+        ).fetchall()
+        popular = popular_tags(conn, POPULAR_TAGS_LIMIT)
+    html = render_template('index.html', tutorials=tutorials, featured=featured,
+                           tags=tags_for_tutorials(conn, [tutorial['id'] for tutorial in tutorials]),
+                           popular_tags=popular, cursor=cursor, next_cursor=next_cursor)
+    return page_response(key, html, etag, last_modified)
+
+@app.route('/tag/<slug>')
+def tag(slug):
+    cursor = request.args.get('cursor')
+    position = decode_cursor(cursor)
+    if cursor and position is None:
+        return redirect(url_for('tag', slug=slug))
+    key = tag_key(slug, position)
+    response = cached_page(key)
+    if response is not None:
+        return response
+    
+    conn = get_db()
+    tag = get_tag(conn, slug)
+    if tag is None:
+        flash('Tag not found', 'error')
+        return redirect(url_for('index'))
+    
+    # Tagging and untagging change the count; edits to tagged tutorials
+    # (including their tags) and deletes move the last change
+    changed = listing_version(conn)[1]
+    etag = page_etag('tag', tag['id'], key, tag['tutorial_count'], changed)
+    last_modified = parse_db_timestamp(changed)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    if position and not tag_cursor_exists(conn, tag['id'], position):
+        g.page_incomplete = True
+    tutorials, next_cursor = fetch_tag_page(conn, tag['id'], cursor, PAGE_SIZE)
+    html = render_template('tag.html', tag=tag, tutorials=tutorials,
+                           tags=tags_for_tutorials(conn, [tutorial['id'] for tutorial in tutorials]),
+                           cursor=cursor, next_cursor=next_cursor)
+    return page_response(key, html, etag, last_modified)
 
 @app.route('/tutorial/<slug>')
 def tutorial(slug):
-    conn = get_db_connection()
-    tutorial = conn.execute('SELECT * FROM tutorials WHERE slug = ?', (slug,)).fetchone()
-    conn.close()
+    key = tutorial_key(slug)
+    response = cached_page(key)
+    if response is not None:
+        return response
+    
+    conn = get_db()
+    tutorial = conn.execute(
+        'SELECT id, title, description, slug, image_path, created_at, updated_at FROM tutorials WHERE slug = ?',
+        (slug,)
+    ).fetchone()
     
     if tutorial is None:
         flash('Tutorial not found', 'error')
         return redirect(url_for('index'))
     
-    tutorial_html_path = os.path.join('templates', 'tutorials', tutorial['html_filename'])
+    etag = page_etag('tutorial', tutorial['id'], tutorial['updated_at'])
+    last_modified = parse_db_timestamp(tutorial['updated_at'])
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
     
-    if not os.path.exists(tutorial_html_path):
+    row = conn.execute(
+        'SELECT content, word_count, reading_minutes, toc_json FROM tutorials WHERE id = ?',
+        (tutorial['id'],)
+    ).fetchone()
+    if row is None or row['content'] is None:
         flash('Tutorial content not found', 'error')
         return redirect(url_for('index'))
     
-    return render_template(f'tutorials/{tutorial["html_filename"]}', tutorial=tutorial)
+    html = render_template('tutorial.html', tutorial=tutorial, content=row['content'],
+                           word_count=row['word_count'], reading_minutes=row['reading_minutes'],
+                           toc=json.loads(row['toc_json'] or '[]'),
+                           tags=tags_for_tutorials(conn, [tutorial['id']])[tutorial['id']])
+    return page_response(key, html, etag, last_modified)
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    conn = get_db()
+    try:
+        results, has_more = search_tutorials(conn, query, page)
+    except sqlite3.OperationalError as e:
+        app.logger.warning('Search failed for %r: %s', query, e)
+        results, has_more = [], False
+    
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify({
+            'query': query,
+            'page': page,
+            'has_more': has_more,
+            'results': [
+                dict(result, snippet=str(result['snippet']), url=url_for('tutorial', slug=result['slug']))
+                for result in results
+            ],
+        })
+    
+    return render_template('search.html', query=query, page=page, results=results, has_more=has_more)
 
 @app.route('/secret-admin-panel')
 def admin():
-    conn = get_db_connection()
-    tutorials = conn.execute('SELECT * FROM tutorials ORDER BY created_at DESC').fetchall()
-    conn.close()
-    return render_template('admin.html', tutorials=tutorials)
+    cursor = request.args.get('cursor')
+    conn = get_db()
+    tutorials, next_cursor = fetch_tutorials_page(conn, cursor, ADMIN_PAGE_SIZE)
+    recent_jobs = list_recent_jobs(conn)
+    return render_template('admin.html', tutorials=tutorials, jobs=recent_jobs,
+                           cursor=cursor, next_cursor=next_cursor)
 
 @app.route('/edit/<int:tutorial_id>', methods=['GET', 'POST'])
 def edit(tutorial_id):
-    conn = get_db_connection()
+    conn = get_db()
     
     if request.method == 'POST':
-        from werkzeug.utils import secure_filename
-        
         title = request.form['title']
         description = request.form['description']
         html_content = request.form.get('html_content', '')
@@ -66,7 +206,6 @@ def edit(tutorial_id):
         tutorial = conn.execute('SELECT * FROM tutorials WHERE id = ?', (tutorial_id,)).fetchone()
         
         if not tutorial:
-            conn.close()
             flash('Tutorial not found', 'error')
             return redirect(url_for('admin'))
         
@@ -75,161 +214,120 @@ def edit(tutorial_id):
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename:
-                if tutorial['image_path']:
-                    old_image_path = os.path.join('static', tutorial['image_path'])
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
-                
-                filename = secure_filename(f"{tutorial['slug']}.{file.filename.rsplit('.', 1)[1].lower()}")
-                save_path = os.path.join('static', 'images', 'tutorial_images', filename)
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                file.save(save_path)
-                image_path = f'images/tutorial_images/{filename}'
+                try:
+                    image_path = store_upload(file)
+                except ImageRejected as e:
+                    flash(f'Image not saved: {e}', 'error')
+                    return redirect(url_for('edit', tutorial_id=tutorial_id))
         
-        if html_content:
-            html_file_path = os.path.join('templates', 'tutorials', tutorial['html_filename'])
-            
-            tutorial_template = f"""
-{{% extends "base.html" %}}
-
-{{% block content %}}
-<div class="container my-5">
-    <h1>{{{{ tutorial['title'] }}}}</h1>
-    {{% if tutorial['image_path'] %}}
-    <img src="{{{{ url_for('static', filename=tutorial['image_path']) }}}}" class="img-fluid mb-4" alt="{{{{ tutorial['title'] }}}}">
-    {{% endif %}}
-    <div class="tutorial-content">
-        {html_content}
-    </div>
-    <a href="{{{{ url_for('index') }}}}" class="btn btn-secondary mt-4">Back to Tutorials</a>
-</div>
-{{% endblock %}}
-"""
-            
-            with open(html_file_path, 'w', encoding='utf-8') as f:
-                f.write(tutorial_template)
+        content = sanitize_html(html_content) if html_content else tutorial['content']
+        # Recomputed even when only the description changed, since the excerpt may come from it
+        content, reading = prepare_content(content, description)
         
-        conn.execute('UPDATE tutorials SET title = ?, description = ?, image_path = ? WHERE id = ?',
-                    (title, description, image_path, tutorial_id))
-        conn.commit()
-        conn.close()
+        # The new image is already stored; the old one is released after the commit
+        with transaction(conn) as write:
+            conn.execute(
+                f'''UPDATE tutorials
+                    SET title = ?, description = ?, image_path = ?, content = ?,
+                        excerpt = ?, word_count = ?, reading_minutes = ?, toc_json = ?, updated_at = {NOW_SQL}
+                    WHERE id = ?''',
+                (title, description, image_path, content, *reading_values(reading), tutorial_id)
+            )
+            index_tutorial(conn, tutorial_id, title, description, content, reading['body_text'])
+            if 'tags' in request.form:
+                set_tutorial_tags(conn, tutorial_id, parse_tags(request.form['tags']))
+            if image_path != tutorial['image_path']:
+                write.release_image(tutorial['image_path'])
+        invalidate_tutorial(tutorial['slug'])
         
         flash('Tutorial updated successfully!', 'success')
         return redirect(url_for('admin'))
     
     tutorial = conn.execute('SELECT * FROM tutorials WHERE id = ?', (tutorial_id,)).fetchone()
-    conn.close()
     
     if tutorial is None:
         flash('Tutorial not found', 'error')
         return redirect(url_for('admin'))
     
-    html_content = ''
-    html_file_path = os.path.join('templates', 'tutorials', tutorial['html_filename'])
-    if os.path.exists(html_file_path):
-        with open(html_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            import re
-            match = re.search(r'<div class="tutorial-content">(.*?)</div>\s*<a href=', content, re.DOTALL)
-            if match:
-                html_content = match.group(1).strip()
-    
-    return render_template('edit.html', tutorial=tutorial, html_content=html_content)
+    html_content = tutorial['content'] or ''
+    tags = [tag['name'] for tag in tags_for_tutorials(conn, [tutorial_id])[tutorial_id]]
+    suggested = [name for name in suggest_for_tutorial(tutorial) if name not in tags]
+    
+    return render_template('edit.html', tutorial=tutorial, html_content=html_content,
+                           tags=tags, suggested=suggested)
 
 @app.route('/delete/<int:tutorial_id>', methods=['POST'])
 def delete(tutorial_id):
-    conn = get_db_connection()
+    conn = get_db()
     tutorial = conn.execute('SELECT * FROM tutorials WHERE id = ?', (tutorial_id,)).fetchone()
     
     if tutorial:
-        html_file_path = os.path.join('templates', 'tutorials', tutorial['html_filename'])
-        if os.path.exists(html_file_path):
-            os.remove(html_file_path)
-        
-        if tutorial['image_path']:
-            full_image_path = os.path.join('static', tutorial['image_path'])
-            if os.path.exists(full_image_path):
-                os.remove(full_image_path)
-        
-        conn.execute('DELETE FROM tutorials WHERE id = ?', (tutorial_id,))
-        conn.commit()
+        # Files are removed only once the row is gone; image files are
+        # content-addressed and may be shared with other tutorials
+        with transaction(conn) as write:
+            conn.execute('DELETE FROM tutorials WHERE id = ?', (tutorial_id,))
+            write.release_image(tutorial['image_path'])
+            write.release_template(tutorial['html_filename'])
+        invalidate_tutorial(tutorial['slug'])
         flash('Tutorial deleted successfully!', 'success')
     else:
         flash('Tutorial not found', 'error')
     
-    conn.close()
     return redirect(url_for('admin'))
 
 @app.route('/scrape', methods=['POST'])
 def scrape_url():
     url = request.form.get('url')
+    wants_json = request.accept_mimetypes.best == 'application/json'
     
-    if not url:
-        flash('Please provide a URL', 'error')
+    def reject(message):
+        if wants_json:
+            return jsonify({'error': message}), 400
+        flash(message, 'error')
         return redirect(url_for('admin'))
     
+    if not url:
+        return reject('Please provide a URL')
+    
     from urllib.parse import urlparse
-    import socket
-    import ipaddress
     
-    try:
-        parsed_url = urlparse(url)
-        
-        if parsed_url.scheme not in ['http', 'https']:
-            flash('Invalid URL scheme. Only HTTP and HTTPS URLs are allowed.', 'error')
-            return redirect(url_for('admin'))
-        
-        hostname = parsed_url.hostname
-        if not hostname:
-            flash('Invalid URL format.', 'error')
-            return redirect(url_for('admin'))
-        
-        if hostname.lower() not in ALLOWED_DOMAINS:
-            flash(f'Domain not allowed. Allowed domains: {", ".join(ALLOWED_DOMAINS)}', 'error')
-            return redirect(url_for('admin'))
-        
-        try:
-            addr_info = socket.getaddrinfo(hostname, None)
-        except socket.gaierror:
-            flash('Could not resolve hostname. Please check the URL.', 'error')
-            return redirect(url_for('admin'))
-        
-        validated_ip = None
-        for addr in addr_info:
-            ip_str = addr[4][0]
-            try:
-                ip = ipaddress.ip_address(ip_str)
-                if ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_multicast or ip.is_reserved:
-                    flash('Cannot scrape from private, loopback, or reserved IP addresses.', 'error')
-                    return redirect(url_for('admin'))
-                if validated_ip is None and ip.version == 4:
-                    validated_ip = ip_str
-            except ValueError:
-                flash('Invalid IP address resolved from hostname.', 'error')
-                return redirect(url_for('admin'))
-        
-        if not validated_ip:
-            flash('No valid IPv4 address found for hostname.', 'error')
-            return redirect(url_for('admin'))
-        
-        success = scrape_tutorial(url, pinned_ip=validated_ip)
-        if success:
-            flash(f'Tutorial scraped successfully from {url}!', 'success')
-        else:
-            flash(f'Failed to scrape tutorial from {url}. It may already exist or the content could not be extracted. Check the console for details.', 'error')
-    except Exception as e:
-        flash(f'Error scraping tutorial: {str(e)}', 'error')
+    parsed_url = urlparse(url)
+    
+    if parsed_url.scheme not in ['http', 'https']:
+        return reject('Invalid URL scheme. Only HTTP and HTTPS URLs are allowed.')
+    
+    hostname = parsed_url.hostname
+    if not hostname:
+        return reject('Invalid URL format.')
+    
+    if hostname.lower() not in ALLOWED_DOMAINS:
+        return reject(f'Domain not allowed. Allowed domains: {", ".join(ALLOWED_DOMAINS)}')
     
+    # DNS resolution, IP validation and the scrape itself run on a worker
+    job_id = enqueue_scrape(get_db(), url)
+    
+    if wants_json:
+        return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+    
+    flash(f'Scrape job #{job_id} queued for {url}. Its progress is shown below.', 'success')
     return redirect(url_for('admin'))
 
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = get_job(get_db(), job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['result_slug']:
+        job['tutorial_url'] = url_for('tutorial', slug=job['result_slug'])
+    return jsonify(job)
+
 @app.route('/add-manual', methods=['POST'])
 def add_manual():
     import re
-    from werkzeug.utils import secure_filename
     
     title = request.form.get('title')
     description = request.form.get('description')
-    content = request.form.get('content')
+    content = sanitize_html(request.form.get('content'))
     
     if not title or not description or not content:
         flash('All fields except image are required', 'error')
@@ -241,10 +339,9 @@ def add_manual():
         slug = re.sub(r'[-\s]+', '-', slug).strip('-')
         
         # Check if slug already exists
-        conn = get_db_connection()
+        conn = get_db()
         existing = conn.execute('SELECT id FROM tutorials WHERE slug = ?', (slug,)).fetchone()
         if existing:
-            conn.close()
             flash(f'A tutorial with similar title already exists', 'error')
             return redirect(url_for('admin'))
         
@@ -253,51 +350,68 @@ def add_manual():
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename:
-                filename = secure_filename(f"{slug}.{file.filename.rsplit('.', 1)[1].lower()}")
-                save_path = os.path.join('static', 'images', 'tutorial_images', filename)
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                file.save(save_path)
-                image_path = f'images/tutorial_images/{filename}'
+                image_path = store_upload(file)
         
-        # Create HTML file
-        html_filename = f"{slug}.html"
-        html_path = os.path.join('templates', 'tutorials', html_filename)
-        os.makedirs(os.path.dirname(html_path), exist_ok=True)
-        
-        tutorial_template = f"""
-{{% extends "base.html" %}}
-
-{{% block content %}}
-<div class="container my-5">
-    <h1>{{{{ tutorial['title'] }}}}</h1>
-    {{% if tutorial['image_path'] %}}
-    <img src="{{{{ url_for('static', filename=tutorial['image_path']) }}}}" class="img-fluid mb-4" alt="{{{{ tutorial['title'] }}}}">
-    {{% endif %}}
-    <div class="tutorial-content">
-        {content}
-    </div>
-    <a href="{{{{ url_for('index') }}}}" class="btn btn-secondary mt-4">Back to Tutorials</a>
-</div>
-{{% endblock %}}
-"""
-        
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(tutorial_template)
+        content, reading = prepare_content(content, description)
+        # Suggested from the content unless the form named some
+        tags = parse_tags(request.form.get('tags')) or suggest_tags(
+            title, toc_headings(reading['toc_json']), description, reading['body_text'])
         
         # Insert into database
-        conn.execute(
-            'INSERT INTO tutorials (title, description, slug, image_path, html_filename) VALUES (?, ?, ?, ?, ?)',
-            (title, description, slug, image_path, html_filename)
-        )
-        conn.commit()
-        conn.close()
+        with transaction(conn):
+            cursor = conn.execute(
+                f'''INSERT INTO tutorials (title, description, slug, image_path, html_filename, content,
+                                           excerpt, word_count, reading_minutes, toc_json, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {NOW_SQL})''',
+                (title, description, slug, image_path, '', content, *reading_values(reading))
+            )
+            index_tutorial(conn, cursor.lastrowid, title, description, content, reading['body_text'])
+            set_tutorial_tags(conn, cursor.lastrowid, tags)
+        invalidate_listings()
         
         flash(f'Tutorial "{title}" added successfully!', 'success')
-        
+    
     except Exception as e:
         flash(f'Error adding tutorial: {str(e)}', 'error')
     
     return redirect(url_for('admin'))
 
+@app.route('/offline')
+def offline_page():
+    return render_template('offline.html')
+
+@app.route('/service-worker.js')
+def service_worker():
+    # Served from the root so its scope covers every page
+    response = app.response_class(service_worker_script, mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/changes')
+def changes():
+    cursor = request.args.get('cursor')
+    if cursor and decode_change_cursor(cursor) is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    rows, next_cursor, has_more = fetch_changes(get_db(), cursor)
+    return jsonify({
+        'cursor': next_cursor,
+        'has_more': has_more,
+        'changes': [
+            {
+                'slug': row['slug'],
+                'url': url_for('tutorial', slug=row['slug']),
+                'changed_at': row['changed_at'],
+                'deleted': bool(row['deleted']),
+            }
+            for row in rows
+        ],
+    })
+
+# Built once at startup from the current static files and templates
+service_worker_script = build_service_worker(build_precache_manifest(app))
+
 if __name__ == '__main__':
+    # Other servers (gunicorn) should run `python database.py` before starting
+    init_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,344 @@
+import argparse
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+import content_store
+import images
+from cache import invalidate_tutorial, page_cache
+from database import db_connection, extract_legacy_content, init_db, LEGACY_TEMPLATES_DIR, NOW_SQL
+from html_text import html_to_text
+from reading import prepare_content, reading_values
+from sanitizer import sanitize_html
+from search import index_tutorials
+from taxonomy import set_tutorial_tags, tags_for_tutorials
+
+# Archive layout, read and written front to back so neither side needs to
+# hold the catalogue in memory or seek:
+#   manifest.json            format version and export metadata
+#   tutorials/000001.jsonl   one JSON object per tutorial, BATCH_SIZE per file,
+#                            with its tags and the plain text the search
+#                            index holds
+#   images/<filename>        the image files the tutorials reference
+ARCHIVE_FORMAT = 1
+MANIFEST_NAME = 'manifest.json'
+TUTORIALS_PREFIX = 'tutorials/'
+IMAGES_PREFIX = 'images/'
+BATCH_SIZE = 1000
+# Tutorials handed to a sanitizer process at a time
+SANITIZE_CHUNK_SIZE = 50
+# tarfile compresses streams at level 9, which is several times slower
+# than level 1 for archives only slightly smaller
+GZIP_LEVEL = 1
+
+# Row ids are local to each database, so tutorials are matched on slug
+COLUMNS = ('slug', 'title', 'description', 'image_path', 'created_at', 'updated_at', 'content',
+           'source_url', 'source_etag', 'source_last_modified', 'content_hash', 'checked_at',
+           'excerpt', 'word_count', 'reading_minutes', 'toc_json')
+
+# Image names are used as file names on import, so nothing that could
+# leave the image directory is accepted
+IMAGE_NAME = re.compile(r'[A-Za-z0-9][\w.-]*\Z')
+
+# Dropping pages one slug at a time costs more than emptying the cache
+# once an import touches this many tutorials
+INVALIDATE_ALL_AFTER = 100
+
+# updated_at is set by the importing database so the /changes feed, ETags
+# and offline clients see imported tutorials as new. created_at is kept on
+# update so existing tutorials keep their place in the listing. Rows whose
+# content is identical are left alone and not returned.
+UPSERT_SQL = f'''
+    INSERT INTO tutorials (slug, title, description, image_path, html_filename, created_at, content,
+                           source_url, source_etag, source_last_modified, content_hash, checked_at,
+                           excerpt, word_count, reading_minutes, toc_json, updated_at)
+    VALUES (?, ?, ?, ?, '', COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {NOW_SQL})
+    ON CONFLICT (slug) DO UPDATE SET
+        title = excluded.title,
+        description = excluded.description,
+        image_path = excluded.image_path,
+        content = excluded.content,
+        excerpt = excluded.excerpt,
+        word_count = excluded.word_count,
+        reading_minutes = excluded.reading_minutes,
+        toc_json = excluded.toc_json,
+        source_url = excluded.source_url,
+        source_etag = excluded.source_etag,
+        source_last_modified = excluded.source_last_modified,
+        content_hash = excluded.content_hash,
+        checked_at = excluded.checked_at,
+        updated_at = excluded.updated_at
+    WHERE (tutorials.title, tutorials.description, tutorials.image_path, tutorials.content, tutorials.source_url)
+          IS NOT (excluded.title, excluded.description, excluded.image_path, excluded.content, excluded.source_url)
+    RETURNING id
+'''
+
+class ArchiveError(Exception):
+    pass
+
+def log(message):
+    # stdout may be the archive itself (`export -`)
+    print(message, file=sys.stderr)
+
+def _add_bytes(tar, name, data, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+@contextmanager
+def _archive_writer(path, compress_level=GZIP_LEVEL):
+    compress = path == '-' or path.endswith(('.gz', '.tgz'))
+    with (nullcontext(sys.stdout.buffer) if path == '-' else open(path, 'wb')) as raw:
+        with (gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=compress_level) if compress else nullcontext(raw)) as out:
+            with tarfile.open(fileobj=out, mode='w|') as tar:
+                yield tar
+
+def _archive_reader(path):
+    if path == '-':
+        return tarfile.open(fileobj=sys.stdin.buffer, mode='r|*')
+    return tarfile.open(path, 'r|*')
+
+def _legacy_content(html_filename):
+    path = os.path.join(LEGACY_TEMPLATES_DIR, html_filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return extract_legacy_content(f.read())
+
+def export_catalogue(path, batch_size=BATCH_SIZE, compress_level=GZIP_LEVEL):
+    started = time.perf_counter()
+    mtime = int(time.time())
+    exported = 0
+    # Insertion-ordered set of referenced images
+    image_paths = {}
+    
+    with db_connection() as conn, _archive_writer(path, compress_level) as tar:
+        manifest = {
+            'format': ARCHIVE_FORMAT,
+            'exported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'columns': COLUMNS,
+        }
+        _add_bytes(tar, MANIFEST_NAME, json.dumps(manifest, indent=2).encode('utf-8'), mtime)
+        
+        # One read transaction, so every page comes from the same snapshot
+        # while the app keeps writing
+        conn.execute('BEGIN')
+        last_id = 0
+        part = 0
+        while True:
+            rows = conn.execute(
+                f'''SELECT t.id, t.html_filename, {', '.join('t.' + column for column in COLUMNS)}, f.body AS body_text
+                    FROM tutorials t LEFT JOIN tutorials_fts f ON f.rowid = t.id
+                    WHERE t.id > ? ORDER BY t.id LIMIT ?''',
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            lines = []
+            tags = tags_for_tutorials(conn, [row['id'] for row in rows])
+            for row in rows:
+                record = {column: row[column] for column in COLUMNS}
+                record['tags'] = [tag['name'] for tag in tags[row['id']]]
+                # Saves the importer from extracting the text from the HTML again
+                record['body_text'] = row['body_text']
+                if record['content'] is None and row['html_filename']:
+                    record['content'] = _legacy_content(row['html_filename'])
+                    record['body_text'] = None
+                if record['image_path']:
+                    image_paths[record['image_path']] = None
+                lines.append(json.dumps(record, ensure_ascii=False))
+            part += 1
+            _add_bytes(tar, f'{TUTORIALS_PREFIX}{part:06d}.jsonl', ('\n'.join(lines) + '\n').encode('utf-8'), mtime)
+            exported += len(rows)
+            last_id = rows[-1]['id']
+        conn.rollback()
+        
+        image_count = 0
+        missing = []
+        for image_path in image_paths:
+            full_path = os.path.join('static', image_path)
+            if not os.path.isfile(full_path):
+                missing.append(full_path)
+                continue
+            tar.add(full_path, arcname=IMAGES_PREFIX + os.path.basename(image_path), recursive=False)
+            image_count += 1
+    
+    if missing:
+        log(f"{len(missing)} referenced images are missing and were not exported, e.g. {missing[0]}")
+    log(f"Exported {exported} tutorials and {image_count} images in {time.perf_counter() - started:.1f}s")
+    return exported
+
+def _sanitize_content(content):
+    # An archive is untrusted input like a scraped page: its HTML goes
+    # through the same allowlist before it can be rendered
+    return sanitize_html(content) if content else content
+
+def _upsert_batch(conn, records, counts, written, executor=None):
+    slugs = [record['slug'] for record in records]
+    existing = {row['slug']: row['id'] for row in conn.execute(
+        f"SELECT id, slug FROM tutorials WHERE slug IN ({', '.join('?' * len(slugs))})", slugs
+    )}
+    indexed = []
+    replaced = []
+    contents = [record.get('content') for record in records]
+    if executor is None:
+        sanitized = list(map(_sanitize_content, contents))
+    else:
+        sanitized = list(executor.map(_sanitize_content, contents, chunksize=SANITIZE_CHUNK_SIZE))
+    for record, content in zip(records, sanitized):
+        image_path = record.get('image_path')
+        if image_path:
+            # Images are shipped by file name and stored in this node's image directory
+            image_path = f'{images.IMAGE_URL_PREFIX}/{os.path.basename(image_path)}'
+        body_text = record.get('body_text')
+        if record.get('word_count') is None or content != record.get('content'):
+            # Exported before the reading metadata existed, from a row not yet
+            # backfilled, or changed by the sanitizer
+            content, reading = prepare_content(content, record.get('description'))
+            body_text = reading['body_text']
+        else:
+            reading = record
+        row = conn.execute(UPSERT_SQL, (
+            record['slug'], record['title'], record.get('description'), image_path, record.get('created_at'),
+            content, record.get('source_url'), record.get('source_etag'),
+            record.get('source_last_modified'), record.get('content_hash'), record.get('checked_at'),
+            *reading_values(reading),
+        )).fetchone()
+        if row is None:
+            # Archives written before tags existed have no 'tags' and leave them alone
+            tutorial_id = existing[record['slug']]
+            if 'tags' in record and set_tutorial_tags(conn, tutorial_id, record['tags']):
+                conn.execute(f'UPDATE tutorials SET updated_at = {NOW_SQL} WHERE id = ?', (tutorial_id,))
+                counts['updated'] += 1
+                written.append(record['slug'])
+            else:
+                counts['unchanged'] += 1
+            continue
+        if 'tags' in record:
+            set_tutorial_tags(conn, row['id'], record['tags'])
+        if record['slug'] in existing:
+            counts['updated'] += 1
+            replaced.append(row['id'])
+        else:
+            counts['inserted'] += 1
+        if body_text is None:
+            body_text = html_to_text(content)
+        indexed.append((row['id'], record['title'], record.get('description'), body_text))
+        written.append(record['slug'])
+    index_tutorials(conn, indexed, replaced)
+
+def _store_image(tar, member):
+    # Returns True if a new file was written. Existing files are kept: names
+    # produced by images.store_stream() are content hashes, so an identical
+    # name means an identical image.
+    name = member.name[len(IMAGES_PREFIX):]
+    if not IMAGE_NAME.match(name) or member.size > images.MAX_IMAGE_BYTES:
+        log(f"Skipping image {member.name!r}")
+        return False
+    target = os.path.join(images.IMAGE_DIR, name)
+    try:
+        # Touched like a deduplicated upload, so it is not released or swept
+        # before the import commits (see content_store.py)
+        os.utime(target)
+        return False
+    except FileNotFoundError:
+        pass
+    
+    with content_store.atomic_file(target) as f:
+        shutil.copyfileobj(tar.extractfile(member), f)
+    return True
+
+def import_catalogue(path, batch_size=BATCH_SIZE, workers=None):
+    # Tutorial HTML is sanitized in `workers` processes (default: one per
+    # CPU) while this process reads the archive and writes the database
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    written = []
+    new_images = 0
+    
+    init_db()
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    with db_connection() as conn, _archive_reader(path) as tar, executor or nullcontext():
+        manifest = None
+        # Everything is written in one transaction: a failed import leaves
+        # the catalogue as it was. Other writers wait for the commit.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for member in tar:
+                if member.name == MANIFEST_NAME:
+                    manifest = json.load(tar.extractfile(member))
+                    if manifest.get('format') != ARCHIVE_FORMAT:
+                        raise ArchiveError(f"Unsupported archive format {manifest.get('format')!r}")
+                elif not member.isfile():
+                    continue
+                elif manifest is None:
+                    raise ArchiveError(f'{MANIFEST_NAME} must be the first member of the archive')
+                elif member.name.startswith(TUTORIALS_PREFIX):
+                    records = []
+                    for line in tar.extractfile(member):
+                        if line.strip():
+                            records.append(json.loads(line))
+                        if len(records) >= batch_size:
+                            _upsert_batch(conn, records, counts, written, executor)
+                            records = []
+                    if records:
+                        _upsert_batch(conn, records, counts, written, executor)
+                elif member.name.startswith(IMAGES_PREFIX):
+                    new_images += _store_image(tar, member)
+                else:
+                    log(f"Skipping unknown archive member {member.name!r}")
+            if manifest is None:
+                raise ArchiveError(f'{MANIFEST_NAME} not found; is this a catalogue archive?')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    
+    if len(written) > INVALIDATE_ALL_AFTER:
+        page_cache.clear()
+    else:
+        for slug in written:
+            invalidate_tutorial(slug)
+    
+    log(f"Imported {counts['inserted']} new and {counts['updated']} changed tutorials "
+        f"({counts['unchanged']} unchanged) and {new_images} new images in {time.perf_counter() - started:.1f}s")
+    if new_images and images.PILLOW_AVAILABLE:
+        log("Run `python images.py --variants` to generate resized variants for the new images.")
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move the tutorial catalogue between installations as a single archive.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='write every tutorial and its image to an archive')
+    export_parser.add_argument('path', help='archive to write (.tar.gz or .tgz to compress; - for stdout, gzipped)')
+    import_parser = subparsers.add_parser('import', help='add or update tutorials from an archive, matched on slug')
+    import_parser.add_argument('path', help='archive to read (- for stdin)')
+    export_parser.add_argument('--compress-level', type=int, default=GZIP_LEVEL, choices=range(1, 10),
+                               help=f'gzip level for compressed archives (default {GZIP_LEVEL})')
+    import_parser.add_argument('--workers', type=int, default=None,
+                               help='processes that sanitize tutorial HTML (default: one per CPU)')
+    for command_parser in (export_parser, import_parser):
+        command_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='tutorials per page or insert batch')
+    args = parser.parse_args()
+    
+    try:
+        if args.command == 'export':
+            export_catalogue(args.path, args.batch_size, args.compress_level)
+        else:
+            import_catalogue(args.path, args.batch_size, args.workers)
+    except (ArchiveError, tarfile.TarError, json.JSONDecodeError, KeyError) as e:
+        log(f"Import failed, nothing was changed: {e}" if args.command == 'import' else f"Export failed: {e}")
+        sys.exit(1)
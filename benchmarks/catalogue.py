@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import DEFAULT_WORKDIR
+
+BATCH_SIZE = 5000
+SEED = 1234
+# Part of the file name, so cached catalogues are rebuilt when the schema
+# or generated data changes
+CATALOGUE_VERSION = 3
+
+WORDS = (
+    'nmap scan port service enumeration kerberos ticket kerberoasting hash relay ntlm smb ldap '
+    'active directory domain controller privilege escalation lateral movement pivot tunnel proxy '
+    'chisel socks ssh reverse shell payload metasploit exploit buffer overflow rop shellcode '
+    'firewall ids evasion wireshark packet capture arp spoofing dns poisoning responder mimikatz '
+    'credential dump lsass sam registry persistence scheduled task service account certificate '
+    'adcs template passthecert golden silver ticket delegation constrained unconstrained bloodhound '
+    'sharphound graph acl abuse gpo password spraying brute force hydra hashcat john wordlist '
+    'web application sql injection xss csrf ssrf deserialization upload bypass waf burp proxy '
+    'linux windows kernel suid capability cron docker container escape cloud metadata bucket '
+    'wireless wpa handshake deauth bluetooth vlan hopping snmp community ftp anonymous telnet'
+).split()
+TOPICS = ['Nmap', 'Kerberos', 'NTLM Relay', 'Active Directory', 'Pivoting', 'Privilege Escalation',
+          'Web Exploitation', 'Password Attacks', 'Wireless', 'Post Exploitation', 'Evasion', 'ADCS']
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+def make_body(rng):
+    # Returns (html, plain text, contents); about 2.5 KB of HTML, similar to
+    # scraped posts, with the heading anchors reading.prepare_content() adds
+    from reading import anchor_id
+    html = []
+    text = []
+    toc = []
+    used = set()
+    for section in range(3):
+        heading = sentence(rng, 4).rstrip('.')
+        anchor = anchor_id(heading, used)
+        html.append(f'<h2 id="{anchor}">{heading}</h2>')
+        text.append(heading)
+        toc.append({'level': 2, 'id': anchor, 'text': heading})
+        for _ in range(3):
+            paragraph = ' '.join(sentence(rng, rng.randint(10, 18)) for _ in range(3))
+            html.append(f'<p>{paragraph}</p>')
+            text.append(paragraph)
+        command = f'{rng.choice(WORDS)} -{rng.choice("abcdefgh")} {rng.choice(WORDS)} 10.0.{section}.{rng.randint(1, 254)}'
+        html.append(f'<pre><code>{command}</code></pre>')
+        text.append(command)
+    return '\n'.join(html), '\n'.join(text), toc
+
+def generate(path, size, seed=SEED):
+    # Imported here: benchmarks/routes.py imports this module and must set
+    # DATABASE_PATH before database.py reads it
+    import database
+    import taxonomy
+    from reading import WORDS_PER_MINUTE, make_excerpt
+    
+    rng = random.Random(seed)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    
+    database.DATABASE_PATH = path
+    database.init_db()
+    conn = database.get_db_connection()
+    conn.execute('PRAGMA synchronous=OFF')
+    
+    started = time.perf_counter()
+    # Every suggestable topic exists as a tag; each tutorial gets one to three
+    tag_names = list(taxonomy.TOPICS)
+    conn.executemany('INSERT INTO tags (id, name, slug) VALUES (?, ?, ?)',
+                     [(i + 1, name, taxonomy.tag_slug(name)) for i, name in enumerate(tag_names)])
+    base = datetime(2023, 1, 1)
+    for start in range(0, size, BATCH_SIZE):
+        tutorials = []
+        search_rows = []
+        tag_rows = []
+        for i in range(start, min(start + BATCH_SIZE, size)):
+            # Groups of three rows share a timestamp, as bulk scrapes do,
+            # so pagination has to break ties on id
+            created_at = (base + timedelta(minutes=10 * (i // 3))).strftime('%Y-%m-%d %H:%M:%S')
+            title = f'{rng.choice(TOPICS)} {i}: {sentence(rng, 5).rstrip(".")}'
+            description = sentence(rng, 20)
+            content, body_text, toc = make_body(rng)
+            image_path = f'images/tutorial_images/bench-{i % 50}.jpg' if rng.random() < 0.8 else None
+            word_count = len(body_text.split())
+            tutorials.append((i + 1, title, description, f'synthetic-{i}', image_path, '', created_at, content, created_at,
+                              make_excerpt(description), word_count, max(1, round(word_count / WORDS_PER_MINUTE)),
+                              json.dumps(toc)))
+            search_rows.append((i + 1, title, description, body_text))
+            for tag_id in rng.sample(range(1, len(tag_names) + 1), rng.randint(1, 3)):
+                tag_rows.append((i + 1, tag_id, created_at))
+        conn.executemany(
+            'INSERT INTO tutorials (id, title, description, slug, image_path, html_filename, created_at, content, updated_at, '
+            'excerpt, word_count, reading_minutes, toc_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            tutorials
+        )
+        # The plain text is already known, so skip html_to_text()
+        conn.executemany('INSERT INTO tutorials_fts (rowid, title, description, body) VALUES (?, ?, ?, ?)', search_rows)
+        # The triggers keep tags.tutorial_count
+        conn.executemany('INSERT INTO tutorial_tags (tutorial_id, tag_id, created_at) VALUES (?, ?, ?)', tag_rows)
+        conn.commit()
+    conn.execute("INSERT INTO tutorials_fts (tutorials_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.execute('ANALYZE')
+    conn.close()
+    print(f"Generated {size} tutorials in {path} ({time.perf_counter() - started:.1f}s, "
+          f"{os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+    return path
+
+def catalogue_path(size, workdir=DEFAULT_WORKDIR, seed=SEED):
+    return os.path.join(workdir, f'catalogue-{size}-{seed}-v{CATALOGUE_VERSION}.db')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic tutorial catalogue for benchmarks.')
+    parser.add_argument('--size', type=int, default=10000, help='number of tutorials')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    parser.add_argument('--path', help='database file to write (default: <workdir>/catalogue-<size>-<seed>-v<version>.db)')
+    args = parser.parse_args()
+    
+    os.makedirs(args.workdir, exist_ok=True)
+    generate(args.path or catalogue_path(args.size, args.workdir, args.seed), args.size, args.seed)
@@ -0,0 +1,114 @@
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Catalogues and scratch databases live outside the repository and are
+# reused between runs
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'netpen-bench')
+
+# Metrics compared against a baseline, and whether a higher value is worse
+COMPARED_METRICS = {
+    'p50_ms': True,
+    'p99_ms': True,
+    'throughput_rps': False,
+    'pages_per_second': False,
+    'response_kb': True,
+    'peak_rss_mb': True,
+}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def latency_summary(samples, elapsed):
+    # samples are per-request wall times in seconds; elapsed is the wall time
+    # of the whole scenario, which is what throughput is measured against
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+        'max_ms': round(samples[-1] * 1000, 3) if samples else 0.0,
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def add_output_arguments(parser):
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against a previous --output file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative change counted as a regression by --compare (default 0.2)')
+
+def compare(results, baseline, threshold):
+    # Returns (rows, regressions) for every metric present in both runs
+    rows = []
+    regressions = []
+    for name, metrics in results['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            if metric not in metrics or not before.get(metric):
+                continue
+            change = (metrics[metric] - before[metric]) / before[metric]
+            worse = change > threshold if higher_is_worse else change < -threshold
+            rows.append((name, metric, before[metric], metrics[metric], change, worse))
+            if worse:
+                regressions.append(f'{name} {metric}')
+    return rows, regressions
+
+def print_table(results):
+    metrics = [metric for metric in ('count', 'p50_ms', 'p99_ms', 'throughput_rps', 'pages_per_second', 'response_kb',
+                                       'peak_rss_mb')
+               if any(metric in values for values in results['results'].values())]
+    print(f"{'scenario':<36}" + ''.join(f'{metric:>16}' for metric in metrics))
+    for name, values in results['results'].items():
+        print(f'{name:<36}' + ''.join(f"{values[metric]:>16}" if metric in values else f"{'':>16}" for metric in metrics))
+
+def finish(args, results):
+    # Prints or writes the results and, with --compare, returns a non-zero
+    # exit status if any metric regressed by more than --threshold
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    
+    if not args.compare:
+        return 0
+    with open(args.compare, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    rows, regressions = compare(results, baseline, args.threshold)
+    print(f"\nCompared with {args.compare} (threshold {args.threshold:.0%}):")
+    for name, metric, before, after, change, worse in rows:
+        flag = '  REGRESSION' if worse else ''
+        print(f'  {name:<36} {metric:<16} {before:>10} -> {after:<10} {change:+.1%}{flag}')
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("No regressions")
+    return 0
@@ -0,0 +1,105 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import trafilatura
+from bs4 import BeautifulSoup
+from scraper import extract_page
+
+DEFAULT_FIXTURES = os.path.join(ROOT, 'templates', 'tutorials', '*.html')
+FIXTURE_URL = 'https://www.hackingarticles.in/fixture/'
+
+# The extraction steps scrape_tutorial ran before the single-parse pipeline:
+# trafilatura parses the decoded string twice (metadata, then content) and
+# BeautifulSoup re-parses the bytes for each fallback and the image lookup.
+def legacy_extract(html_content, url):
+    downloaded = html_content.decode('utf-8', errors='ignore')
+    metadata = trafilatura.extract_metadata(downloaded)
+    content_html = trafilatura.extract(
+        downloaded,
+        include_formatting=True,
+        include_links=True,
+        include_images=True,
+        output_format='html',
+        favor_precision=True
+    )
+    if not content_html:
+        soup = BeautifulSoup(html_content, 'html.parser')
+        main_content = soup.find('article') or soup.find('main') or soup.find('div', class_='content')
+        content_html = str(main_content) if main_content else ''
+    if metadata and metadata.title:
+        title_text = metadata.title
+    else:
+        soup = BeautifulSoup(html_content, 'html.parser')
+        title = soup.find('h1')
+        title_text = title.get_text().strip() if title else 'Untitled Tutorial'
+    if metadata and metadata.description:
+        description = metadata.description
+    else:
+        soup = BeautifulSoup(html_content, 'html.parser')
+        description_meta = soup.find('meta', attrs={'name': 'description'})
+        description = description_meta['content'] if description_meta else ''
+    soup = BeautifulSoup(html_content, 'html.parser')
+    img_tag = soup.find('img') or soup.find('meta', property='og:image')
+    img_url = (img_tag.get('src') or img_tag.get('content')) if img_tag else None
+    return {'title': title_text, 'description': description, 'content_html': content_html, 'image_url': img_url}
+
+def time_cpu(func, html_content, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func(html_content, FIXTURE_URL)
+        samples.append(time.process_time() - start)
+    return statistics.median(samples)
+
+def run(paths, repeat):
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            html_content = f.read()
+        # Warm up imports and trafilatura's caches outside the timed runs
+        legacy_extract(html_content, FIXTURE_URL)
+        extract_page(html_content, FIXTURE_URL)
+        before = time_cpu(legacy_extract, html_content, repeat)
+        after = time_cpu(extract_page, html_content, repeat)
+        pages.append({
+            'page': os.path.basename(path),
+            'bytes': len(html_content),
+            'before_ms': round(before * 1000, 2),
+            'after_ms': round(after * 1000, 2),
+            'speedup': round(before / after, 2) if after else None,
+        })
+    total_before = sum(page['before_ms'] for page in pages)
+    total_after = sum(page['after_ms'] for page in pages)
+    return {
+        'repeat': repeat,
+        'pages': pages,
+        'total_before_ms': round(total_before, 2),
+        'total_after_ms': round(total_after, 2),
+        'speedup': round(total_before / total_after, 2) if total_after else None,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-page CPU time of the scrape extraction stage, before and after the single-parse pipeline.')
+    parser.add_argument('paths', nargs='*', help=f'saved HTML pages (default: {os.path.relpath(DEFAULT_FIXTURES, ROOT)})')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per page; the median is reported')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    
+    paths = args.paths or sorted(glob.glob(DEFAULT_FIXTURES))
+    results = run(paths, args.repeat)
+    
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'page':<45} {'bytes':>8} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for page in results['pages']:
+            print(f"{page['page']:<45} {page['bytes']:>8} {page['before_ms']:>10.2f} {page['after_ms']:>10.2f} {page['speedup']:>7.2f}x")
+        print(f"{'total':<45} {'':>8} {results['total_before_ms']:>10.2f} {results['total_after_ms']:>10.2f} {results['speedup']:>7.2f}x")
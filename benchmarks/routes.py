@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import DEFAULT_WORKDIR, add_output_arguments, environment, finish, latency_summary, peak_rss_mb
+from benchmarks.catalogue import SEED, WORDS, catalogue_path
+
+DEFAULT_SIZES = '1000,10000,100000'
+WARMUP_REQUESTS = 10
+
+def build_scenarios(conn, client, size, rng, requests):
+    # Each scenario is a list of (path, headers, expected status) requests
+    slugs = [row[0] for row in conn.execute(
+        'SELECT slug FROM tutorials WHERE id IN (%s)' % ','.join('?' * min(requests, size)),
+        rng.sample(range(1, size + 1), min(requests, size))
+    )]
+    deep = conn.execute(
+        'SELECT created_at, id FROM tutorials ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?',
+        (int(size * 0.9),)
+    ).fetchone()
+    deep_cursor = f'{deep[0]}|{deep[1]}'
+    tag_id, tag_slug, tag_count = conn.execute(
+        'SELECT id, slug, tutorial_count FROM tags ORDER BY tutorial_count DESC LIMIT 1'
+    ).fetchone()
+    deep_tag = conn.execute(
+        '''SELECT created_at, tutorial_id FROM tutorial_tags WHERE tag_id = ?
+           ORDER BY created_at DESC, tutorial_id DESC LIMIT 1 OFFSET ?''',
+        (tag_id, int(tag_count * 0.9))
+    ).fetchone()
+    deep_tag_cursor = f'{deep_tag[0]}|{deep_tag[1]}'
+    etags = {slug: client.get(f'/tutorial/{slug}').headers.get('ETag') for slug in slugs[:20]}
+    
+    def cycle(items):
+        return [items[i % len(items)] for i in range(requests)]
+    
+    return {
+        'index': [('/', {}, 200)] * requests,
+        'index_deep_page': [(f'/?cursor={deep_cursor}', {}, 200)] * requests,
+        'tag': [(f'/tag/{tag_slug}', {}, 200)] * requests,
+        'tag_deep_page': [(f'/tag/{tag_slug}?cursor={deep_tag_cursor}', {}, 200)] * requests,
+        'tutorial': [(f'/tutorial/{slug}', {}, 200) for slug in cycle(slugs)],
+        'tutorial_not_modified': [(f'/tutorial/{slug}', {'If-None-Match': etag}, 304) for slug, etag in cycle(list(etags.items()))],
+        'search': [(f'/search?q={rng.choice(WORDS)}+{rng.choice(WORDS)}', {}, 200) for _ in range(requests)],
+        'search_prefix': [(f'/search?q={rng.choice(WORDS)[:3]}', {}, 200) for _ in range(requests)],
+        'admin': [('/secret-admin-panel', {}, 200)] * requests,
+        'changes': [('/changes?cursor=0|0|0', {}, 200)] * requests,
+        'api_listing': [('/api/v1/tutorials', {}, 200)] * requests,
+        'api_listing_large': [('/api/v1/tutorials?limit=1000', {}, 200)] * requests,
+        'api_tutorial': [(f'/api/v1/tutorials/{slug}', {}, 200) for slug in cycle(slugs)],
+        'api_changes': [('/api/v1/changes?cursor=0|0|0', {}, 200)] * requests,
+    }
+
+def run_scenario(app, requests, concurrency, accept_encoding=None):
+    samples = []
+    sizes = []
+    errors = []
+    lock = threading.Lock()
+    
+    def worker(chunk):
+        client = app.test_client()
+        local = []
+        local_sizes = []
+        for path, headers, expected in chunk:
+            if accept_encoding:
+                headers = dict(headers, **{'Accept-Encoding': accept_encoding})
+            start = time.perf_counter()
+            response = client.get(path, headers=headers)
+            local_sizes.append(len(response.get_data()))
+            local.append(time.perf_counter() - start)
+            if response.status_code != expected:
+                errors.append(f'{path}: {response.status_code}')
+        with lock:
+            samples.extend(local)
+            sizes.extend(local_sizes)
+    
+    warmup = app.test_client()
+    for path, headers, expected in requests[:WARMUP_REQUESTS]:
+        warmup.get(path, headers=headers)
+    
+    chunks = [requests[i::concurrency] for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = latency_summary(samples, time.perf_counter() - started)
+    # Bytes on the wire per response body, which compression changes
+    summary['response_kb'] = round(sum(sizes) / len(sizes) / 1024, 2) if sizes else 0.0
+    if errors:
+        summary['errors'] = len(errors)
+        print(f"  {len(errors)} unexpected responses, e.g. {errors[0]}")
+    return summary
+
+def run_size(size, args):
+    # Runs in its own process (see main) so peak RSS belongs to one catalogue.
+    # The environment must be set before the app modules are imported.
+    os.environ['DATABASE_PATH'] = catalogue_path(size, args.workdir, args.seed)
+    os.environ['PAGE_CACHE_BACKEND'] = args.page_cache
+    page_cache_path = os.path.join(args.workdir, f'page-cache-{os.getpid()}.db')
+    os.environ['PAGE_CACHE_PATH'] = page_cache_path
+    # No scrape workers polling the queue during the timed requests
+    os.environ['SCRAPE_IN_PROCESS_WORKERS'] = '0'
+    os.chdir(ROOT)
+    
+    from app import app
+    from database import get_db_connection
+    
+    conn = get_db_connection()
+    rng = random.Random(args.seed)
+    scenarios = build_scenarios(conn, app.test_client(), size, rng, args.requests)
+    conn.close()
+    
+    results = {}
+    for name, requests in scenarios.items():
+        if args.only and name not in args.only:
+            continue
+        print(f"  {size} tutorials: {name} ({len(requests)} requests, concurrency {args.concurrency})")
+        results[f'{size}/{name}'] = run_scenario(app, requests, args.concurrency, args.accept_encoding)
+    results[f'{size}/process'] = {'peak_rss_mb': peak_rss_mb()}
+    
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(page_cache_path + suffix):
+            os.remove(page_cache_path + suffix)
+    return results
+
+def ensure_catalogue(size, args):
+    path = catalogue_path(size, args.workdir, args.seed)
+    if not os.path.exists(path) or args.regenerate:
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'benchmarks', 'catalogue.py'),
+             '--size', str(size), '--seed', str(args.seed), '--workdir', args.workdir],
+            check=True
+        )
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latency and throughput of the Flask routes over synthetic catalogues.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f'comma-separated catalogue sizes (default {DEFAULT_SIZES})')
+    parser.add_argument('--requests', type=int, default=300, help='timed requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='threads issuing requests, each with its own client')
+    parser.add_argument('--page-cache', default='none', choices=['none', 'memory', 'sqlite'],
+                        help='PAGE_CACHE_BACKEND for the run (default none, which measures rendering)')
+    parser.add_argument('--accept-encoding', default='',
+                        help='Accept-Encoding sent with every request, e.g. "gzip, br" (default none, uncompressed)')
+    parser.add_argument('--only', nargs='*', help='scenario names to run')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    parser.add_argument('--regenerate', action='store_true', help='rebuild the catalogues even if they exist')
+    parser.add_argument('--size-run', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--size-output', help=argparse.SUPPRESS)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    
+    if args.size_run:
+        with open(args.size_output, 'w', encoding='utf-8') as f:
+            json.dump(run_size(args.size_run, args), f)
+        sys.exit(0)
+    
+    results = {}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        ensure_catalogue(size, args)
+        fd, size_output = tempfile.mkstemp(suffix='.json', dir=args.workdir)
+        os.close(fd)
+        try:
+            command = [sys.executable, os.path.abspath(__file__), '--size-run', str(size), '--size-output', size_output,
+                       '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                       '--page-cache', args.page_cache, '--accept-encoding', args.accept_encoding,
+                       '--seed', str(args.seed), '--workdir', args.workdir]
+            if args.only:
+                command += ['--only'] + args.only
+            subprocess.run(command, check=True)
+            with open(size_output, 'r', encoding='utf-8') as f:
+                results.update(json.load(f))
+        finally:
+            os.remove(size_output)
+    
+    sys.exit(finish(args, {
+        'suite': 'routes',
+        'environment': environment(),
+        'params': {
+            'sizes': args.sizes,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'page_cache': args.page_cache,
+            'accept_encoding': args.accept_encoding,
+            'seed': args.seed,
+        },
+        'results': results,
+    }))
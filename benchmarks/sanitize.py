@@ -0,0 +1,124 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import DEFAULT_WORKDIR, add_output_arguments, environment, finish, latency_summary, peak_rss_mb
+from benchmarks.catalogue import SEED, catalogue_path
+
+DEFAULT_FIXTURES = os.path.join(ROOT, 'templates', 'tutorials', '*.html')
+
+# The tag and attribute lists scrape_tutorial passed to bleach.clean()
+# before sanitizer.py, rebuilt on every call
+LEGACY_TAGS = ['p', 'br', 'strong', 'em', 'u', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+               'ul', 'ol', 'li', 'a', 'img', 'code', 'pre', 'blockquote', 'div', 'span', 'table', 'tr', 'td', 'th', 'thead', 'tbody']
+LEGACY_ATTRIBUTES = {'a': ['href', 'title'], 'img': ['src', 'alt', 'title']}
+
+def load_documents(paths):
+    from database import extract_legacy_content
+    documents = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            source = f.read()
+        # Saved tutorial templates hold the body inside the page markup
+        documents.append(extract_legacy_content(source) or source)
+    return documents
+
+def cleaners():
+    import bleach
+    import lxml.html
+    from sanitizer import ALLOWED_ATTRIBUTES, ALLOWED_TAGS, sanitize_html
+    
+    def legacy(html):
+        return bleach.clean(html, tags=LEGACY_TAGS, attributes=LEGACY_ATTRIBUTES, strip=True)
+    
+    result = {'bleach_clean_per_call': legacy, 'shared_cleaner': sanitize_html}
+    try:
+        from lxml_html_clean import Cleaner
+    except ImportError:
+        return result
+    # For reference only: lxml's cleaner is faster but is not meant for
+    # security-sensitive use, and it cannot restrict attributes per tag
+    attributes = set()
+    for names in ALLOWED_ATTRIBUTES.values():
+        attributes.update(names)
+    lxml_cleaner = Cleaner(allow_tags=ALLOWED_TAGS, remove_unknown_tags=False, safe_attrs_only=True,
+                           safe_attrs=frozenset(attributes), page_structure=False)
+    
+    def lxml_clean(html):
+        return lxml.html.tostring(lxml_cleaner.clean_html(lxml.html.fragment_fromstring(html, create_parent='div')),
+                                  encoding='unicode')
+    
+    result['lxml_html_clean'] = lxml_clean
+    return result
+
+def run_documents(documents, repeat):
+    results = {}
+    size = sum(len(document.encode('utf-8')) for document in documents)
+    for name, clean in cleaners().items():
+        for document in documents:
+            clean(document)
+        samples = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for document in documents:
+                start = time.perf_counter()
+                clean(document)
+                samples.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+        summary = latency_summary(samples, elapsed)
+        summary['mb_per_second'] = round(size * repeat / 1024 / 1024 / elapsed, 2)
+        results[f'documents/{name}'] = summary
+        print(f"  {name}: {summary['p50_ms']} ms per document")
+    return results
+
+def run_corpus(worker_counts):
+    # Dry runs, so the shared catalogue is read but never modified
+    from sanitizer import resanitize_corpus
+    results = {}
+    for workers in worker_counts:
+        summary = resanitize_corpus(workers=workers, dry_run=True)
+        results[f'corpus/workers-{workers}'] = {
+            'count': summary['scanned'],
+            'throughput_rps': summary['rows_per_second'],
+            'mb_per_second': summary['mb_per_second'],
+        }
+        print(f"  corpus, {workers} workers: {summary['rows_per_second']} tutorials/s")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the HTML sanitizer, per document and over a whole catalogue.')
+    parser.add_argument('fixtures', nargs='*', help=f'saved HTML pages (default: {os.path.relpath(DEFAULT_FIXTURES, ROOT)})')
+    parser.add_argument('--repeat', type=int, default=10, help='passes over the fixtures per cleaner')
+    parser.add_argument('--size', type=int, default=1000, help='synthetic catalogue size for the corpus sweep (0 skips it)')
+    parser.add_argument('--workers', default=f'1,{os.cpu_count()}', help='comma-separated worker counts for the corpus sweep')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    
+    if args.size:
+        path = catalogue_path(args.size, args.workdir, args.seed)
+        if not os.path.exists(path):
+            from benchmarks.catalogue import generate
+            generate(path, args.size, args.seed)
+        # Read by database.py when sanitizer.py first imports it
+        os.environ['DATABASE_PATH'] = path
+    os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    
+    results = run_documents(load_documents(args.fixtures or sorted(glob.glob(DEFAULT_FIXTURES))), args.repeat)
+    if args.size:
+        results.update(run_corpus(sorted({int(workers) for workers in args.workers.split(',')})))
+    results['process'] = {'peak_rss_mb': peak_rss_mb()}
+    
+    sys.exit(finish(args, {
+        'suite': 'sanitize',
+        'environment': environment(),
+        'params': {'repeat': args.repeat, 'size': args.size, 'workers': args.workers, 'seed': args.seed},
+        'results': results,
+    }))
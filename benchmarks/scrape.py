@@ -0,0 +1,209 @@
+import argparse
+import glob
+import hashlib
+import io
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import DEFAULT_WORKDIR, add_output_arguments, environment, finish, latency_summary, peak_rss_mb
+
+DEFAULT_FIXTURES = os.path.join(ROOT, 'templates', 'tutorials', '*.html')
+IMAGE_COUNT = 20
+
+def make_image(index):
+    try:
+        from PIL import Image
+    except ImportError:
+        # 1x1 PNG when Pillow is not installed
+        return bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                             '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+    output = io.BytesIO()
+    Image.new('RGB', (1200, 600), ((index * 37) % 256, (index * 91) % 256, 160)).save(output, 'PNG')
+    return output.getvalue()
+
+class StubSite:
+    # Serves /page/<n> from the saved fixtures with a unique title per n and
+    # every image pointed at /img/<k>.png, honouring If-None-Match like a
+    # real site. Bumping `revision` changes every page's content.
+    def __init__(self, fixtures, latency):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.revision = 0
+        self.images = [make_image(i) for i in range(IMAGE_COUNT)]
+        site = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.handle(self)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+    
+    def page(self, number):
+        html = self.fixtures[number % len(self.fixtures)]
+        # The title decides the slug, so each page needs its own
+        html = re.sub(r'<title>.*?</title>', '', html, flags=re.S)
+        html = f'<title>Stub tutorial {number}</title>\n{html}'
+        html = re.sub(r'(<h1[^>]*>)(.*?)(</h1>)', lambda m: f'{m.group(1)}{m.group(2)} {number}{m.group(3)}', html, flags=re.S)
+        html = re.sub(r'<img([^>]*?)src="[^"]*"', lambda m: f'<img{m.group(1)}src="/img/{number % IMAGE_COUNT}.png"', html)
+        if self.revision:
+            html = html.replace('</p>', f' Revised in revision {self.revision}.</p>', 1)
+        return html.encode('utf-8')
+    
+    def handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        match = re.fullmatch(r'/page/(\d+)|/img/(\d+)\.png', request.path)
+        if match is None:
+            request.send_response(404)
+            request.end_headers()
+            return
+        if match.group(1):
+            body, content_type = self.page(int(match.group(1))), 'text/html; charset=utf-8'
+        else:
+            body, content_type = self.images[int(match.group(2)) % IMAGE_COUNT], 'image/png'
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        if request.headers.get('If-None-Match') == etag:
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.end_headers()
+            return
+        request.send_response(200)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.send_header('ETag', etag)
+        request.end_headers()
+        request.wfile.write(body)
+
+def run_phase(scraper, items, task, workers, per_host):
+    # Returns (summary, per-stage timings) for one pass over items
+    stages = {}
+    stages_lock = threading.Lock()
+    outcomes = {}
+    
+    def timed(item):
+        timings = {}
+        current = {'stage': None, 'started': time.perf_counter()}
+        
+        def progress(stage):
+            now = time.perf_counter()
+            if current['stage']:
+                timings[current['stage']] = now - current['started']
+            current.update(stage=stage, started=now)
+        
+        try:
+            return task(item, progress)
+        finally:
+            if current['stage']:
+                timings[current['stage']] = time.perf_counter() - current['started']
+            with stages_lock:
+                for stage, seconds in timings.items():
+                    stages.setdefault(stage, []).append(seconds)
+    
+    samples = []
+    started = time.perf_counter()
+    for url, outcome, detail, seconds in scraper._run_per_host(items, timed, workers, per_host):
+        samples.append(seconds)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if outcome == 'failed':
+            print(f"  failed: {url}: {detail}")
+    elapsed = time.perf_counter() - started
+    
+    summary = latency_summary(samples, elapsed)
+    summary['pages_per_second'] = summary.pop('throughput_rps')
+    summary['outcomes'] = outcomes
+    return summary, {stage: latency_summary(values, elapsed) for stage, values in stages.items()}
+
+def run(args):
+    fixtures = []
+    for path in args.fixtures or sorted(glob.glob(DEFAULT_FIXTURES)):
+        with open(path, 'r', encoding='utf-8') as f:
+            fixtures.append(f.read())
+    
+    # The scraper writes the database, page cache and images relative to the
+    # working directory, so run it in a scratch directory
+    scratch = os.path.join(args.workdir, f'scrape-{os.getpid()}')
+    os.makedirs(scratch)
+    os.chdir(scratch)
+    os.environ['DATABASE_PATH'] = os.path.join(scratch, 'tutorials.db')
+    os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    try:
+        import database
+        import scraper
+        database.init_db()
+        
+        site = StubSite(fixtures, args.latency_ms / 1000)
+        items = [(site.url(f'/page/{n}'), site.url(f'/page/{n}')) for n in range(args.pages)]
+        results = {}
+        
+        def scrape(url, progress):
+            return 'scraped', scraper.run_scrape(url, progress=progress)
+        
+        def refresh(url, progress):
+            with database.db_connection() as conn:
+                tutorial = conn.execute(f'SELECT {scraper.SOURCE_COLUMNS} FROM tutorials WHERE source_url = ?', (url,)).fetchone()
+            if tutorial is None:
+                return 'missing', url
+            return scraper.refresh_tutorial(tutorial, progress=progress), url
+        
+        phases = [('scrape', scrape, None), ('refresh_not_modified', refresh, None), ('refresh_changed', refresh, 1)]
+        for name, task, revision in phases:
+            if revision:
+                site.revision = revision
+            print(f"  {name}: {len(items)} pages, {args.workers} workers, {args.per_host} per host, "
+                  f"{args.latency_ms} ms simulated latency")
+            summary, stages = run_phase(scraper, items, task, args.workers, args.per_host)
+            results[name] = summary
+            for stage, stage_summary in stages.items():
+                results[f'{name}/stage/{stage}'] = {key: stage_summary[key] for key in ('count', 'p50_ms', 'p99_ms')}
+        results['process'] = {'peak_rss_mb': peak_rss_mb()}
+        site.server.shutdown()
+        return results
+    finally:
+        # Variants are written relative to the working directory, so let the
+        # background resizes finish before leaving the scratch directory
+        import images
+        if images._executor is not None:
+            images._executor.shutdown(wait=True)
+        os.chdir(ROOT)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput and latency of the scrape pipeline against a local stub site.')
+    parser.add_argument('fixtures', nargs='*', help=f'saved HTML pages (default: {os.path.relpath(DEFAULT_FIXTURES, ROOT)})')
+    parser.add_argument('--pages', type=int, default=60, help='pages to scrape')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--per-host', type=int, default=8, help='the stub is a single host')
+    parser.add_argument('--latency-ms', type=float, default=20, help='delay the stub adds to every response')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    
+    sys.exit(finish(args, {
+        'suite': 'scrape',
+        'environment': environment(),
+        'params': {
+            'pages': args.pages,
+            'workers': args.workers,
+            'per_host': args.per_host,
+            'latency_ms': args.latency_ms,
+            'fixtures': len(args.fixtures) or len(glob.glob(DEFAULT_FIXTURES)),
+        },
+        'results': run(args),
+    }))
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import DEFAULT_WORKDIR, add_output_arguments, environment, finish, latency_summary
+
+# Only needed once a worker scrapes, an admin saves HTML or an image is
+# resized; importing the app must not load them
+DEFERRED_MODULES = ('scraper', 'requests', 'trafilatura', 'lxml', 'bleach', 'html5lib', 'PIL', 'multiprocessing')
+
+def parse_importtime(stderr, module):
+    # Returns (cumulative microseconds of `module`, {direct child: cumulative
+    # microseconds}) from `python -X importtime` output. Lines are written
+    # after each import finishes, so a module's children precede it.
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        cumulative_us, name = line.split('|')[1:3]
+        # One space, then two more per nesting level
+        entries.append(((len(name) - len(name.lstrip()) - 1) // 2, name.strip(), int(cumulative_us)))
+    for index, (level, name, cumulative) in enumerate(entries):
+        if name == module and level == 0:
+            children = {}
+            for child_level, child_name, child_cumulative in reversed(entries[:index]):
+                if child_level == 0:
+                    break
+                if child_level == 1:
+                    children[child_name] = child_cumulative
+            return cumulative, children
+    raise ValueError(f'{module} not found in the importtime output')
+
+def run_import(module, env):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr[-2000:]}')
+    return elapsed, parse_importtime(result.stderr, module)
+
+def loaded_modules(module, env):
+    script = f'import json, sys, {module}; print(json.dumps(sorted(set(name.split(".")[0] for name in sys.modules))))'
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    # The module may print while importing; the list is the last line
+    return set(json.loads(output.splitlines()[-1]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold-start cost of importing the app, per module, in fresh interpreters.')
+    parser.add_argument('--module', default='app', help='module a server process imports')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=12, help='direct imports to list')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    
+    # Importing must not touch the database, so point it at a file that
+    # does not exist and check it still does not afterwards
+    database_path = os.path.join(args.workdir, f'startup-{os.getpid()}.db')
+    env = dict(os.environ, DATABASE_PATH=database_path, PAGE_CACHE_BACKEND='none')
+    
+    interpreter = []
+    process = []
+    imports = []
+    children = {}
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        interpreter.append(time.perf_counter() - started)
+        elapsed, (cumulative, direct) = run_import(args.module, env)
+        process.append(elapsed)
+        imports.append(cumulative / 1e6)
+        for name, value in direct.items():
+            children.setdefault(name, []).append(value / 1e6)
+    
+    loaded = loaded_modules(args.module, env)
+    deferred = sorted(name for name in DEFERRED_MODULES if name in loaded)
+    touched_database = os.path.exists(database_path)
+    
+    results = {
+        f'import_{args.module}': latency_summary(imports, sum(imports)),
+        'process_start': latency_summary(process, sum(process)),
+    }
+    for summary in results.values():
+        # Throughput means nothing here
+        del summary['throughput_rps']
+    
+    # Reported for reference but not compared: it is outside the app's control
+    interpreter_ms = round(sorted(interpreter)[len(interpreter) // 2] * 1000, 3)
+    print(f"Interpreter start alone: {interpreter_ms} ms (median)")
+    print(f"Slowest direct imports of {args.module} (median cumulative ms):")
+    medians = sorted(((sorted(values)[len(values) // 2], name) for name, values in children.items()), reverse=True)
+    for seconds, name in medians[:args.top]:
+        print(f"  {seconds * 1000:8.1f}  {name}")
+    if deferred:
+        print(f"Loaded at import but should be deferred: {', '.join(deferred)}")
+    if touched_database:
+        print(f"Importing {args.module} created {database_path}")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+    
+    status = finish(args, {
+        'suite': 'startup',
+        'environment': environment(),
+        'params': {'module': args.module, 'runs': args.runs},
+        'results': results,
+        'interpreter_ms': interpreter_ms,
+        'modules': {name: round(seconds * 1000, 3) for seconds, name in medians},
+        'deferred_loaded': deferred,
+        'touched_database': touched_database,
+    })
+    sys.exit(status or int(bool(deferred) or touched_database))
@@ -0,0 +1,296 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'sqlite')
+PAGE_CACHE_PATH = os.environ.get('PAGE_CACHE_PATH', os.path.join('data', 'page_cache.db'))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+class LRUCache:
+    def __init__(self, maxsize=256, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        # key -> (value, size in bytes)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key][0]
+    
+    def set(self, key, value):
+        size = self.sizeof(value) if self.maxbytes else 0
+        with self._lock:
+            self._pop(key)
+            # A value bigger than the whole budget would only evict everything else
+            if self.maxbytes and size > self.maxbytes:
+                return
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes and self.nbytes > self.maxbytes):
+                self.nbytes -= self._data.popitem(last=False)[1][1]
+    
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+    
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+    
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                self._pop(key)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+    
+    def __len__(self):
+        return len(self._data)
+
+# Rendered pages are stored as (body bytes, etag, last_modified, version,
+# gzip body, brotli body). `version` is the template version the page was
+# rendered with, so entries left over from before a deploy are ignored
+# rather than served. The compressed bodies are None when not worth storing.
+#
+# Every invalidation bumps a generation number. A request that misses reads
+# the generation before querying the database and passes it to set(), which
+# drops the page if a write was invalidated while it was being rendered, or
+# if the generation could not be read (None).
+
+def _entry_size(entry):
+    return sum(len(body) for body in (entry[0], entry[4], entry[5]) if body) + 128
+
+class MemoryPageCache:
+    # Private to one process: use it only when a single process serves the
+    # site and runs every write path (e.g. `python app.py` with in-process workers).
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self._lru = LRUCache(maxsize=1_000_000, maxbytes=max_bytes, sizeof=_entry_size)
+        self._generation = 0
+        self._lock = threading.Lock()
+    
+    def generation(self):
+        return self._generation
+    
+    def get(self, key):
+        return self._lru.get(key)
+    
+    def set(self, key, entry, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._lru.set(key, entry)
+    
+    def delete(self, key):
+        with self._lock:
+            self._generation += 1
+            self._lru.delete(key)
+    
+    def delete_prefix(self, prefix):
+        with self._lock:
+            self._generation += 1
+            self._lru.delete_prefix(prefix)
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._lru.clear()
+
+class SQLitePageCache:
+    # A separate database file shared by every process on the host, so an
+    # invalidation from a gunicorn worker, jobs.py or scraper.py is seen by all.
+    def __init__(self, path=PAGE_CACHE_PATH, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+    
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # SQLite handles must not cross a fork
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS page_cache (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                version TEXT,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                body_gzip BLOB,
+                body_br BLOB
+            )
+        ''')
+        # Added after the table first shipped; the cache file may predate them
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(page_cache)')}
+        for column in ('body_gzip', 'body_br'):
+            if column not in columns:
+                try:
+                    conn.execute(f'ALTER TABLE page_cache ADD COLUMN {column} BLOB')
+                except sqlite3.OperationalError as e:
+                    # Another process added it first
+                    if 'duplicate column' not in str(e):
+                        raise
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_page_cache_stored_at ON page_cache (stored_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS page_cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO page_cache_meta (name, value) VALUES ('generation', 0)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+    
+    def generation(self):
+        try:
+            return self._connect().execute(
+                "SELECT value FROM page_cache_meta WHERE name = 'generation'"
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Page cache read failed: {e}")
+            return None
+    
+    def get(self, key):
+        try:
+            row = self._connect().execute(
+                'SELECT body, etag, last_modified, version, body_gzip, body_br FROM page_cache WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Page cache read failed: {e}")
+            return None
+        return tuple(row) if row else None
+    
+    def set(self, key, entry, generation):
+        size = _entry_size(entry)
+        if generation is None or size > self.max_bytes:
+            return
+        try:
+            conn = self._connect()
+            # The generation check and the write are one statement, so an
+            # invalidation from another process cannot slip in between
+            conn.execute(
+                'INSERT OR REPLACE INTO page_cache (key, body, etag, last_modified, version, body_gzip, body_br, size, stored_at) '
+                "SELECT ?, ?, ?, ?, ?, ?, ?, ?, ? FROM page_cache_meta WHERE name = 'generation' AND value = ?",
+                (key, entry[0], entry[1], entry[2], entry[3], entry[4], entry[5], size, time.time(), generation)
+            )
+            self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Page cache write failed: {e}")
+    
+    def _evict(self, conn):
+        # Oldest-stored first; tracking reads would turn every hit into a write
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM page_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        for key, size in conn.execute('SELECT key, size FROM page_cache ORDER BY stored_at').fetchall():
+            conn.execute('DELETE FROM page_cache WHERE key = ?', (key,))
+            excess -= size
+            if excess <= 0:
+                break
+    
+    def _invalidate(self, sql, params=()):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(sql, params)
+            conn.execute("UPDATE page_cache_meta SET value = value + 1 WHERE name = 'generation'")
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    
+    def delete(self, key):
+        self._invalidate('DELETE FROM page_cache WHERE key = ?', (key,))
+    
+    def delete_prefix(self, prefix):
+        # Range form of LIKE 'prefix%' that uses the primary key index
+        self._invalidate('DELETE FROM page_cache WHERE key >= ? AND key < ?', (prefix, prefix + '\U0010ffff'))
+    
+    def clear(self):
+        self._invalidate('DELETE FROM page_cache')
+
+class NullPageCache:
+    def generation(self):
+        return 0
+    
+    def get(self, key):
+        return None
+    
+    def set(self, key, entry, generation):
+        pass
+    
+    def delete(self, key):
+        pass
+    
+    def delete_prefix(self, prefix):
+        pass
+    
+    def clear(self):
+        pass
+
+def create_page_cache(backend=PAGE_CACHE_BACKEND):
+    if backend == 'memory':
+        return MemoryPageCache()
+    if backend == 'sqlite':
+        return SQLitePageCache()
+    if backend == 'none':
+        return NullPageCache()
+    raise ValueError(f'Unknown PAGE_CACHE_BACKEND: {backend}')
+
+page_cache = create_page_cache()
+
+# Listing keys take a decoded cursor (see database.decode_cursor), so a
+# query string that does not name a position never reaches the cache
+def _position_key(position):
+    return f'{position[0]}|{position[1]}' if position else ''
+
+def listing_key(position=None):
+    return f'index:{_position_key(position)}'
+
+def tutorial_key(slug):
+    return f'tutorial:{slug}'
+
+def tag_key(slug, position=None):
+    return f'tag:{slug}:{_position_key(position)}'
+
+# Write paths call these after committing. Every listing page (the home
+# page and the tag pages) is dropped, since a new or edited row shifts or
+# changes cards on any of them.
+def invalidate_listings():
+    page_cache.delete_prefix('index:')
+    page_cache.delete_prefix('tag:')
+
+def invalidate_tutorial(slug):
+    page_cache.delete(tutorial_key(slug))
+    invalidate_listings()
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Manage the rendered page cache.')
+    parser.add_argument('--clear', action='store_true', help='drop every cached page')
+    args = parser.parse_args()
+    
+    if not args.clear:
+        parser.print_help()
+    elif PAGE_CACHE_BACKEND != 'sqlite':
+        print(f"The {PAGE_CACHE_BACKEND} page cache lives inside the app process; restart the app to clear it.")
+    else:
+        page_cache.clear()
+        print(f"Cleared the page cache in {PAGE_CACHE_PATH}")
@@ -0,0 +1,252 @@
+import argparse
+import gzip
+import importlib.util
+import mimetypes
+import os
+import threading
+import time
+import zlib
+from flask import current_app, request, send_file
+from werkzeug.security import safe_join
+import content_store
+from metrics import COMPRESSION_SECONDS, RESPONSE_ENCODINGS
+
+# Smaller bodies barely shrink and still cost a compressor
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+# Per request: levels that take about 1 ms on a 40 KB page. Stored variants
+# are written once and served many times, so they are smaller and slower:
+# static files at the maximum, cached pages at what a cache miss can afford.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+PAGE_GZIP_LEVEL = 9
+PAGE_BROTLI_QUALITY = 6
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+# Brotli is optional; without it everything is served as gzip
+BROTLI_AVAILABLE = importlib.util.find_spec('brotli') is not None
+# Preferred first when the client accepts both equally
+ENCODINGS = ('br', 'gzip') if BROTLI_AVAILABLE else ('gzip',)
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Images, fonts and archives are already compressed
+COMPRESSIBLE_TYPES = {'application/javascript', 'application/json', 'application/manifest+json',
+                      'application/xml', 'image/svg+xml'}
+
+_static_variants = {}
+_static_lock = threading.Lock()
+
+def is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+def compress(data, encoding, level=None):
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    # mtime=0 so the same input always gives the same bytes
+    return gzip.compress(data, GZIP_LEVEL if level is None else level, mtime=0)
+
+def compress_variants(data, gzip_level=PAGE_GZIP_LEVEL, brotli_quality=PAGE_BROTLI_QUALITY):
+    # {encoding: compressed body} for each encoding that makes data smaller
+    variants = {}
+    if len(data) < MIN_SIZE:
+        return variants
+    for encoding in ENCODINGS:
+        body = compress(data, encoding, brotli_quality if encoding == 'br' else gzip_level)
+        if len(body) < len(data):
+            variants[encoding] = body
+    return variants
+
+def choose_encoding(available=ENCODINGS):
+    # The encoding the client prefers among those available, or None
+    best = None
+    best_quality = 0
+    for encoding in available:
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def mark_encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # The compressed bytes differ from the page the ETag was computed for,
+    # so it becomes weak; If-None-Match is compared weakly either way
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def use_variant(response, variants, source):
+    # Swaps in a stored compressed body the client accepts, if there is one
+    encoding = choose_encoding([encoding for encoding in ENCODINGS if variants.get(encoding)])
+    if encoding is None:
+        return response
+    response.set_data(variants[encoding])
+    RESPONSE_ENCODINGS.inc(encoding=encoding, source=source)
+    return mark_encoded(response, encoding)
+
+def _compress_stream(chunks, encoding):
+    # Flushed after every chunk, so the client receives each part as it is
+    # produced instead of when the compressor's buffer fills
+    if encoding == 'br':
+        import brotli
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+        
+        def flush():
+            return compressor.flush(zlib.Z_SYNC_FLUSH)
+    
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+            started = time.perf_counter()
+            data = process(chunk) + flush()
+            COMPRESSION_SECONDS.inc(time.perf_counter() - started)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+def compress_response(response):
+    if not is_compressible(response.mimetype):
+        return response
+    # Set even when this response is not compressed, since others for the
+    # same URL may be
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+        RESPONSE_ENCODINGS.inc(encoding=encoding, source='stream')
+        return mark_encoded(response, encoding)
+    
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+    started = time.perf_counter()
+    body = compress(data, encoding)
+    COMPRESSION_SECONDS.inc(time.perf_counter() - started)
+    if len(body) >= len(data):
+        return response
+    response.set_data(body)
+    RESPONSE_ENCODINGS.inc(encoding=encoding, source='dynamic')
+    return mark_encoded(response, encoding)
+
+def precompress_file(path):
+    # Writes <path>.br and <path>.gz unless current ones exist. Returns
+    # {encoding: variant path} for the variants that can be served.
+    mtime_ns = os.stat(path).st_mtime_ns
+    variants = {}
+    data = None
+    for encoding in ENCODINGS:
+        variant = path + SUFFIXES[encoding]
+        try:
+            if os.stat(variant).st_mtime_ns == mtime_ns:
+                variants[encoding] = variant
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        if len(data) < MIN_SIZE:
+            break
+        body = compress(data, encoding, STATIC_BROTLI_QUALITY if encoding == 'br' else STATIC_GZIP_LEVEL)
+        if len(body) < len(data):
+            # A variant is current when its mtime equals the source's
+            content_store.write_file(variant, body, mtime_ns)
+            variants[encoding] = variant
+    return variants
+
+def static_variants(path):
+    # Checked once per process and file version; a changed file is
+    # recompressed on its first request
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    with _static_lock:
+        cached = _static_variants.get(path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        variants = precompress_file(path)
+    except OSError as e:
+        # e.g. a read-only static directory: served uncompressed
+        print(f"Could not precompress {path}: {e}")
+        variants = {}
+    with _static_lock:
+        _static_variants[path] = (mtime_ns, variants)
+    return variants
+
+def serve_static_variant():
+    # Answers static requests with the stored .br/.gz file when the client
+    # accepts one; everything else falls through to Flask's static view
+    if request.endpoint != 'static' or request.method not in ('GET', 'HEAD'):
+        return None
+    filename = request.view_args.get('filename', '')
+    mimetype = mimetypes.guess_type(filename)[0]
+    if not is_compressible(mimetype):
+        return None
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    variants = static_variants(path)
+    encoding = choose_encoding([encoding for encoding in ENCODINGS if encoding in variants])
+    if encoding is None:
+        return None
+    response = send_file(variants[encoding], mimetype=mimetype, conditional=True,
+                         max_age=current_app.get_send_file_max_age(filename))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    RESPONSE_ENCODINGS.inc(encoding=encoding, source='static')
+    return response
+
+def precompress_static(static_folder):
+    # Returns (files, original bytes, {encoding: compressed bytes})
+    files = 0
+    original = 0
+    compressed = dict.fromkeys(ENCODINGS, 0)
+    for directory, _, names in os.walk(static_folder):
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            if os.path.splitext(name)[1] in ('.br', '.gz') or not is_compressible(mimetypes.guess_type(name)[0]):
+                continue
+            variants = precompress_file(path)
+            if not variants:
+                continue
+            files += 1
+            original += os.path.getsize(path)
+            for encoding, variant in variants.items():
+                compressed[encoding] += os.path.getsize(variant)
+    return files, original, compressed
+
+def init_app(app):
+    app.before_request(serve_static_variant)
+    app.after_request(compress_response)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write .br and .gz copies of the compressible static files.')
+    parser.add_argument('--static-folder', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    args = parser.parse_args()
+    
+    start = time.perf_counter()
+    files, original, compressed = precompress_static(args.static_folder)
+    sizes = ', '.join(f"{encoding} {size / 1024:.1f} KB" for encoding, size in compressed.items())
+    print(f"Precompressed {files} files ({original / 1024:.1f} KB; {sizes}) in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,239 @@
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+import images
+from database import db_connection, LEGACY_TEMPLATES_DIR
+
+# Every file the app writes (images, their variants, precompressed static
+# files) goes through atomic_file(): the bytes are written to a temp file in
+# the target's directory, fsynced and renamed over the target, so a reader
+# or a crash sees either the old file or the whole new one.
+#
+# Rows and files are kept in step by ordering rather than by locking:
+#   - a file is stored, durably, before the transaction that references it
+#     commits, so a committed row never points at a file still being written;
+#   - a file a transaction stops referencing is removed only after the
+#     commit (see transaction());
+#   - nothing younger than GRACE_SECONDS is removed, by a release or by the
+#     sweep. Storing an image that already exists touches it, so a writer
+#     between storing a file and committing its row is never raced.
+# A crash or failed transaction leaves at worst an unreferenced file, which
+# collect_garbage() removes.
+GRACE_SECONDS = int(os.environ.get('CONTENT_GRACE_SECONDS', '3600'))
+TEMP_PREFIX = '.tmp-'
+# Temp names used by this module and by older versions (.upload-, .import-
+# and .compress- prefixes, and <target>.<pid>-<thread>.tmp for variants)
+TEMP_PREFIXES = (TEMP_PREFIX, '.upload-', '.import-', '.compress-')
+
+def fsync_directory(directory):
+    # Makes a rename in directory durable. Not every platform can open a
+    # directory, and there the rename is as durable as it gets.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def open_temp(directory):
+    # Returns (file, temp path) for a new file in directory, from where it
+    # can be renamed over its target
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+    return os.fdopen(fd, 'wb'), temp_path
+
+def publish(f, temp_path, path, mtime_ns=None):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.chmod(temp_path, 0o644)
+    if mtime_ns is not None:
+        os.utime(temp_path, ns=(mtime_ns, mtime_ns))
+    os.replace(temp_path, path)
+    fsync_directory(os.path.dirname(path) or '.')
+
+def discard(f, temp_path):
+    f.close()
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+@contextmanager
+def atomic_file(path, mtime_ns=None):
+    # Yields a file for path's new contents; they replace path only if the
+    # block completes
+    f, temp_path = open_temp(os.path.dirname(path) or '.')
+    try:
+        yield f
+        publish(f, temp_path, path, mtime_ns)
+    except BaseException:
+        discard(f, temp_path)
+        raise
+
+def write_file(path, data, mtime_ns=None):
+    with atomic_file(path, mtime_ns) as f:
+        f.write(data)
+
+def is_temp_file(name):
+    return name.startswith(TEMP_PREFIXES) or name.endswith('.tmp')
+
+def _is_stale(path, cutoff):
+    try:
+        return os.stat(path).st_mtime < cutoff
+    except FileNotFoundError:
+        return False
+
+def release_images(conn, image_paths, grace=GRACE_SECONDS):
+    # Removes each image and its variants if no committed row references it
+    # and it was not stored or reused in the last `grace` seconds; anything
+    # kept is left for collect_garbage(). Returns the number released.
+    cutoff = time.time() - grace
+    released = 0
+    for image_path in set(filter(None, image_paths)):
+        if conn.execute('SELECT 1 FROM tutorials WHERE image_path = ? LIMIT 1', (image_path,)).fetchone():
+            continue
+        if not _is_stale(os.path.join('static', image_path), cutoff):
+            continue
+        images.remove_image_files(image_path)
+        released += 1
+    return released
+
+def release_templates(conn, html_filenames):
+    # Legacy template files are never written any more, so no grace applies
+    for html_filename in set(filter(None, html_filenames)):
+        if conn.execute(
+            "SELECT 1 FROM tutorials WHERE html_filename = ? AND html_filename != '' LIMIT 1", (html_filename,)
+        ).fetchone():
+            continue
+        try:
+            os.remove(os.path.join(LEGACY_TEMPLATES_DIR, html_filename))
+        except FileNotFoundError:
+            pass
+
+class ContentWrite:
+    # Files the rows of one transaction stop referencing; see transaction()
+    def __init__(self):
+        self.images = []
+        self.templates = []
+    
+    def release_image(self, image_path):
+        self.images.append(image_path)
+    
+    def release_template(self, html_filename):
+        self.templates.append(html_filename)
+
+@contextmanager
+def transaction(conn):
+    # Commits the block's writes, then removes the files they released. New
+    # files are stored inside the block, before the commit. On an error the
+    # rows roll back and no file is touched.
+    write = ContentWrite()
+    try:
+        yield write
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    release_images(conn, write.images)
+    release_templates(conn, write.templates)
+
+def collect_garbage(conn, grace=GRACE_SECONDS, dry_run=False):
+    # Reconciles the image and legacy template directories with the table:
+    # one scan of each directory against the referenced names, read from the
+    # image_path and html_filename indexes. Only files this module writes are
+    # removed: content-hash images, their variants and temp files, older than
+    # `grace` seconds and unreferenced. Anything else (legacy images and
+    # templates, which double as benchmark fixtures) is only listed. Returns a
+    # dict of counts plus the referenced images whose file is missing and the
+    # unreferenced files that were kept.
+    referenced_images = {row[0] for row in conn.execute(
+        'SELECT DISTINCT image_path FROM tutorials WHERE image_path IS NOT NULL'
+    )}
+    referenced_templates = {row[0] for row in conn.execute(
+        "SELECT DISTINCT html_filename FROM tutorials WHERE html_filename != ''"
+    )}
+    referenced_stems = {os.path.splitext(path)[0] for path in referenced_images}
+    # Names images.store_stream() and generate_variants() produce
+    stored_name = re.compile(
+        r'^(?P<stem>[0-9a-f]{32})(?:-(?:' + '|'.join(images.VARIANTS) + r')\.(?:'
+        + '|'.join(images.VARIANT_FORMATS) + r')|\.(?:' + '|'.join(set(images.CONTENT_TYPES.values())) + r'))$'
+    )
+    cutoff = time.time() - grace
+    stats = {'scanned': 0, 'removed': 0, 'removed_bytes': 0, 'recent': 0, 'missing': [], 'unmanaged': []}
+    present = set()
+    
+    for directory, prefix, referenced in ((images.IMAGE_DIR, images.IMAGE_URL_PREFIX, referenced_images),
+                                          (LEGACY_TEMPLATES_DIR, None, referenced_templates)):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            stats['scanned'] += 1
+            name = f'{prefix}/{entry.name}' if prefix else entry.name
+            if not is_temp_file(entry.name):
+                if name in referenced:
+                    present.add(name)
+                    continue
+                stored = stored_name.match(entry.name) if prefix else None
+                if stored is None:
+                    stats['unmanaged'].append(entry.path)
+                    continue
+                if f"{prefix}/{stored.group('stem')}" in referenced_stems:
+                    continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime >= cutoff:
+                stats['recent'] += 1
+                continue
+            if dry_run:
+                print(f"Would remove {entry.path}")
+            else:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+            stats['removed'] += 1
+            stats['removed_bytes'] += stat.st_size
+    
+    # Referenced images with no file, listed so their rows can be fixed
+    stats['missing'] = sorted(name for name in referenced_images - present
+                              if name.startswith(images.IMAGE_URL_PREFIX + '/'))
+    stats['unmanaged'].sort()
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove stored image files no tutorial references.')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be removed without removing it')
+    parser.add_argument('--grace', type=int, default=GRACE_SECONDS,
+                        help=f'keep files modified in the last GRACE seconds (default {GRACE_SECONDS})')
+    parser.add_argument('--allow-empty', action='store_true',
+                        help='sweep even if the tutorials table is empty (every stored image would be removed)')
+    args = parser.parse_args()
+    
+    start = time.perf_counter()
+    with db_connection() as conn:
+        # An empty table more likely means the wrong DATABASE_PATH than an
+        # empty catalogue
+        if not args.allow_empty and conn.execute('SELECT 1 FROM tutorials LIMIT 1').fetchone() is None:
+            print("The tutorials table is empty; pass --allow-empty to remove every stored image anyway.")
+            sys.exit(1)
+        stats = collect_garbage(conn, args.grace, args.dry_run)
+    
+    action = 'Would remove' if args.dry_run else 'Removed'
+    print(f"{action} {stats['removed']} of {stats['scanned']} files ({stats['removed_bytes'] / 1024:.1f} KB), "
+          f"kept {stats['recent']} recent ones, in {time.perf_counter() - start:.2f}s")
+    for name in stats['missing']:
+        print(f"Referenced but missing: {name}")
+    for path in stats['unmanaged']:
+        print(f"Unreferenced, not written by the store, kept: {path}")
@@ -1,12 +1,42 @@
 import sqlite3
 import os
+import re
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from flask import g
+import metrics
+from html_text import html_to_text
 
-DATABASE_PATH = 'data/tutorials.db'
+DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join('data', 'tutorials.db'))
 
-def init_db():
-    os.makedirs('data', exist_ok=True)
-    
-    conn = sqlite3.connect(DATABASE_PATH)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+STATEMENT_CACHE_SIZE = 256
+
+LEGACY_TEMPLATES_DIR = os.path.join('templates', 'tutorials')
+SEARCH_INDEX_BATCH_SIZE = 500
+
+# Millisecond precision so two saves in the same second still produce
+# distinct versions for anything keyed on updated_at.
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Columns needed to render listing cards and admin rows; keeps the
+# (potentially large) per-tutorial fields out of listing queries.
+LISTING_COLUMNS = 'id, title, description, slug, image_path, created_at, excerpt, reading_minutes'
+
+def _add_columns(cursor, table, columns):
+    existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    for column in columns:
+        if column.split()[0] not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+
+# Migration 1 is the schema as it stood before migrations were versioned.
+# Databases created before then report user_version 0 but may already have
+# any part of it, so every step checks before it creates or adds.
+def _migrate_baseline(conn):
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -17,18 +47,523 @@ def init_db():
             slug TEXT UNIQUE NOT NULL,
             image_path TEXT,
             html_filename TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            content TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            source_url TEXT,
+            source_etag TEXT,
+            source_last_modified TEXT,
+            content_hash TEXT,
+            checked_at TIMESTAMP
+        )
+    ''')
+    
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(tutorials)')}
+    if 'content' not in columns:
+        cursor.execute('ALTER TABLE tutorials ADD COLUMN content TEXT')
+    if 'updated_at' not in columns:
+        cursor.execute('ALTER TABLE tutorials ADD COLUMN updated_at TIMESTAMP')
+        cursor.execute('UPDATE tutorials SET updated_at = created_at')
+    # Where a scraped tutorial came from and the validators and content hash
+    # of the last fetch, so refreshes can use conditional requests
+    _add_columns(cursor, 'tutorials', ('source_url TEXT', 'source_etag TEXT', 'source_last_modified TEXT',
+                                       'content_hash TEXT', 'checked_at TIMESTAMP'))
+    
+    # Backs keyset pagination on (created_at, id) for the listing pages
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tutorials_created_at_id
+        ON tutorials (created_at DESC, id DESC)
+    ''')
+    
+    # Newest-change lookups for HTTP validators and change feeds
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tutorials_updated_at ON tutorials (updated_at)')
+    
+    # Image files are content-addressed and shared, so deletes check for
+    # other references before removing one
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tutorials_image_path ON tutorials (image_path)')
+    
+    # Full-text index over title, description and the plain text of the body.
+    # Rows are written by search.index_tutorial() on the insert/update paths,
+    # since the body text has to be extracted from HTML in Python.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tutorials_fts USING fts5(
+            title,
+            description,
+            body,
+            tokenize = 'porter unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tutorials_fts_delete AFTER DELETE ON tutorials
+        BEGIN
+            DELETE FROM tutorials_fts WHERE rowid = old.id;
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            error TEXT,
+            result_slug TEXT,
+            timings TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scrape_jobs_status_run_after
+        ON scrape_jobs (status, run_after)
+    ''')
+    
+    # Deleted slugs are remembered so offline clients can drop their copies
+    # (see offline.fetch_changes)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tutorial_tombstones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tutorial_id INTEGER NOT NULL,
+            slug TEXT NOT NULL,
+            deleted_at TIMESTAMP NOT NULL
+        )
+    ''')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tutorial_tombstones_deleted_at ON tutorial_tombstones (deleted_at)')
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS tutorials_tombstone AFTER DELETE ON tutorials
+        BEGIN
+            INSERT INTO tutorial_tombstones (tutorial_id, slug, deleted_at) VALUES (old.id, old.slug, {NOW_SQL});
+        END
+    ''')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tutorials_source_url ON tutorials (source_url)')
+    
+    # Tutorials scraped through the job queue before sources were stored
+    cursor.execute('''
+        UPDATE tutorials SET source_url = (
+            SELECT url FROM scrape_jobs
+            WHERE scrape_jobs.result_slug = tutorials.slug AND scrape_jobs.status = 'succeeded'
+            ORDER BY scrape_jobs.id DESC LIMIT 1
         )
+        WHERE source_url IS NULL AND html_filename = ''
     ''')
     
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully!")
+    import_legacy_content(conn)
+
+# Computed from the body when it is saved (see reading.py); rows saved
+# before these existed are filled by `python reading.py --backfill`
+def _migrate_reading_metadata(conn):
+    _add_columns(conn.cursor(), 'tutorials',
+                 ('excerpt TEXT', 'word_count INTEGER', 'reading_minutes INTEGER', 'toc_json TEXT'))
+
+# Tags are normalized into their own table; tutorial_tags carries a copy of
+# tutorials.created_at so a tag's listing pages are one index range scan.
+# Triggers keep that copy, tags.tutorial_count and deletes in step.
+def _migrate_tags(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            slug TEXT UNIQUE NOT NULL,
+            tutorial_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tutorial_tags (
+            tutorial_id INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            PRIMARY KEY (tutorial_id, tag_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tutorial_tags_tag_created_at
+        ON tutorial_tags (tag_id, created_at DESC, tutorial_id DESC)
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tutorial_tags_count_insert AFTER INSERT ON tutorial_tags
+        BEGIN
+            UPDATE tags SET tutorial_count = tutorial_count + 1 WHERE id = new.tag_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tutorial_tags_count_delete AFTER DELETE ON tutorial_tags
+        BEGIN
+            UPDATE tags SET tutorial_count = tutorial_count - 1 WHERE id = old.tag_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tutorials_tags_delete AFTER DELETE ON tutorials
+        BEGIN
+            DELETE FROM tutorial_tags WHERE tutorial_id = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tutorials_tags_created_at AFTER UPDATE OF created_at ON tutorials
+        BEGIN
+            UPDATE tutorial_tags SET created_at = new.created_at WHERE tutorial_id = new.id;
+        END
+    ''')
+
+# content_store.collect_garbage() reads every referenced file name from an
+# index (image_path has one); few rows still name a legacy template file
+def _migrate_legacy_template_index(conn):
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tutorials_html_filename
+        ON tutorials (html_filename) WHERE html_filename != ''
+    ''')
+
+# Migration 1 creates the search index empty, so tutorials already in the
+# database (scraped ones and the legacy content it imports) were not found
+# until `python search.py --rebuild` was run. Indexes every row missing from
+# it, which is all of them on an upgrade and none on a new database.
+def _migrate_search_index(conn):
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            '''SELECT id, title, description, content FROM tutorials
+               WHERE id > ? AND id NOT IN (SELECT rowid FROM tutorials_fts)
+               ORDER BY id LIMIT ?''',
+            (last_id, SEARCH_INDEX_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        conn.executemany(
+            'INSERT INTO tutorials_fts (rowid, title, description, body) VALUES (?, ?, ?, ?)',
+            [(row[0], row[1], row[2] or '', html_to_text(row[3])) for row in rows]
+        )
+        last_id = rows[-1][0]
+
+# Applied in order; a database's position is kept in PRAGMA user_version.
+# Append new migrations, never edit or reorder applied ones.
+MIGRATIONS = [
+    ('tutorials, search index, scrape jobs and tombstones', _migrate_baseline),
+    ('reading metadata columns', _migrate_reading_metadata),
+    ('tags and tutorial_tags', _migrate_tags),
+    ('legacy template file index', _migrate_legacy_template_index),
+    ('search index for existing tutorials', _migrate_search_index),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    # Applies the pending migrations, each in its own transaction together
+    # with the version bump. BEGIN IMMEDIATE takes the write lock before the
+    # version is read, so processes starting at once apply each one once.
+    # Returns the descriptions of the migrations applied.
+    applied = []
+    for version, (description, migration) in enumerate(MIGRATIONS, 1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(description)
+    return applied
+
+def init_db():
+    # Creates the database or brings it up to SCHEMA_VERSION; safe to run at
+    # any time. `python app.py` and `python database.py` run it, and the
+    # connection pool runs it on first use if a deploy skipped that step.
+    os.makedirs(os.path.dirname(DATABASE_PATH) or '.', exist_ok=True)
+    conn = get_db_connection()
+    try:
+        before = schema_version(conn)
+        applied = migrate(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"Database migrated from schema version {before} to {SCHEMA_VERSION}: {'; '.join(applied)}")
+    return applied
+
+def extract_legacy_content(template_source):
+    match = re.search(r'<div class="tutorial-content">(.*?)</div>\s*<a href=', template_source, re.DOTALL)
+    return match.group(1).strip() if match else None
+
+# Tutorials used to be stored as one Jinja template per slug; pull their
+# bodies into the content column so they render through tutorial.html.
+def import_legacy_content(conn):
+    rows = conn.execute(
+        "SELECT id, html_filename FROM tutorials WHERE content IS NULL AND html_filename != ''"
+    ).fetchall()
+    for row in rows:
+        path = os.path.join(LEGACY_TEMPLATES_DIR, row[1])
+        if not os.path.exists(path):
+            print(f"Legacy tutorial file missing: {path}")
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            content = extract_legacy_content(f.read())
+        if content is None:
+            print(f"Could not find tutorial content in {path}")
+            continue
+        conn.execute(
+            f'UPDATE tutorials SET content = ?, updated_at = {NOW_SQL} WHERE id = ?',
+            (content, row[0])
+        )
+
+# Every statement and fetch is counted and timed for /metrics (see metrics.py).
+# conn.execute() goes through cursor(), so both paths are covered.
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.record_query(time.perf_counter() - started)
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.record_query(time.perf_counter() - started)
+    
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            metrics.record_query(time.perf_counter() - started)
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.record_fetch(time.perf_counter() - started)
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            metrics.record_fetch(time.perf_counter() - started)
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.record_fetch(time.perf_counter() - started)
+    
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            metrics.record_fetch(time.perf_counter() - started)
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=InstrumentedConnection
+    )
     conn.row_factory = sqlite3.Row
+    # WAL lets readers proceed while a writer commits; NORMAL sync is
+    # durable across application crashes and much cheaper than FULL in WAL.
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+    
+    def _reset(self):
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._pid = os.getpid()
+        self._schema_checked = False
+    
+    def acquire(self, timeout=BUSY_TIMEOUT_MS / 1000):
+        with self._lock:
+            # SQLite handles must not cross a fork (e.g. gunicorn --preload)
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        
+        if create:
+            try:
+                conn = get_db_connection()
+                self._check_schema(conn)
+                return conn
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('database connection pool exhausted')
+    
+    def _check_schema(self, conn):
+        # Schema setup is not done at import, so the first connection each
+        # process opens makes sure migrations were applied (one PRAGMA read)
+        if self._schema_checked:
+            return
+        if schema_version(conn) < SCHEMA_VERSION:
+            applied = migrate(conn)
+            if applied:
+                print(f"Database was behind; applied migrations: {'; '.join(applied)}")
+        self._schema_checked = True
+    
+    def release(self, conn):
+        if self._pid != os.getpid():
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+    
+    def close_all(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
+pool = ConnectionPool()
+
+@contextmanager
+def db_connection():
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+def get_db():
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+def close_db(e=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+# created_at as SQLite's CURRENT_TIMESTAMP and NOW_SQL write it
+_CURSOR_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?')
+
+def encode_cursor(row):
+    return f"{row['created_at']}|{row['id']}"
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    created_at, sep, tutorial_id = cursor.rpartition('|')
+    if not sep or not _CURSOR_TIMESTAMP.fullmatch(created_at) or not tutorial_id.isdigit():
+        return None
+    return created_at, int(tutorial_id)
+
+def listing_version(conn):
+    # (row count, time of the last change) for validating listing pages.
+    # MAX(updated_at) alone goes back in time when the most recently updated
+    # row is deleted, so the newest tombstone counts as a change too.
+    count, newest, deleted = conn.execute(
+        'SELECT COUNT(*), MAX(updated_at), (SELECT MAX(deleted_at) FROM tutorial_tombstones) FROM tutorials'
+    ).fetchone()
+    return count, max(filter(None, (newest, deleted)), default=None)
+
+def cursor_row_exists(conn, position):
+    # A cursor names the last row of the page before it. Any other position
+    # still pages correctly, but only these are worth caching: there are as
+    # many of them as rows, while anyone can make up new positions.
+    return conn.execute(
+        'SELECT 1 FROM tutorials WHERE id = ? AND created_at = ?', (position[1], position[0])
+    ).fetchone() is not None
+
+# Pages are addressed by the (created_at, id) of the last row seen, so every
+# page is a bounded index range scan no matter how deep the reader goes.
+def fetch_tutorials_page(conn, cursor=None, limit=24, columns=LISTING_COLUMNS):
+    position = decode_cursor(cursor)
+    if position:
+        rows = conn.execute(
+            f'SELECT {columns} FROM tutorials WHERE (created_at, id) < (?, ?) '
+            'ORDER BY created_at DESC, id DESC LIMIT ?',
+            (position[0], position[1], limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f'SELECT {columns} FROM tutorials ORDER BY created_at DESC, id DESC LIMIT ?',
+            (limit + 1,)
+        ).fetchall()
+    
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
 if __name__ == '__main__':
-    init_db()
+    import argparse
+    parser = argparse.ArgumentParser(description='Create the database or apply pending schema migrations.')
+    parser.add_argument('--status', action='store_true', help='show the schema version without migrating')
+    args = parser.parse_args()
+    
+    if args.status:
+        conn = get_db_connection()
+        version = schema_version(conn)
+        conn.close()
+        print(f"{DATABASE_PATH}: schema version {version} of {SCHEMA_VERSION}")
+        for number, (description, _) in enumerate(MIGRATIONS, 1):
+            print(f"  {number} {'applied' if number <= version else 'pending'}  {description}")
+    elif not init_db():
+        print(f"{DATABASE_PATH} is up to date (schema version {SCHEMA_VERSION})")
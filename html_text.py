@@ -0,0 +1,37 @@
+from html.parser import HTMLParser
+
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'template'}
+BLOCK_TAGS = {
+    'p', 'br', 'div', 'li', 'ul', 'ol', 'pre', 'blockquote', 'table', 'tr', 'td', 'th',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'header', 'footer',
+}
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append(' ')
+    
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append(' ')
+    
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+def html_to_text(html):
+    if not html:
+        return ''
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return ' '.join(''.join(parser.parts).split())
@@ -0,0 +1,165 @@
+import glob
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+from flask import current_app, g, make_response, request, session
+import images
+from cache import NullPageCache, page_cache
+from compression import compress_variants, use_variant
+from metrics import CACHE_REQUESTS
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+# Pages may be reused by a shared cache for a minute, then revalidated
+# with If-None-Match / If-Modified-Since, which is answered without rendering.
+PAGE_CACHE_CONTROL = 'public, max-age=60, must-revalidate'
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+def _hash_files(paths):
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        digest.update(path.encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def static_fingerprint(static_folder, filename):
+    path = os.path.join(static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    fingerprint = _hash_files([path])[:12]
+    with _fingerprints_lock:
+        _fingerprints[path] = (mtime, fingerprint)
+    return fingerprint
+
+def parse_db_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def page_etag(*parts):
+    # Every page ETag includes the template version, so a deploy that
+    # changes the markup or an asset it links to invalidates pages whose
+    # data did not change.
+    key = '|'.join(str(part) for part in (current_app.config['TEMPLATE_VERSION'],) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+def is_cacheable():
+    # Flash messages are rendered into the page, so it must not be reused.
+    # Decided before the view runs, as rendering consumes the messages.
+    return g.get('page_cacheable', True)
+
+def is_not_modified(etag, last_modified=None):
+    if not is_cacheable() or request.method not in ('GET', 'HEAD'):
+        return False
+    if request.if_none_match:
+        # Weak comparison, as compressed responses carry the weak form
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def add_validators(response, etag, last_modified=None):
+    if not is_cacheable():
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+    return response
+
+def not_modified_response(etag, last_modified=None):
+    response = current_app.response_class(status=304)
+    return add_validators(response, etag, last_modified)
+
+def cached_page(key):
+    # A stored page (or a 304 for it) served without the database or Jinja
+    if not is_cacheable():
+        CACHE_REQUESTS.inc(cache='page', result='bypass')
+        return None
+    entry = page_cache.get(key)
+    if entry is None or entry[3] != current_app.config['TEMPLATE_VERSION']:
+        CACHE_REQUESTS.inc(cache='page', result='miss' if entry is None else 'stale')
+        # Read before the view queries the database; see cache.py
+        g.page_generation = page_cache.generation()
+        return None
+    CACHE_REQUESTS.inc(cache='page', result='hit')
+    body, etag, last_modified = entry[0], entry[1], entry[2]
+    last_modified = datetime.fromisoformat(last_modified) if last_modified else None
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    response = add_validators(current_app.response_class(body, mimetype='text/html'), etag, last_modified)
+    return use_variant(response, {'gzip': entry[4], 'br': entry[5]}, 'page')
+
+def page_response(key, html, etag, last_modified=None):
+    # Pages flagged page_incomplete are not stored: those whose image
+    # variants are still being generated, so the next request picks up the
+    # resized images, and listing pages at a cursor that names no row (see
+    # database.cursor_row_exists). Stored pages are compressed once here and
+    # every hit serves those bytes.
+    variants = {}
+    if (is_cacheable() and 'page_generation' in g and not g.get('page_incomplete')
+            and not isinstance(page_cache, NullPageCache)):
+        body = html.encode('utf-8')
+        variants = compress_variants(body)
+        page_cache.set(key, (
+            body,
+            etag,
+            last_modified.isoformat() if last_modified else None,
+            current_app.config['TEMPLATE_VERSION'],
+            variants.get('gzip'),
+            variants.get('br'),
+        ), g.page_generation)
+    return use_variant(add_validators(make_response(html), etag, last_modified), variants, 'page')
+
+def init_app(app):
+    # Pages embed the ?v= fingerprints of the assets they link to, so those
+    # count towards the version: a CSS- or JS-only deploy must not keep
+    # serving (or 304ing) pages that point at the old URLs. Tutorial images
+    # are named after their content and are left out.
+    image_dir = os.path.join(app.static_folder, images.IMAGE_URL_PREFIX)
+    asset_files = []
+    for directory, subdirectories, names in os.walk(app.static_folder):
+        # Not even listed: it holds every tutorial image and variant
+        subdirectories[:] = [name for name in subdirectories if os.path.join(directory, name) != image_dir]
+        asset_files.extend(os.path.join(directory, name) for name in names if not name.endswith(('.br', '.gz')))
+    template_files = glob.glob(os.path.join(app.root_path, 'templates', '*.html'))
+    app.config.setdefault('TEMPLATE_VERSION', _hash_files(template_files + asset_files)[:12])
+    
+    @app.before_request
+    def check_pending_flashes():
+        # Reading the session adds Vary: Cookie to the response, which would
+        # stop shared caches from storing static files; without a session
+        # cookie there can be no pending messages
+        if request.endpoint != 'static' and app.config['SESSION_COOKIE_NAME'] in request.cookies:
+            g.page_cacheable = '_flashes' not in session
+    
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        # url_for('static', ...) gains ?v=<content hash>, so every change to a
+        # file produces a new URL and the old one can be cached forever.
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            fingerprint = static_fingerprint(app.static_folder, values['filename'])
+            if fingerprint:
+                values['v'] = fingerprint
+    
+    @app.after_request
+    def cache_static_files(response):
+        if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
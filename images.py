@@ -0,0 +1,227 @@
+import hashlib
+import importlib.util
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+import content_store
+
+# Pillow is optional. It is imported by the first resize, so processes that
+# only serve pages do not load it.
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+IMAGE_DIR = os.path.join('static', 'images', 'tutorial_images')
+IMAGE_URL_PREFIX = 'images/tutorial_images'
+
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/pjpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+
+# Resized copies written next to each original: name -> max width in pixels
+VARIANTS = {'card': 400, 'carousel': 800, 'full': 1600}
+VARIANT_FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}), 'jpg': ('JPEG', {'quality': 82, 'progressive': True, 'optimize': True})}
+
+_executor = None
+_executor_lock = threading.Lock()
+# image path -> {variant: actual width}; originals narrower than a variant
+# are not upscaled, so its width can be smaller than the nominal one
+_variants_ready = {}
+_variants_pending = set()
+
+class ImageRejected(Exception):
+    pass
+
+def image_extension(content_type):
+    if not content_type:
+        return None
+    return CONTENT_TYPES.get(content_type.split(';', 1)[0].strip().lower())
+
+def store_stream(chunks, content_type, max_bytes=MAX_IMAGE_BYTES):
+    # Streams an image to disk under the hash of its bytes, so identical
+    # images downloaded for different tutorials share one file.
+    extension = image_extension(content_type)
+    if extension is None:
+        raise ImageRejected(f'Unsupported image type: {content_type}')
+    
+    digest = hashlib.sha256()
+    size = 0
+    f, temp_path = content_store.open_temp(IMAGE_DIR)
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageRejected(f'Image is larger than {max_bytes} bytes')
+            digest.update(chunk)
+            f.write(chunk)
+        if size == 0:
+            raise ImageRejected('Image is empty')
+        
+        filename = f'{digest.hexdigest()[:32]}.{extension}'
+        final_path = os.path.join(IMAGE_DIR, filename)
+        try:
+            # Already stored: touched, so it is not released or swept before
+            # the row that now references it commits (see content_store.py)
+            os.utime(final_path)
+            content_store.discard(f, temp_path)
+        except FileNotFoundError:
+            content_store.publish(f, temp_path, final_path)
+    except BaseException:
+        content_store.discard(f, temp_path)
+        raise
+    
+    image_path = f'{IMAGE_URL_PREFIX}/{filename}'
+    schedule_variants(image_path)
+    return image_path
+
+def store_upload(file):
+    return store_stream(iter(lambda: file.stream.read(CHUNK_SIZE), b''), file.mimetype)
+
+def variant_path(image_path, variant, extension):
+    stem = os.path.splitext(image_path)[0]
+    return f'{stem}-{variant}.{extension}'
+
+def generate_variants(image_path):
+    if not PILLOW_AVAILABLE:
+        return False
+    from PIL import Image
+    source = os.path.join('static', image_path)
+    try:
+        with Image.open(source) as original:
+            original.load()
+            if original.mode not in ('RGB', 'RGBA'):
+                original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+            widths = {}
+            for variant, width in VARIANTS.items():
+                resized = original.copy()
+                if resized.width > width:
+                    resized.thumbnail((width, width * 10), Image.LANCZOS)
+                widths[variant] = resized.width
+                for extension, (image_format, options) in VARIANT_FORMATS.items():
+                    output = resized
+                    if image_format == 'JPEG' and output.mode == 'RGBA':
+                        output = Image.new('RGB', resized.size, (255, 255, 255))
+                        output.paste(resized, mask=resized.split()[3])
+                    target = os.path.join('static', variant_path(image_path, variant, extension))
+                    with content_store.atomic_file(target) as f:
+                        output.save(f, image_format, **options)
+    except Exception as e:
+        print(f"Could not generate image variants for {image_path}: {e}")
+        return False
+    _variants_ready[image_path] = widths
+    return True
+
+def _generate_pending(image_path):
+    try:
+        return generate_variants(image_path)
+    finally:
+        with _executor_lock:
+            _variants_pending.discard(image_path)
+
+def schedule_variants(image_path):
+    global _executor
+    if not PILLOW_AVAILABLE or has_variants(image_path):
+        return None
+    with _executor_lock:
+        # A deduplicated upload of an image already being processed
+        if image_path in _variants_pending:
+            return None
+        _variants_pending.add(image_path)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-variants')
+    return _executor.submit(_generate_pending, image_path)
+
+def variants_pending(image_path):
+    with _executor_lock:
+        return image_path in _variants_pending
+
+def _read_widths(image_path):
+    # Widths of variants written by another process, from their headers.
+    # Without Pillow they cannot be read and the nominal widths stand in.
+    widths = dict(VARIANTS)
+    if not PILLOW_AVAILABLE:
+        return widths
+    from PIL import Image
+    extension = list(VARIANT_FORMATS)[-1]
+    for variant in VARIANTS:
+        try:
+            with Image.open(os.path.join('static', variant_path(image_path, variant, extension))) as variant_image:
+                widths[variant] = variant_image.width
+        except Exception as e:
+            print(f"Could not read the size of {image_path} variant {variant}: {e}")
+    return widths
+
+def has_variants(image_path):
+    if image_path in _variants_ready:
+        return True
+    # Variants are written all-or-nothing in order; the last one marks completion
+    last_variant = list(VARIANTS)[-1]
+    last_extension = list(VARIANT_FORMATS)[-1]
+    if os.path.exists(os.path.join('static', variant_path(image_path, last_variant, last_extension))):
+        _variants_ready[image_path] = _read_widths(image_path)
+        return True
+    return False
+
+def image_sources(image_path):
+    # srcset strings for templates, or None if the variants are not ready
+    # yet (the template then falls back to the original file).
+    if not image_path or not has_variants(image_path):
+        return None
+    # Variants of a small original share its width; the smallest one is listed
+    variants = {}
+    for variant, width in _variants_ready[image_path].items():
+        variants.setdefault(width, variant)
+    return {
+        extension: ', '.join(
+            f"{url_for('static', filename=variant_path(image_path, variant, extension))} {width}w"
+            for width, variant in variants.items()
+        )
+        for extension in VARIANT_FORMATS
+    }
+
+def image_files(image_path):
+    # The original and every variant, relative to static/
+    return [image_path] + [
+        variant_path(image_path, variant, extension)
+        for variant in VARIANTS for extension in VARIANT_FORMATS
+    ]
+
+def remove_image_files(image_path):
+    # Callers check that nothing references the image first; see
+    # content_store.release_images()
+    _variants_ready.pop(image_path, None)
+    for path in image_files(image_path):
+        try:
+            os.remove(os.path.join('static', path))
+        except FileNotFoundError:
+            pass
+
+if __name__ == '__main__':
+    import argparse
+    from database import db_connection
+    
+    parser = argparse.ArgumentParser(description='Maintain tutorial image variants.')
+    parser.add_argument('--variants', action='store_true', help='generate missing resized variants for every tutorial image')
+    parser.add_argument('--force', action='store_true', help='regenerate variants that already exist')
+    args = parser.parse_args()
+    
+    if not args.variants:
+        parser.print_help()
+    elif not PILLOW_AVAILABLE:
+        print("Pillow is not installed; install it to generate image variants.")
+    else:
+        with db_connection() as conn:
+            image_paths = [row[0] for row in conn.execute(
+                'SELECT DISTINCT image_path FROM tutorials WHERE image_path IS NOT NULL'
+            )]
+        pending = [path for path in image_paths if args.force or not has_variants(path)]
+        generated = sum(1 for path in pending if generate_variants(path))
+        print(f"Generated variants for {generated}/{len(pending)} images ({len(image_paths)} referenced)")
@@ -0,0 +1,268 @@
+import json
+import os
+import threading
+import time
+import traceback
+from urllib.parse import urlparse
+from database import db_connection, NOW_SQL
+
+WORKER_COUNT = int(os.environ.get('SCRAPE_WORKERS', '4'))
+PER_DOMAIN_CONCURRENCY = int(os.environ.get('SCRAPE_PER_DOMAIN_CONCURRENCY', '2'))
+MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 30
+POLL_INTERVAL_SECONDS = 2.0
+# A job still "running" after this long belonged to a worker that died
+STALE_AFTER_SECONDS = 300
+STALE_ERROR = f'Worker stopped responding (no result after {STALE_AFTER_SECONDS}s)'
+STALE_SQL = "status = 'running' AND started_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)"
+# Scraped sources are re-checked this often (0 disables the sweep)
+REFRESH_INTERVAL_HOURS = float(os.environ.get('SOURCE_REFRESH_HOURS', '24'))
+REFRESH_CHECK_SECONDS = 600
+# Set to 0 when the workers run as `python jobs.py` instead of in the web
+# processes
+IN_PROCESS_WORKERS = os.environ.get('SCRAPE_IN_PROCESS_WORKERS', '1') != '0'
+# The refresh sweep runs in `python jobs.py`; set to 1 to also run it in
+# web processes that have no separate worker process
+IN_PROCESS_REFRESH = os.environ.get('SOURCE_REFRESH_IN_PROCESS', '0') == '1'
+
+JOB_COLUMNS = ('id, url, domain, status, stage, attempts, max_attempts, error, result_slug, '
+               'timings, created_at, run_after, started_at, finished_at')
+
+_wakeup = threading.Event()
+_workers_lock = threading.Lock()
+_workers = []
+_workers_pid = None
+
+def enqueue_scrape(conn, url, max_attempts=MAX_ATTEMPTS):
+    domain = urlparse(url).hostname.lower()
+    cursor = conn.execute(
+        f'INSERT INTO scrape_jobs (url, domain, max_attempts, run_after) VALUES (?, ?, ?, {NOW_SQL})',
+        (url, domain, max_attempts)
+    )
+    conn.commit()
+    _wakeup.set()
+    return cursor.lastrowid
+
+def job_to_dict(row):
+    job = dict(row)
+    job['timings'] = json.loads(job['timings']) if job['timings'] else {}
+    return job
+
+def get_job(conn, job_id):
+    row = conn.execute(f'SELECT {JOB_COLUMNS} FROM scrape_jobs WHERE id = ?', (job_id,)).fetchone()
+    return job_to_dict(row) if row else None
+
+def list_recent_jobs(conn, limit=10):
+    rows = conn.execute(f'SELECT {JOB_COLUMNS} FROM scrape_jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+    return [job_to_dict(row) for row in rows]
+
+def claim_next_job(conn):
+    stale_after = f'-{STALE_AFTER_SECONDS} seconds'
+    # An idle queue is seen with a read, so polling workers in every web
+    # process do not take the write lock every few seconds
+    if conn.execute(
+        f"""SELECT 1 FROM scrape_jobs WHERE status = 'queued' AND run_after <= {NOW_SQL}
+            UNION ALL SELECT 1 FROM scrape_jobs WHERE {STALE_SQL} LIMIT 1""",
+        (stale_after,)
+    ).fetchone() is None:
+        return None
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers (in this
+    # process or another gunicorn worker) can never claim the same job.
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # The dead run used up the attempt its claim counted, so a job that
+        # keeps killing its worker fails after max_attempts like any other
+        conn.execute(
+            f"""UPDATE scrape_jobs
+                SET status = 'failed', stage = NULL, error = ?, finished_at = {NOW_SQL}
+                WHERE {STALE_SQL} AND attempts >= max_attempts""",
+            (STALE_ERROR, stale_after)
+        )
+        conn.execute(
+            f"""UPDATE scrape_jobs SET status = 'queued', stage = NULL, error = ?, run_after = {NOW_SQL}
+                WHERE {STALE_SQL}""",
+            (STALE_ERROR, stale_after)
+        )
+        row = conn.execute(
+            f"""SELECT {JOB_COLUMNS} FROM scrape_jobs
+                WHERE status = 'queued' AND run_after <= {NOW_SQL}
+                  AND domain NOT IN (
+                      SELECT domain FROM scrape_jobs WHERE status = 'running'
+                      GROUP BY domain HAVING COUNT(*) >= ?
+                  )
+                ORDER BY run_after, id
+                LIMIT 1""",
+            (PER_DOMAIN_CONCURRENCY,)
+        ).fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        conn.execute(
+            f"""UPDATE scrape_jobs
+                SET status = 'running', stage = 'resolve', attempts = attempts + 1,
+                    error = NULL, started_at = {NOW_SQL}, finished_at = NULL
+                WHERE id = ?""",
+            (row['id'],)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    job = job_to_dict(row)
+    job['attempts'] += 1
+    return job
+
+def run_job(job):
+    # Imported on the first job: scraper.py brings in requests, trafilatura
+    # and lxml, which web processes that never scrape should not load
+    from scraper import ScrapeError, resolve_pinned_ip, run_scrape
+    timings = {}
+    current = {'stage': 'resolve', 'started': time.perf_counter()}
+    
+    def progress(stage):
+        now = time.perf_counter()
+        timings[current['stage']] = round(now - current['started'], 4)
+        current.update(stage=stage, started=now)
+        with db_connection() as conn:
+            conn.execute(
+                'UPDATE scrape_jobs SET stage = ?, timings = ? WHERE id = ?',
+                (stage, json.dumps(timings), job['id'])
+            )
+            conn.commit()
+    
+    try:
+        pinned_ip = resolve_pinned_ip(job['domain'])
+        # Queuing a URL that was already scraped refreshes that tutorial
+        slug = run_scrape(job['url'], pinned_ip=pinned_ip, progress=progress, refresh=True)
+    except Exception as e:
+        timings[current['stage']] = round(time.perf_counter() - current['started'], 4)
+        retryable = e.retryable if isinstance(e, ScrapeError) else True
+        if not isinstance(e, ScrapeError):
+            traceback.print_exc()
+        _fail_job(job, e, timings, retryable)
+        return
+    
+    timings[current['stage']] = round(time.perf_counter() - current['started'], 4)
+    timings['total'] = round(sum(timings.values()), 4)
+    with db_connection() as conn:
+        conn.execute(
+            f"""UPDATE scrape_jobs
+                SET status = 'succeeded', stage = NULL, result_slug = ?, timings = ?, finished_at = {NOW_SQL}
+                WHERE id = ?""",
+            (slug, json.dumps(timings), job['id'])
+        )
+        conn.commit()
+
+def _fail_job(job, error, timings, retryable):
+    message = str(error) or error.__class__.__name__
+    with db_connection() as conn:
+        if retryable and job['attempts'] < job['max_attempts']:
+            delay = BACKOFF_BASE_SECONDS * 2 ** (job['attempts'] - 1)
+            print(f"Scrape job {job['id']} failed ({message}); retrying in {delay}s")
+            conn.execute(
+                f"""UPDATE scrape_jobs
+                    SET status = 'queued', stage = NULL, error = ?, timings = ?,
+                        run_after = strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+                    WHERE id = ?""",
+                (message, json.dumps(timings), f'+{delay} seconds', job['id'])
+            )
+        else:
+            print(f"Scrape job {job['id']} failed: {message}")
+            conn.execute(
+                f"""UPDATE scrape_jobs
+                    SET status = 'failed', error = ?, timings = ?, finished_at = {NOW_SQL}
+                    WHERE id = ?""",
+                (message, json.dumps(timings), job['id'])
+            )
+        conn.commit()
+
+def worker_loop(stop_event=None):
+    while stop_event is None or not stop_event.is_set():
+        try:
+            with db_connection() as conn:
+                job = claim_next_job(conn)
+        except Exception as e:
+            print(f"Scrape worker could not claim a job: {e}")
+            job = None
+        
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL_SECONDS)
+            _wakeup.clear()
+            continue
+        
+        run_job(job)
+
+def sources_due(conn, older_than_hours=REFRESH_INTERVAL_HOURS):
+    return conn.execute(
+        """SELECT 1 FROM tutorials
+           WHERE source_url IS NOT NULL
+             AND (checked_at IS NULL OR checked_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?))
+           LIMIT 1""",
+        (f'-{older_than_hours} hours',)
+    ).fetchone() is not None
+
+def refresh_loop(stop_event=None):
+    # Each pass only re-checks sources not checked within the interval, and
+    # rows are claimed one by one, so several processes can run this loop.
+    while stop_event is None or not stop_event.is_set():
+        try:
+            with db_connection() as conn:
+                due = sources_due(conn)
+            if due:
+                # Imported only when there is work; see run_job()
+                from scraper import refresh_sources
+                refresh_sources(workers=WORKER_COUNT, per_host=PER_DOMAIN_CONCURRENCY, pin=True,
+                                older_than_hours=REFRESH_INTERVAL_HOURS)
+        except Exception:
+            traceback.print_exc()
+        if stop_event is None:
+            time.sleep(REFRESH_CHECK_SECONDS)
+        else:
+            stop_event.wait(REFRESH_CHECK_SECONDS)
+
+def start_workers(count=WORKER_COUNT, refresh=REFRESH_INTERVAL_HOURS > 0):
+    global _workers_pid
+    # Called on every request (see init_app); the lock is only taken to start
+    if _workers_pid == os.getpid() and any(worker.is_alive() for worker in _workers):
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid() and any(worker.is_alive() for worker in _workers):
+            return
+        _workers.clear()
+        _workers_pid = os.getpid()
+        for i in range(count):
+            worker = threading.Thread(target=worker_loop, name=f'scrape-worker-{i}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+        if refresh:
+            refresher = threading.Thread(target=refresh_loop, name='source-refresher', daemon=True)
+            refresher.start()
+            _workers.append(refresher)
+
+def init_app(app):
+    # Every web process runs its own job workers. They start on the
+    # process's first request rather than at import, so a gunicorn master
+    # that preloads the app forks no dead threads and each worker starts its
+    # own. They load the scraper only once they claim a job.
+    if not IN_PROCESS_WORKERS:
+        return
+    
+    @app.before_request
+    def ensure_workers():
+        start_workers(refresh=IN_PROCESS_REFRESH and REFRESH_INTERVAL_HOURS > 0)
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Run scrape job workers in the foreground.')
+    parser.add_argument('--workers', type=int, default=WORKER_COUNT)
+    parser.add_argument('--no-refresh', action='store_true', help='do not run the periodic source refresh sweep')
+    args = parser.parse_args()
+    
+    print(f"Starting {args.workers} scrape worker(s)...")
+    start_workers(args.workers, refresh=REFRESH_INTERVAL_HOURS > 0 and not args.no_refresh)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("Stopping scrape workers")
@@ -0,0 +1,326 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import Response, abort, before_render_template, g, request, template_rendered
+
+# Profiling is off unless a token is configured; admins send it in the
+# X-Profile header to sample a single request.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join('data', 'profiles'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry = []
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # label values -> [per-bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+    
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# Metrics are kept per process: with several server workers, each one
+# exposes its own numbers and Prometheus sums them by instance.
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to handle a request, by endpoint.',
+    ('endpoint', 'method', 'status')
+)
+REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Database statements executed per request.',
+    ('endpoint',), COUNT_BUCKETS
+)
+REQUEST_DB_SECONDS = Histogram(
+    'http_request_db_seconds', 'Time spent in the database per request.',
+    ('endpoint',)
+)
+DB_QUERIES = Counter('db_queries_total', 'Database statements executed, in and out of requests.')
+DB_SECONDS = Counter('db_query_seconds_total', 'Time spent executing statements and fetching rows.')
+TEMPLATE_SECONDS = Histogram(
+    'template_render_duration_seconds', 'Time to render a Jinja template.',
+    ('template',)
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by outcome (hit, miss, stale or bypass).',
+    ('cache', 'result')
+)
+RESPONSE_ENCODINGS = Counter(
+    'http_response_encodings_total',
+    'Compressed responses by encoding and body source (static file, page cache, per request or streamed).',
+    ('encoding', 'source')
+)
+COMPRESSION_SECONDS = Counter('http_compression_seconds_total', 'Time spent compressing response bodies while serving requests.')
+SCRAPE_STAGE_SECONDS = Histogram(
+    'scrape_stage_duration_seconds', 'Time spent in each scraper stage.',
+    ('operation', 'stage'), STAGE_BUCKETS
+)
+SCRAPE_RESULTS = Counter(
+    'scrape_results_total', 'Scrapes and refreshes by outcome.',
+    ('operation', 'result')
+)
+
+# Database time is attributed to whatever request the thread is serving;
+# database.py reports every statement and fetch here. Inside a request the
+# totals are kept per thread and added to the counters once at the end.
+_local = threading.local()
+
+def record_query(seconds, statements=1):
+    stats = getattr(_local, 'request_stats', None)
+    if stats is None:
+        DB_QUERIES.inc(statements)
+        DB_SECONDS.inc(seconds)
+        return
+    stats[0] += statements
+    stats[1] += seconds
+
+def record_fetch(seconds):
+    record_query(seconds, 0)
+
+@contextmanager
+def timed_stages(operation, progress=None):
+    # Yields a report(stage) callback: each call ends the previous stage, and
+    # the last one ends when the block exits. `progress` still gets every stage.
+    current = {'stage': None, 'started': 0.0}
+    
+    def finish_stage(now):
+        if current['stage']:
+            SCRAPE_STAGE_SECONDS.observe(now - current['started'], operation=operation, stage=current['stage'])
+    
+    def report(stage):
+        now = time.perf_counter()
+        finish_stage(now)
+        current.update(stage=stage, started=now)
+        if progress:
+            progress(stage)
+    
+    try:
+        yield report
+    finally:
+        finish_stage(time.perf_counter())
+
+class SamplingProfiler:
+    # Samples one thread's stack every `interval` seconds from a helper
+    # thread and counts identical stacks, in the folded format flame graph
+    # tools read ("outer;inner;leaf count").
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='request-profiler')
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+    
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+def _wants_profile():
+    return bool(PROFILE_TOKEN) and request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN
+
+def _save_profile(profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    endpoint = (request.endpoint or 'unmatched').replace('.', '-')
+    filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{endpoint}.folded"
+    with open(os.path.join(PROFILE_DIR, filename), 'w', encoding='utf-8') as f:
+        f.write(profiler.folded())
+    return filename
+
+def _finish_request_stats():
+    stats = getattr(_local, 'request_stats', None)
+    _local.request_stats = None
+    if stats is not None:
+        DB_QUERIES.inc(stats[0])
+        DB_SECONDS.inc(stats[1])
+    return stats
+
+def init_app(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        _local.request_stats = [0, 0.0]
+        if _wants_profile():
+            g.profiler = SamplingProfiler(threading.get_ident())
+            g.profiler.start()
+    
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        stats = _finish_request_stats()
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                method=request.method, status=str(response.status_code))
+        if stats is not None:
+            REQUEST_DB_QUERIES.observe(stats[0], endpoint=endpoint)
+            REQUEST_DB_SECONDS.observe(stats[1], endpoint=endpoint)
+        
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            response.headers['X-Profile-Samples'] = str(profiler.samples)
+            response.headers['X-Profile-File'] = _save_profile(profiler)
+        return response
+    
+    @app.teardown_request
+    def stop_profiler(e=None):
+        # after_request does not run when a request fails before a response
+        _finish_request_stats()
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+    
+    # render_template() fires both signals on the rendering thread
+    def start_render(sender, template, context, **extra):
+        stack = getattr(_local, 'renders', None)
+        if stack is None:
+            stack = _local.renders = []
+        stack.append(time.perf_counter())
+    
+    def finish_render(sender, template, context, **extra):
+        stack = getattr(_local, 'renders', None)
+        if stack:
+            TEMPLATE_SECONDS.observe(time.perf_counter() - stack.pop(), template=template.name or 'string')
+    
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(finish_render, app, weak=False)
+    
+    @app.route('/metrics')
+    def metrics():
+        if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            abort(401)
+        response = Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarise a folded profile written by an X-Profile request.')
+    parser.add_argument('path')
+    parser.add_argument('--top', type=int, default=20, help='functions to list')
+    args = parser.parse_args()
+    
+    # Self time is the leaf of each sampled stack; total time counts a
+    # function once per stack it appears in
+    self_counts = {}
+    total_counts = {}
+    samples = 0
+    with open(args.path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            count = int(count)
+            frames = [frame.rsplit(':', 1)[0] for frame in stack.split(';')]
+            samples += count
+            self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+            for frame in set(frames):
+                total_counts[frame] = total_counts.get(frame, 0) + count
+    print(f"{samples} samples")
+    print(f"{'self':>7} {'total':>7}  function")
+    for frame, count in sorted(self_counts.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{count / samples:>7.1%} {total_counts[frame] / samples:>7.1%}  {frame}')
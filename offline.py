@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+from flask import url_for
+from http_cache import static_fingerprint
+
+SERVICE_WORKER_SOURCE = os.path.join('static', 'js', 'service-worker.js')
+
+# Files installed with the service worker; every other asset and page is
+# cached at runtime as it is visited.
+PRECACHE_STATIC_FILES = [
+    'css/style.css',
+    'manifest.json',
+    'images/icons/icon-192x192.png',
+    'images/icons/icon-512x512.png',
+]
+# Pinned CDN URLs never change content, so the URL itself is the revision
+PRECACHE_EXTERNAL_URLS = [
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+]
+
+CHANGES_LIMIT = 100
+
+def build_precache_manifest(app):
+    entries = []
+    with app.test_request_context():
+        for filename in PRECACHE_STATIC_FILES:
+            revision = static_fingerprint(app.static_folder, filename)
+            if revision is None:
+                print(f"Precache file missing: {filename}")
+                continue
+            entries.append({'url': url_for('static', filename=filename), 'revision': revision})
+        entries.append({'url': url_for('offline_page'), 'revision': app.config['TEMPLATE_VERSION']})
+    entries.extend({'url': url, 'revision': url} for url in PRECACHE_EXTERNAL_URLS)
+    
+    version = hashlib.sha1(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return {'version': version, 'entries': entries}
+
+def build_service_worker(manifest):
+    # The manifest is inlined so that any asset or template change alters the
+    # script bytes, which is what makes browsers install the new worker.
+    with open(SERVICE_WORKER_SOURCE, 'r', encoding='utf-8') as f:
+        source = f.read()
+    return f'const PRECACHE_MANIFEST = {json.dumps(manifest)};\n\n{source}'
+
+def encode_change_cursor(row):
+    return f"{row['changed_at']}|{row['deleted']}|{row['id']}"
+
+def decode_change_cursor(cursor):
+    if not cursor:
+        return None
+    parts = cursor.rsplit('|', 2)
+    if len(parts) != 3 or not parts[0] or parts[1] not in ('0', '1') or not parts[2].isdigit():
+        return None
+    return parts[0], int(parts[1]), int(parts[2])
+
+CHANGES_SQL = '''
+    SELECT id, slug, changed_at, deleted FROM (
+        SELECT id, slug, updated_at AS changed_at, 0 AS deleted FROM tutorials WHERE updated_at >= ?
+        UNION ALL
+        SELECT id, slug, deleted_at, 1 FROM tutorial_tombstones WHERE deleted_at >= ?
+    )
+'''
+
+def fetch_changes(conn, cursor=None, limit=CHANGES_LIMIT):
+    # Edits and deletions in the order they happened, resuming after the
+    # (changed_at, deleted, id) of the last change the client has seen.
+    # Without a cursor only the current position is returned, so a new
+    # client starts from now instead of downloading the whole catalogue.
+    position = decode_change_cursor(cursor)
+    if position is None:
+        newest = conn.execute(CHANGES_SQL + 'ORDER BY changed_at DESC, deleted DESC, id DESC LIMIT 1', ('', '')).fetchone()
+        if newest is None:
+            return [], '0|0|0', False
+        return [], encode_change_cursor(newest), False
+    
+    rows = conn.execute(
+        CHANGES_SQL + '''
+        WHERE (changed_at, deleted, id) > (?, ?, ?)
+        ORDER BY changed_at, deleted, id
+        LIMIT ?''',
+        (position[0], position[0], position[0], position[1], position[2], limit + 1)
+    ).fetchall()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_change_cursor(rows[-1]) if rows else cursor
+    return rows, next_cursor, has_more
@@ -0,0 +1,128 @@
+import argparse
+import json
+import re
+import time
+from cache import page_cache
+from database import db_connection, NOW_SQL
+from html_text import html_to_text
+
+EXCERPT_LENGTH = 200
+WORDS_PER_MINUTE = 200
+# Headings listed in the table of contents; h1 is normally the title again
+TOC_LEVELS = ('h2', 'h3', 'h4')
+BACKFILL_BATCH_SIZE = 500
+
+# Bleach re-serializes everything it keeps, so stored headings are always
+# well-formed <hN ...>...</hN> with double-quoted attributes
+HEADING = re.compile(r'<(h[1-6])\b([^>]*)>(.*?)</\1>', re.S)
+ID_ATTRIBUTE = re.compile(r'\s+id="[^"]*"')
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    text = ' '.join((text or '').split())
+    if len(text) <= length:
+        return text
+    # Cut at the last whole word that fits
+    cut = text[:length + 1].rsplit(' ', 1)[0][:length]
+    return cut.rstrip(' ,.;:-') + '…'
+
+def anchor_id(text, used):
+    anchor = re.sub(r'[^\w\s-]', '', text.lower())
+    anchor = re.sub(r'[-\s]+', '-', anchor).strip('-') or 'section'
+    candidate = anchor
+    number = 2
+    while candidate in used:
+        candidate = f'{anchor}-{number}'
+        number += 1
+    used.add(candidate)
+    return candidate
+
+def add_heading_anchors(html):
+    # Returns (html, toc). Every heading gets an id derived from its text,
+    # replacing any id it had, so the anchors are the same every time the
+    # same content is saved.
+    toc = []
+    used = set()
+    
+    def replace(match):
+        tag, attributes, inner = match.groups()
+        text = html_to_text(inner)
+        anchor = anchor_id(text, used)
+        if tag in TOC_LEVELS and text:
+            toc.append({'level': int(tag[1]), 'id': anchor, 'text': text})
+        return f'<{tag} id="{anchor}"{ID_ATTRIBUTE.sub("", attributes)}>{inner}</{tag}>'
+    
+    return HEADING.sub(replace, html), toc
+
+def prepare_content(html, description=None):
+    # Takes sanitized tutorial HTML and returns (html with heading anchors,
+    # reading metadata). Called wherever content is written, so pages and
+    # listing cards never parse the body at request time. body_text is the
+    # plain text for the search index, so the body is only parsed once.
+    if not html:
+        return html, {'excerpt': make_excerpt(description), 'word_count': 0, 'reading_minutes': 0,
+                      'toc_json': '[]', 'body_text': ''}
+    html, toc = add_heading_anchors(html)
+    body_text = html_to_text(html)
+    word_count = len(body_text.split())
+    return html, {
+        # Cards show the description when there is one, else the start of the body
+        'excerpt': make_excerpt(description or body_text),
+        'word_count': word_count,
+        'reading_minutes': max(1, round(word_count / WORDS_PER_MINUTE)) if word_count else 0,
+        'toc_json': json.dumps(toc, ensure_ascii=False),
+        'body_text': body_text,
+    }
+
+def reading_values(reading):
+    # Parameters for "excerpt = ?, word_count = ?, reading_minutes = ?, toc_json = ?"
+    return reading['excerpt'], reading['word_count'], reading['reading_minutes'], reading['toc_json']
+
+def backfill(rebuild=False, batch_size=BACKFILL_BATCH_SIZE):
+    # Fills the reading columns for tutorials saved before they existed (or
+    # all of them with rebuild=True). Heading anchors change the stored HTML,
+    # so updated_at moves and cached pages and offline copies are refreshed.
+    # The plain text is unchanged, so the search index is left alone.
+    updated = 0
+    last_id = 0
+    where = '' if rebuild else 'AND word_count IS NULL'
+    while True:
+        with db_connection() as conn:
+            rows = conn.execute(
+                f'SELECT id, description, content FROM tutorials WHERE id > ? AND content IS NOT NULL {where} '
+                'ORDER BY id LIMIT ?',
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                content, reading = prepare_content(row['content'], row['description'])
+                values = (content, *reading_values(reading))
+                # Skipped if the tutorial was edited since it was read, or if
+                # nothing would change
+                updated += conn.execute(
+                    f'''UPDATE tutorials
+                        SET content = ?, excerpt = ?, word_count = ?, reading_minutes = ?, toc_json = ?,
+                            updated_at = {NOW_SQL}
+                        WHERE id = ? AND content = ?
+                          AND (content, excerpt, word_count, reading_minutes, toc_json) IS NOT (?, ?, ?, ?, ?)''',
+                    (*values, row['id'], row['content'], *values)
+                ).rowcount
+            conn.commit()
+        last_id = rows[-1]['id']
+    if updated:
+        page_cache.clear()
+    return updated
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the precomputed reading metadata (excerpt, word count, reading time, contents).')
+    parser.add_argument('--backfill', action='store_true', help='compute the metadata for tutorials that have none')
+    parser.add_argument('--rebuild', action='store_true', help='recompute it for every tutorial')
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    
+    if not args.backfill and not args.rebuild:
+        parser.print_help()
+    else:
+        start = time.perf_counter()
+        count = backfill(args.rebuild, args.batch_size)
+        print(f"Updated {count} tutorials in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,165 @@
+import argparse
+import os
+import threading
+import time
+from cache import page_cache
+from database import db_connection, NOW_SQL
+from reading import prepare_content, reading_values
+from search import index_tutorial
+
+# Everything stored in tutorials.content is rendered with |safe, so every
+# write path (scrapes, archive imports, the admin's add and edit forms) goes
+# through here.
+ALLOWED_TAGS = frozenset([
+    'p', 'br', 'hr', 'strong', 'b', 'em', 'i', 'u', 's', 'del', 'ins', 'mark', 'sub', 'sup', 'small',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'dl', 'dt', 'dd', 'a', 'img',
+    'code', 'kbd', 'samp', 'pre', 'blockquote', 'div', 'span', 'figure', 'figcaption',
+    'table', 'caption', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th',
+])
+# class is kept for the syntax-highlighting and layout classes in existing tutorials.
+# Heading ids are the anchors reading.prepare_content() sets; it replaces
+# whatever ids the input had.
+ALLOWED_ATTRIBUTES = {
+    '*': ['class'],
+    'h1': ['id'], 'h2': ['id'], 'h3': ['id'], 'h4': ['id'], 'h5': ['id'], 'h6': ['id'],
+    'a': ['href', 'title'],
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    'td': ['colspan', 'rowspan'],
+    'th': ['colspan', 'rowspan'],
+}
+ALLOWED_PROTOCOLS = frozenset(['http', 'https', 'mailto'])
+
+RESANITIZE_BATCH_SIZE = 200
+
+# A Cleaner is built once per thread: its html5lib parser keeps state
+# between calls, so one instance cannot be shared by the scrape workers.
+_local = threading.local()
+
+def get_cleaner():
+    cleaner = getattr(_local, 'cleaner', None)
+    if cleaner is None:
+        # Imported on first use: bleach pulls in html5lib, which web
+        # processes only need once an admin saves a tutorial
+        import bleach
+        cleaner = _local.cleaner = bleach.Cleaner(
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRIBUTES,
+            protocols=ALLOWED_PROTOCOLS,
+            strip=True,
+            strip_comments=True,
+        )
+    return cleaner
+
+def sanitize_html(html):
+    if not html:
+        return ''
+    return get_cleaner().clean(html)
+
+def _sanitize_batch(rows):
+    # Runs in a worker process. Returns (bytes read, [(id, description, old,
+    # new, reading)]) for the rows the sanitizer changed.
+    changed = []
+    size = 0
+    for tutorial_id, description, content in rows:
+        size += len(content.encode('utf-8'))
+        cleaned, reading = prepare_content(sanitize_html(content), description)
+        if cleaned != content:
+            changed.append((tutorial_id, description, content, cleaned, reading))
+    return size, changed
+
+def _batches(batch_size):
+    last_id = 0
+    while True:
+        with db_connection() as conn:
+            rows = conn.execute(
+                'SELECT id, description, content FROM tutorials WHERE id > ? AND content IS NOT NULL ORDER BY id LIMIT ?',
+                (last_id, batch_size)
+            ).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield [(row['id'], row['description'], row['content']) for row in rows]
+
+def _save_changes(changed):
+    saved = 0
+    with db_connection() as conn:
+        for tutorial_id, description, old, new, reading in changed:
+            # Skipped if the tutorial was edited since it was read; the
+            # excerpt may come from the description, so that is checked too
+            row = conn.execute(
+                f'''UPDATE tutorials
+                    SET content = ?, excerpt = ?, word_count = ?, reading_minutes = ?, toc_json = ?,
+                        updated_at = {NOW_SQL}
+                    WHERE id = ? AND content = ? AND description IS ?
+                    RETURNING title, description''',
+                (new, *reading_values(reading), tutorial_id, old, description)
+            ).fetchone()
+            if row is not None:
+                index_tutorial(conn, tutorial_id, row['title'], row['description'], new, reading['body_text'])
+                saved += 1
+        conn.commit()
+    # A sweep rewrites pages across the whole catalogue, so the cache is
+    # emptied once per batch instead of page by page
+    if saved:
+        page_cache.clear()
+    return saved
+
+def resanitize_corpus(workers=None, batch_size=RESANITIZE_BATCH_SIZE, dry_run=False):
+    # Re-runs every stored tutorial through the current allowlist, sanitizing
+    # batches in `workers` processes while this process reads and writes the
+    # database. Returns a summary with throughput figures.
+    workers = workers or os.cpu_count() or 1
+    summary = {'workers': workers, 'scanned': 0, 'changed': 0, 'saved': 0, 'bytes': 0}
+    started = time.perf_counter()
+    
+    def collect(result):
+        size, changed = result
+        summary['bytes'] += size
+        summary['changed'] += len(changed)
+        if changed and not dry_run:
+            summary['saved'] += _save_changes(changed)
+    
+    if workers == 1:
+        for batch in _batches(batch_size):
+            summary['scanned'] += len(batch)
+            collect(_sanitize_batch(batch))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of batches in flight so memory does not
+            # grow with the catalogue
+            pending = []
+            for batch in _batches(batch_size):
+                summary['scanned'] += len(batch)
+                pending.append(executor.submit(_sanitize_batch, batch))
+                if len(pending) >= workers * 2:
+                    collect(pending.pop(0).result())
+            for future in pending:
+                collect(future.result())
+    
+    elapsed = time.perf_counter() - started
+    summary['seconds'] = round(elapsed, 2)
+    summary['rows_per_second'] = round(summary['scanned'] / elapsed, 1) if elapsed else 0.0
+    summary['mb_per_second'] = round(summary['bytes'] / 1024 / 1024 / elapsed, 2) if elapsed else 0.0
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sanitize stored tutorial HTML with the current allowlist.')
+    parser.add_argument('--resanitize', action='store_true', help='re-sanitize every stored tutorial')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='sanitizer processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=RESANITIZE_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    args = parser.parse_args()
+    
+    if not args.resanitize:
+        parser.print_help()
+    else:
+        summary = resanitize_corpus(args.workers, args.batch_size, args.dry_run)
+        if args.dry_run:
+            outcome = f"{summary['changed']} would change"
+        else:
+            # The rest were edited while the sweep ran and were left alone
+            outcome = f"{summary['saved']} rewritten ({summary['changed'] - summary['saved']} edited meanwhile)"
+        print(f"Scanned {summary['scanned']} tutorials ({summary['bytes'] / 1024 / 1024:.1f} MB), {outcome}, "
+              f"in {summary['seconds']}s with {summary['workers']} workers: "
+              f"{summary['rows_per_second']} tutorials/s, {summary['mb_per_second']} MB/s")
@@ -1,233 +1,606 @@
 
 import requests
 import trafilatura
-import os
 import re
-import bleach
-from database import get_db_connection
+import socket
+import ipaddress
+import sys
+import threading
+import time
+import hashlib
+import os
+import lxml.etree
+import lxml.html
+import content_store
+import images
+from cache import invalidate_listings, invalidate_tutorial
+from database import db_connection, NOW_SQL
+from metrics import SCRAPE_RESULTS, timed_stages
+from reading import prepare_content, reading_values
+from sanitizer import sanitize_html
+from search import index_tutorial
+from taxonomy import set_tutorial_tags, suggest_tags, toc_headings
 from requests.adapters import HTTPAdapter
-from urllib3.util.connection import create_connection
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse, urlunparse, urljoin
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+USER_AGENT = 'Mozilla/5.0 (compatible; NetworkPenGuidesBot/1.0)'
+# Tutorials whose source was checked within this many hours are skipped by a sweep
+REFRESH_AFTER_HOURS = 24
+SOURCE_COLUMNS = 'id, slug, image_path, source_url, source_etag, source_last_modified, content_hash, checked_at'
+# Upper bound on keep-alive connections each host's session holds open
+SESSION_POOL_SIZE = 16
+# Sessions kept per process; image CDNs and re-resolved IPs add new ones, so
+# the least recently used are closed past this many
+SESSION_CACHE_SIZE = int(os.environ.get('SCRAPER_SESSION_CACHE_SIZE', '64'))
+
+class PinnedIPAdapter(HTTPAdapter):
+    # Sends every request for one hostname to an IP validated up front, so a
+    # DNS answer that changes between validation and connect (rebinding) is
+    # never used. The URL is rewritten to the IP for the socket only; the Host
+    # header, TLS SNI and certificate verification still use the hostname.
+    def __init__(self, hostname, pinned_ip, **kwargs):
+        self.hostname = hostname
+        self.pinned_ip = pinned_ip
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs['server_hostname'] = self.hostname
+        pool_kwargs['assert_hostname'] = self.hostname
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+    
+    def send(self, request, **kwargs):
+        original_url = request.url
+        parsed = urlparse(original_url)
+        if parsed.hostname != self.hostname:
+            raise requests.exceptions.InvalidURL(
+                f'Session pinned to {self.hostname} cannot fetch {parsed.hostname}'
+            )
+        netloc = self.pinned_ip if parsed.port is None else f'{self.pinned_ip}:{parsed.port}'
+        request.url = urlunparse(parsed._replace(netloc=netloc))
+        request.headers['Host'] = parsed.netloc.rpartition('@')[2]
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            request.url = original_url
+        response.url = original_url
+        return response
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def get_session(hostname, pinned_ip=None):
+    # One long-lived session per host (and pinned IP) so repeated requests
+    # reuse its keep-alive connections instead of paying TCP/TLS setup every
+    # time. Sessions never share pinning state, so concurrent scrapes are safe.
+    key = (hostname, pinned_ip)
+    evicted = []
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+        else:
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            if pinned_ip:
+                adapter = PinnedIPAdapter(hostname, pinned_ip, pool_connections=1, pool_maxsize=SESSION_POOL_SIZE)
+            else:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SESSION_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+            while len(_sessions) > SESSION_CACHE_SIZE:
+                evicted.append(_sessions.popitem(last=False)[1])
+    # A request still running on an evicted session completes; its
+    # connection is closed instead of going back to the pool
+    for old_session in evicted:
+        old_session.close()
+    return session
 
 def sanitize_filename(filename):
     filename = re.sub(r'[^\w\s-]', '', filename)
     filename = re.sub(r'[-\s]+', '-', filename)
     return filename.strip('-').lower()
 
-def download_image(img_url, save_path, pinned_ip=None):
+def download_image(img_url, pin=False):
     try:
-        # Skip images from external CDNs when using IP pinning to avoid SSL issues
         parsed = urlparse(img_url)
-        if pinned_ip and parsed.hostname and 'googleusercontent.com' in parsed.hostname:
-            print(f"Skipping external CDN image: {img_url}")
-            return False
+        # Images may live on another host (e.g. a CDN), which gets its own
+        # validated and pinned address rather than the page's.
+        pinned_ip = resolve_pinned_ip(parsed.hostname) if pin else None
+        session = get_session(parsed.hostname, pinned_ip)
+        with session.get(img_url, timeout=10, allow_redirects=False, stream=True) as response:
+            if response.status_code != 200:
+                print(f"Image request returned {response.status_code}: {img_url}")
+                return None
             
-        if pinned_ip:
-            session = requests.Session()
+            content_type = response.headers.get('Content-Type')
+            if images.image_extension(content_type) is None:
+                print(f"Skipping image with unsupported type {content_type}: {img_url}")
+                return None
             
-            original_create_connection = create_connection
+            declared_size = response.headers.get('Content-Length')
+            if declared_size and declared_size.isdigit() and int(declared_size) > images.MAX_IMAGE_BYTES:
+                print(f"Skipping image larger than {images.MAX_IMAGE_BYTES} bytes: {img_url}")
+                return None
             
-            def patched_create_connection(address, *args, **kwargs):
-                host, port = address
-                if host == parsed.hostname:
-                    return original_create_connection((pinned_ip, port), *args, **kwargs)
-                return original_create_connection(address, *args, **kwargs)
-            
-            import urllib3.util.connection
-            urllib3.util.connection.create_connection = patched_create_connection
-            
-            try:
-                response = session.get(img_url, timeout=10, allow_redirects=False, verify=True)
-            finally:
-                urllib3.util.connection.create_connection = original_create_connection
-        else:
-            response = requests.get(img_url, timeout=10, allow_redirects=False)
-        
-        if response.status_code == 200:
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
-            return True
+            return images.store_stream(response.iter_content(images.CHUNK_SIZE), content_type)
     except Exception as e:
         print(f"Error downloading image: {e}")
-    return False
+    return None
 
-def scrape_tutorial(url, pinned_ip=None):
+# Raised by run_scrape(); retryable tells the job queue whether another
+# attempt could succeed (e.g. a timeout) or is pointless (e.g. a duplicate).
+class ScrapeError(Exception):
+    retryable = True
+
+class DuplicateTutorialError(ScrapeError):
+    retryable = False
+
+class UnsafeHostError(ScrapeError):
+    retryable = False
+
+def resolve_pinned_ip(hostname):
     try:
-        if pinned_ip:
-            session = requests.Session()
-            parsed = urlparse(url)
-            
-            original_create_connection = create_connection
-            
-            def patched_create_connection(address, *args, **kwargs):
-                host, port = address
-                if host == parsed.hostname:
-                    return original_create_connection((pinned_ip, port), *args, **kwargs)
-                return original_create_connection(address, *args, **kwargs)
-            
-            import urllib3.util.connection
-            urllib3.util.connection.create_connection = patched_create_connection
-            
-            try:
-                response = session.get(url, timeout=15, allow_redirects=False)
-            finally:
-                urllib3.util.connection.create_connection = original_create_connection
-        else:
-            response = requests.get(url, timeout=15, allow_redirects=False)
-        
-        response.raise_for_status()
-        html_content = response.content
-        
-        # Use trafilatura to extract the main content
-        downloaded = trafilatura.fetch_url(url) if not pinned_ip else html_content.decode('utf-8', errors='ignore')
-        
-        # Extract metadata and content with trafilatura
-        metadata = trafilatura.extract_metadata(downloaded)
-        content_html = trafilatura.extract(
-            downloaded,
-            include_formatting=True,
-            include_links=True,
-            include_images=True,
-            output_format='html',
-            favor_precision=True
+        addr_info = socket.getaddrinfo(hostname, None)
+    except socket.gaierror:
+        raise ScrapeError('Could not resolve hostname. Please check the URL.')
+    
+    validated_ip = None
+    for addr in addr_info:
+        ip_str = addr[4][0]
+        try:
+            ip = ipaddress.ip_address(ip_str)
+        except ValueError:
+            raise UnsafeHostError('Invalid IP address resolved from hostname.')
+        if ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_multicast or ip.is_reserved:
+            raise UnsafeHostError('Cannot scrape from private, loopback, or reserved IP addresses.')
+        if validated_ip is None and ip.version == 4:
+            validated_ip = ip_str
+    
+    if not validated_ip:
+        raise UnsafeHostError('No valid IPv4 address found for hostname.')
+    return validated_ip
+
+def parse_html(html_content):
+    text = html_content.decode('utf-8', errors='ignore') if isinstance(html_content, bytes) else html_content
+    try:
+        return lxml.html.document_fromstring(text)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        return lxml.html.document_fromstring(text.encode('utf-8'))
+    except lxml.etree.ParserError:
+        raise ScrapeError('The page is empty or is not HTML.')
+
+def _first(tree, *xpaths):
+    for xpath in xpaths:
+        found = tree.xpath(xpath)
+        if found:
+            return found[0]
+    return None
+
+# Parses the page once and feeds the same lxml tree to trafilatura (content
+# and metadata) and to the title/description/image lookups. Does no network
+# or database I/O, so benchmarks/extraction.py can time it on saved pages.
+def extract_page(html_content, url=None):
+    tree = parse_html(html_content)
+    
+    # Read everything needed from the tree before handing it to trafilatura
+    h1 = _first(tree, '//h1')
+    description_meta = _first(tree, '//meta[@name="description"]/@content')
+    img = _first(tree, '//img')
+    if img is not None:
+        img_url = img.get('src')
+    else:
+        img_url = _first(tree, '//meta[@property="og:image"]/@content')
+    if img_url and url and not img_url.startswith('http'):
+        img_url = urljoin(url, img_url)
+    
+    content_html = trafilatura.extract(
+        tree,
+        url=url,
+        include_formatting=True,
+        include_links=True,
+        include_images=True,
+        output_format='html',
+        favor_precision=True
+    )
+    
+    # Fallback to the page's main container if trafilatura fails
+    if not content_html:
+        print("Trafilatura extraction failed, falling back to the main container...")
+        main_content = _first(
+            tree,
+            '//article',
+            '//main',
+            '//div[contains(concat(" ", normalize-space(@class), " "), " content ")]'
         )
-        
-        # Fallback to BeautifulSoup if trafilatura fails
-        if not content_html:
-            print("Trafilatura extraction failed, falling back to BeautifulSoup...")
-            soup = BeautifulSoup(html_content, 'html.parser')
-            main_content = soup.find('article') or soup.find('main') or soup.find('div', class_='content')
-            
-            if main_content:
-                content_html = str(main_content)
-            else:
-                content_html = '<div><p>Content could not be extracted.</p></div>'
-        
-        # Get title and description from metadata or fallback to BeautifulSoup
-        if metadata and metadata.title:
-            title_text = metadata.title
-        else:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            title = soup.find('h1')
-            title_text = title.get_text().strip() if title else 'Untitled Tutorial'
-        
-        if metadata and metadata.description:
-            description = metadata.description
+        if main_content is not None:
+            content_html = lxml.html.tostring(main_content, encoding='unicode')
         else:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            description_meta = soup.find('meta', attrs={'name': 'description'})
-            description = description_meta['content'] if description_meta else ''
-        
-        slug = sanitize_filename(title_text)
-        
-        # Sanitize the extracted HTML
-        allowed_tags = ['p', 'br', 'strong', 'em', 'u', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-                      'ul', 'ol', 'li', 'a', 'img', 'code', 'pre', 'blockquote', 'div', 'span', 'table', 'tr', 'td', 'th', 'thead', 'tbody']
-        allowed_attrs = {'a': ['href', 'title'], 'img': ['src', 'alt', 'title']}
-        
-        content_html = bleach.clean(
-            content_html,
-            tags=allowed_tags,
-            attributes=allowed_attrs,
-            strip=True
+            content_html = '<div><p>Content could not be extracted.</p></div>'
+    
+    metadata = trafilatura.extract_metadata(tree, default_url=url)
+    
+    # Get title and description from metadata or fall back to the page itself
+    if metadata and metadata.title:
+        title_text = metadata.title
+    else:
+        title_text = h1.text_content().strip() if h1 is not None else 'Untitled Tutorial'
+    
+    if metadata and metadata.description:
+        description = metadata.description
+    else:
+        description = description_meta or ''
+    
+    # The site's own categories and tags, used as tag suggestions
+    categories = []
+    if metadata:
+        categories = list(metadata.categories or []) + list(metadata.tags or [])
+    
+    return {
+        'title': title_text,
+        'description': description,
+        'content_html': content_html,
+        'image_url': img_url,
+        'categories': categories,
+    }
+
+def fetch_page(url, pinned_ip=None, etag=None, last_modified=None):
+    # Sends the validators from the previous fetch, if any; a 304 is
+    # returned to the caller rather than raised.
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    session = get_session(urlparse(url).hostname, pinned_ip)
+    response = session.get(url, timeout=15, allow_redirects=False, headers=headers)
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
+
+def content_fingerprint(page):
+    # Hash of everything a scrape would write, taken after sanitizing so
+    # markup the sanitizer drops anyway does not count as a change
+    digest = hashlib.sha256()
+    for field in ('title', 'description', 'content_html', 'image_url'):
+        digest.update((page[field] or '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def run_scrape(url, pinned_ip=None, progress=None, refresh=False):
+    with db_connection() as conn:
+        existing = conn.execute(f'SELECT {SOURCE_COLUMNS} FROM tutorials WHERE source_url = ?', (url,)).fetchone()
+    if existing is not None:
+        if not refresh:
+            SCRAPE_RESULTS.inc(operation='scrape', result='duplicate')
+            raise DuplicateTutorialError(f"{url} was already scraped as '{existing['slug']}'.")
+        refresh_tutorial(existing, pinned_ip=pinned_ip, progress=progress)
+        return existing['slug']
+    
+    try:
+        with timed_stages('scrape', progress) as report:
+            slug, title_text = _scrape_new(url, pinned_ip, report)
+    except DuplicateTutorialError:
+        SCRAPE_RESULTS.inc(operation='scrape', result='duplicate')
+        raise
+    except Exception:
+        SCRAPE_RESULTS.inc(operation='scrape', result='failed')
+        raise
+    SCRAPE_RESULTS.inc(operation='scrape', result='scraped')
+    
+    print(f"Successfully scraped: {title_text}")
+    return slug
+
+def _check_new_slug(conn, slug):
+    if conn.execute('SELECT 1 FROM tutorials WHERE slug = ?', (slug,)).fetchone():
+        raise DuplicateTutorialError(f"Tutorial with slug '{slug}' already exists.")
+
+def _scrape_new(url, pinned_ip, report):
+    report('fetch')
+    response = fetch_page(url, pinned_ip)
+    html_content = response.content
+    
+    report('extract')
+    page = extract_page(html_content, url)
+    title_text = page['title']
+    description = page['description']
+    
+    slug = sanitize_filename(title_text)
+    # Checked before anything is downloaded or stored, and again in the
+    # transaction for a scrape of the same page that commits in between
+    with db_connection() as conn:
+        _check_new_slug(conn, slug)
+    
+    report('sanitize')
+    # Sanitize the extracted HTML. The fingerprint is taken before anchors
+    # are added, so it only changes when the source does.
+    page['content_html'] = sanitize_html(page['content_html'])
+    content_html, reading = prepare_content(page['content_html'], description)
+    tags = suggest_tags(title_text, toc_headings(reading['toc_json']), description,
+                        reading['body_text'], page['categories'])
+    
+    report('image')
+    image_path = None
+    if page['image_url']:
+        image_path = download_image(page['image_url'], pin=bool(pinned_ip))
+    
+    report('save')
+    # A duplicate found here leaves the stored image unreferenced, for
+    # content_store.collect_garbage()
+    with db_connection() as conn, content_store.transaction(conn):
+        _check_new_slug(conn, slug)
+        cursor = conn.execute(
+            f"""INSERT INTO tutorials (title, description, slug, image_path, html_filename, content,
+                                       excerpt, word_count, reading_minutes, toc_json, updated_at,
+                                       source_url, source_etag, source_last_modified, content_hash, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {NOW_SQL}, ?, ?, ?, ?, {NOW_SQL})""",
+            (title_text, description, slug, image_path, '', content_html, *reading_values(reading),
+             url, response.headers.get('ETag'), response.headers.get('Last-Modified'), content_fingerprint(page))
         )
-        
-        # Extract main image
-        soup = BeautifulSoup(html_content, 'html.parser')
-        img_tag = soup.find('img') or (soup.find('meta', property='og:image'))
-        image_path = None
-        
-        if img_tag:
-            img_url = img_tag.get('src') or img_tag.get('content')
-            if img_url and not img_url.startswith('http'):
-                from urllib.parse import urljoin
-                img_url = urljoin(url, img_url)
-            
-            if img_url:
-                img_filename = f"{slug}.jpg"
-                save_path = os.path.join('static', 'images', 'tutorial_images', img_filename)
-                
-                if download_image(img_url, save_path, pinned_ip=pinned_ip):
-                    image_path = f'images/tutorial_images/{img_filename}'
-        
-        html_filename = f"{slug}.html"
-        html_path = os.path.join('templates', 'tutorials', html_filename)
-        
-        os.makedirs(os.path.dirname(html_path), exist_ok=True)
-        
-        tutorial_template = f"""
-{{% extends "base.html" %}}
-
-{{% block content %}}
-<div class="container my-5">
-    <h1>{{{{ tutorial['title'] }}}}</h1>
-    {{% if tutorial['image_path'] %}}
-    <img src="{{{{ url_for('static', filename=tutorial['image_path']) }}}}" class="img-fluid mb-4" alt="{{{{ tutorial['title'] }}}}">
-    {{% endif %}}
-    <div class="tutorial-content">
-        {content_html}
-    </div>
-    <a href="{{{{ url_for('index') }}}}" class="btn btn-secondary mt-4">Back to Tutorials</a>
-</div>
-{{% endblock %}}
-"""
-        
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(tutorial_template)
-        
-        conn = get_db_connection()
-        
-        # Check if tutorial with this slug already exists
-        existing = conn.execute('SELECT id FROM tutorials WHERE slug = ?', (slug,)).fetchone()
-        if existing:
-            conn.close()
-            print(f"Tutorial with slug '{slug}' already exists. Skipping.")
-            return False
-        
+        index_tutorial(conn, cursor.lastrowid, title_text, description, content_html, reading['body_text'])
+        set_tutorial_tags(conn, cursor.lastrowid, tags)
+    invalidate_listings()
+    return slug, title_text
+
+def _record_check(tutorial, response):
+    # Servers may omit validators on a 304, so keep the previous ones then
+    with db_connection() as conn:
         conn.execute(
-            'INSERT INTO tutorials (title, description, slug, image_path, html_filename) VALUES (?, ?, ?, ?, ?)',
-            (title_text, description, slug, image_path, html_filename)
+            f"""UPDATE tutorials
+                SET source_etag = COALESCE(?, source_etag),
+                    source_last_modified = COALESCE(?, source_last_modified),
+                    checked_at = {NOW_SQL}
+                WHERE id = ?""",
+            (response.headers.get('ETag'), response.headers.get('Last-Modified'), tutorial['id'])
         )
         conn.commit()
-        conn.close()
-        
-        print(f"Successfully scraped: {title_text}")
-        return True
-        
+
+def refresh_tutorial(tutorial, pinned_ip=None, progress=None):
+    # Re-fetches a scraped tutorial's source with the validators saved by the
+    # last fetch. Returns 'not_modified' (304, nothing parsed), 'unchanged'
+    # (same content hash, nothing written) or 'updated'.
+    try:
+        with timed_stages('refresh', progress) as report:
+            outcome = _refresh(tutorial, pinned_ip, report)
+    except Exception:
+        SCRAPE_RESULTS.inc(operation='refresh', result='failed')
+        raise
+    SCRAPE_RESULTS.inc(operation='refresh', result=outcome)
+    return outcome
+
+def _refresh(tutorial, pinned_ip, report):
+    report('fetch')
+    response = fetch_page(tutorial['source_url'], pinned_ip,
+                          tutorial['source_etag'], tutorial['source_last_modified'])
+    if response.status_code == 304:
+        _record_check(tutorial, response)
+        return 'not_modified'
+    
+    report('extract')
+    page = extract_page(response.content, tutorial['source_url'])
+    
+    report('sanitize')
+    page['content_html'] = sanitize_html(page['content_html'])
+    content_hash = content_fingerprint(page)
+    if content_hash == tutorial['content_hash']:
+        _record_check(tutorial, response)
+        return 'unchanged'
+    
+    content_html, reading = prepare_content(page['content_html'], page['description'])
+    
+    report('image')
+    image_path = tutorial['image_path']
+    if page['image_url']:
+        image_path = download_image(page['image_url'], pin=bool(pinned_ip)) or image_path
+    
+    report('save')
+    # The slug is kept so existing links and offline copies stay valid
+    with db_connection() as conn, content_store.transaction(conn) as write:
+        conn.execute(
+            f"""UPDATE tutorials
+                SET title = ?, description = ?, image_path = ?, content = ?, content_hash = ?,
+                    excerpt = ?, word_count = ?, reading_minutes = ?, toc_json = ?,
+                    source_etag = ?, source_last_modified = ?, checked_at = {NOW_SQL}, updated_at = {NOW_SQL}
+                WHERE id = ?""",
+            (page['title'], page['description'], image_path, content_html, content_hash, *reading_values(reading),
+             response.headers.get('ETag'), response.headers.get('Last-Modified'), tutorial['id'])
+        )
+        index_tutorial(conn, tutorial['id'], page['title'], page['description'], content_html, reading['body_text'])
+        if image_path != tutorial['image_path']:
+            write.release_image(tutorial['image_path'])
+    invalidate_tutorial(tutorial['slug'])
+    
+    print(f"Refreshed: {page['title']}")
+    return 'updated'
+
+def scrape_tutorial(url, pinned_ip=None):
+    try:
+        return bool(run_scrape(url, pinned_ip=pinned_ip))
+    except DuplicateTutorialError as e:
+        print(f"{e} Skipping.")
+        return False
     except Exception as e:
         print(f"Error scraping {url}: {e}")
         import traceback
         traceback.print_exc()
         return False
 
-def scrape_multiple_tutorials(urls):
-    success_count = 0
-    for url in urls:
-        print(f"\nScraping: {url}")
-        if scrape_tutorial(url):
-            success_count += 1
+def _interleave_by_host(items):
+    # Round-robin (url, item) pairs across hosts so one large site cannot
+    # occupy every worker while they wait on its per-host limit.
+    by_host = {}
+    for url, item in items:
+        by_host.setdefault(urlparse(url).hostname, []).append((url, item))
+    queues = list(by_host.values())
+    ordered = []
+    while queues:
+        for queue in list(queues):
+            ordered.append(queue.pop(0))
+            if not queue:
+                queues.remove(queue)
+    return ordered
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def _run_per_host(items, task, workers, per_host):
+    # Runs task(item) for each (url, item) pair on a thread pool, with at most
+    # per_host running against any one host. task returns (outcome, detail);
+    # exceptions count as 'failed'. Yields (url, outcome, detail, seconds).
+    host_limits = {}
+    host_limits_lock = threading.Lock()
     
-    print(f"\nCompleted! Successfully scraped {success_count}/{len(urls)} tutorials")
-    return success_count
+    def run_one(url, item):
+        hostname = urlparse(url).hostname
+        with host_limits_lock:
+            limit = host_limits.setdefault(hostname, threading.Semaphore(per_host))
+        with limit:
+            start = time.perf_counter()
+            try:
+                outcome, detail = task(item)
+            except Exception as e:
+                outcome, detail = 'failed', str(e)
+            return url, outcome, detail, time.perf_counter() - start
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_one, url, item) for url, item in _interleave_by_host(items)]
+        for future in as_completed(futures):
+            yield future.result()
 
-if __name__ == '__main__':
-    sample_urls = [
-        'https://www.hackingarticles.in/netcat-tutorials-beginner-to-advance/',
-        'https://www.hackingarticles.in/network-penetration-testing/',
-    ]
+def _run_batch(items, task, outcomes, workers, per_host):
+    counts = dict.fromkeys(outcomes, 0)
+    counts['failed'] = 0
+    durations = []
+    failures = []
+    started = time.perf_counter()
     
-    print("Starting tutorial scraper...")
-    print("This will scrape tutorials from the provided URLs.")
-    print("\nNote: Make sure you have permission to scrape the target website.")
-    print("For demonstration, run this script manually with specific URLs.\n")
+    for done, (url, outcome, detail, duration) in enumerate(_run_per_host(items, task, workers, per_host), 1):
+        counts[outcome] = counts.get(outcome, 0) + 1
+        durations.append(duration)
+        if outcome == 'failed':
+            failures.append({'url': url, 'error': detail})
+        elapsed = time.perf_counter() - started
+        print(f"[{done}/{len(items)}] {outcome:<12} {duration:6.2f}s  {url}  ({done / elapsed:.2f} pages/s)")
     
-    user_input = input("Enter URLs separated by commas (or press Enter to use sample URLs): ")
+    elapsed = time.perf_counter() - started
+    durations.sort()
+    return dict(
+        counts,
+        total=len(items),
+        workers=workers,
+        per_host=per_host,
+        elapsed_seconds=round(elapsed, 3),
+        pages_per_second=round(len(items) / elapsed, 3) if elapsed else 0.0,
+        p50_seconds=round(_percentile(durations, 0.50), 3),
+        p95_seconds=round(_percentile(durations, 0.95), 3),
+        failures=failures,
+    )
+
+def scrape_multiple_tutorials(urls, workers=8, per_host=2, pin=False, refresh=False):
+    def scrape_one(url):
+        try:
+            pinned_ip = resolve_pinned_ip(urlparse(url).hostname) if pin else None
+            return 'scraped', run_scrape(url, pinned_ip=pinned_ip, refresh=refresh)
+        except DuplicateTutorialError as e:
+            return 'duplicate', str(e)
+    
+    summary = _run_batch([(url, url) for url in urls], scrape_one, ('scraped', 'duplicate'), workers, per_host)
+    print(f"\nCompleted! Scraped {summary['scraped']}/{len(urls)} tutorials "
+          f"({summary['duplicate']} already existed, {summary['failed']} failed) "
+          f"in {summary['elapsed_seconds']:.1f}s, {summary['pages_per_second']:.2f} pages/s")
+    return summary
+
+def _claim_for_refresh(tutorial):
+    # Marks the row as checked before fetching, only if no other sweep (another
+    # process or scheduler thread) has claimed it since it was selected
+    with db_connection() as conn:
+        claimed = conn.execute(
+            f'UPDATE tutorials SET checked_at = {NOW_SQL} WHERE id = ? AND checked_at IS ?',
+            (tutorial['id'], tutorial['checked_at'])
+        ).rowcount
+        conn.commit()
+    return claimed == 1
+
+def refresh_sources(workers=4, per_host=2, pin=False, older_than_hours=REFRESH_AFTER_HOURS):
+    # Sweeps every scraped tutorial not checked within older_than_hours,
+    # re-fetching it with conditional requests (see refresh_tutorial).
+    with db_connection() as conn:
+        if older_than_hours:
+            due = conn.execute(
+                f"""SELECT {SOURCE_COLUMNS} FROM tutorials
+                    WHERE source_url IS NOT NULL
+                      AND (checked_at IS NULL OR checked_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?))
+                    ORDER BY checked_at""",
+                (f'-{older_than_hours} hours',)
+            ).fetchall()
+        else:
+            due = conn.execute(
+                f'SELECT {SOURCE_COLUMNS} FROM tutorials WHERE source_url IS NOT NULL ORDER BY checked_at'
+            ).fetchall()
     
-    if user_input.strip():
-        urls = [url.strip() for url in user_input.split(',')]
+    def refresh_one(tutorial):
+        if not _claim_for_refresh(tutorial):
+            return 'skipped', 'claimed by another sweep'
+        pinned_ip = resolve_pinned_ip(urlparse(tutorial['source_url']).hostname) if pin else None
+        return refresh_tutorial(tutorial, pinned_ip=pinned_ip), tutorial['slug']
+    
+    summary = _run_batch([(row['source_url'], row) for row in due], refresh_one,
+                         ('updated', 'unchanged', 'not_modified', 'skipped'), workers, per_host)
+    print(f"\nRefreshed {len(due)} sources: {summary['updated']} updated, {summary['unchanged']} unchanged, "
+          f"{summary['not_modified']} not modified, {summary['failed']} failed "
+          f"in {summary['elapsed_seconds']:.1f}s")
+    return summary
+
+def read_urls(path):
+    stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        return [line.strip() for line in stream if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(description='Scrape tutorials into the database.')
+    parser.add_argument('urls', nargs='*', help='tutorial URLs to scrape')
+    parser.add_argument('-f', '--file', help="file with one URL per line ('-' reads stdin)")
+    parser.add_argument('--workers', type=int, default=8, help='total concurrent scrapes')
+    parser.add_argument('--per-host', type=int, default=2, help='concurrent scrapes per host')
+    parser.add_argument('--pin', action='store_true',
+                        help='refuse private/reserved addresses and pin each host to its validated IP')
+    parser.add_argument('--refresh', action='store_true',
+                        help='refresh URLs that were already scraped instead of skipping them')
+    parser.add_argument('--refresh-all', action='store_true',
+                        help='re-check every scraped source with conditional requests')
+    parser.add_argument('--older-than', type=float, default=REFRESH_AFTER_HOURS, metavar='HOURS',
+                        help='with --refresh-all, skip sources checked within this many hours (0 checks all)')
+    parser.add_argument('--report', help='write the JSON summary to this file')
+    args = parser.parse_args()
+    
+    if args.refresh_all:
+        summary = refresh_sources(workers=args.workers, per_host=args.per_host, pin=args.pin,
+                                  older_than_hours=args.older_than)
     else:
-        urls = sample_urls
+        urls = list(args.urls)
+        if args.file:
+            urls.extend(read_urls(args.file))
+        elif not urls and not sys.stdin.isatty():
+            urls.extend(read_urls('-'))
+        
+        if not urls:
+            parser.error('no URLs given; pass them as arguments, with --file, or on stdin')
+        
+        print("Note: Make sure you have permission to scrape the target website.")
+        summary = scrape_multiple_tutorials(urls, workers=args.workers, per_host=args.per_host, pin=args.pin,
+                                            refresh=args.refresh)
     
-    scrape_multiple_tutorials(urls)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,148 @@
+import argparse
+import re
+import time
+from markupsafe import Markup, escape
+from database import db_connection
+from html_text import html_to_text
+
+RESULTS_PER_PAGE = 20
+MAX_QUERY_TERMS = 16
+REBUILD_BATCH_SIZE = 500
+
+# Column weights for bm25(): a hit in the title outranks one in the body
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 4.0
+BODY_WEIGHT = 1.0
+
+# Control characters mark snippet highlights so the surrounding text can be
+# HTML-escaped before the markers are turned into <mark> tags.
+_HIGHLIGHT_OPEN = '\x02'
+_HIGHLIGHT_CLOSE = '\x03'
+
+def index_tutorial(conn, tutorial_id, title, description, content, body_text=None):
+    # Writers that already have the plain text (see reading.prepare_content)
+    # pass it as body_text so the HTML is not parsed again
+    if body_text is None:
+        body_text = html_to_text(content)
+    conn.execute('DELETE FROM tutorials_fts WHERE rowid = ?', (tutorial_id,))
+    conn.execute(
+        'INSERT INTO tutorials_fts (rowid, title, description, body) VALUES (?, ?, ?, ?)',
+        (tutorial_id, title, description or '', body_text)
+    )
+
+def index_tutorials(conn, tutorials, replace_ids=()):
+    # Batch form of index_tutorial() for (id, title, description, body text)
+    # tuples. FTS5 flushes its pending inserts on every delete, so rows that
+    # may already be indexed are passed in replace_ids and deleted up front.
+    if replace_ids:
+        conn.executemany('DELETE FROM tutorials_fts WHERE rowid = ?', [(tutorial_id,) for tutorial_id in replace_ids])
+    conn.executemany(
+        'INSERT INTO tutorials_fts (rowid, title, description, body) VALUES (?, ?, ?, ?)',
+        [(tutorial_id, title, description or '', body) for tutorial_id, title, description, body in tutorials]
+    )
+
+def build_match_query(query):
+    # Quote every term so user input can never be parsed as FTS5 syntax;
+    # the last term is a prefix match to support search-as-you-type.
+    terms = re.findall(r'\w+', query or '')[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) > 1:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def highlight(snippet):
+    escaped = str(escape(snippet or ''))
+    return Markup(escaped.replace(_HIGHLIGHT_OPEN, '<mark>').replace(_HIGHLIGHT_CLOSE, '</mark>'))
+
+def search_tutorials(conn, query, page=1, per_page=RESULTS_PER_PAGE):
+    match = build_match_query(query)
+    if match is None:
+        return [], False
+    
+    # Every match is ranked, on the index alone, so the join and snippet()
+    # are paid for just the page's rows
+    ranked = conn.execute(
+        '''SELECT rowid, bm25(tutorials_fts, ?, ?, ?) AS score FROM tutorials_fts
+           WHERE tutorials_fts MATCH ?
+           ORDER BY score
+           LIMIT ? OFFSET ?''',
+        (TITLE_WEIGHT, DESCRIPTION_WEIGHT, BODY_WEIGHT, match, per_page + 1, (page - 1) * per_page)
+    ).fetchall()
+    page_ids = [row['rowid'] for row in ranked[:per_page]]
+    if not page_ids:
+        return [], False
+    
+    # The page's ids filter (the unary +) a rowid range; as a constraint,
+    # FTS5 would evaluate the MATCH again for each of them
+    rows = {row['id']: row for row in conn.execute(
+        f'''
+        SELECT t.id, t.title, t.description, t.slug, t.image_path, t.created_at,
+               snippet(tutorials_fts, 2, '{_HIGHLIGHT_OPEN}', '{_HIGHLIGHT_CLOSE}', '…', 24) AS snippet
+        FROM tutorials_fts
+        JOIN tutorials t ON t.id = tutorials_fts.rowid
+        WHERE tutorials_fts MATCH ? AND tutorials_fts.rowid BETWEEN ? AND ?
+          AND +tutorials_fts.rowid IN ({', '.join('?' * len(page_ids))})
+        ''',
+        (match, min(page_ids), max(page_ids), *page_ids)
+    )}
+    
+    results = []
+    for rank in ranked[:per_page]:
+        row = rows.get(rank['rowid'])
+        if row is None:
+            continue
+        results.append({
+            'id': row['id'],
+            'title': row['title'],
+            'description': row['description'],
+            'slug': row['slug'],
+            'image_path': row['image_path'],
+            'created_at': row['created_at'],
+            'snippet': highlight(row['snippet']),
+            'score': rank['score'],
+        })
+    return results, len(ranked) > per_page
+
+def rebuild_index(conn, batch_size=REBUILD_BATCH_SIZE):
+    conn.execute('DELETE FROM tutorials_fts')
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, title, description, content FROM tutorials WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            'INSERT INTO tutorials_fts (rowid, title, description, body) VALUES (?, ?, ?, ?)',
+            [(row['id'], row['title'], row['description'] or '', html_to_text(row['content'])) for row in rows]
+        )
+        indexed += len(rows)
+        last_id = rows[-1]['id']
+    conn.execute("INSERT INTO tutorials_fts (tutorials_fts) VALUES ('optimize')")
+    return indexed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the tutorial full-text search index.')
+    parser.add_argument('--rebuild', action='store_true', help='re-index every existing tutorial')
+    parser.add_argument('query', nargs='?', help='run a search and print the ranked results')
+    args = parser.parse_args()
+    
+    with db_connection() as conn:
+        if args.rebuild:
+            start = time.perf_counter()
+            with conn:
+                count = rebuild_index(conn)
+            print(f"Indexed {count} tutorials in {time.perf_counter() - start:.2f}s")
+        if args.query:
+            start = time.perf_counter()
+            results, has_more = search_tutorials(conn, args.query)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            for result in results:
+                print(f"{result['score']:8.3f}  {result['slug']}")
+            print(f"{len(results)}{'+' if has_more else ''} results in {elapsed_ms:.1f}ms")
+        if not args.rebuild and not args.query:
+            parser.print_help()
@@ -1,60 +1,195 @@
-const CACHE_NAME = 'network-pen-guides-v1';
-const urlsToCache = [
-  '/',
-  '/static/css/style.css',
-  '/static/manifest.json',
-  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
-  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js'
-];
+// Served by the app at /service-worker.js with PRECACHE_MANIFEST
+// ({version, entries: [{url, revision}]}) prepended; see offline.py.
+const CACHE_PREFIX = 'network-pen-guides';
+const PRECACHE_NAME = `${CACHE_PREFIX}-precache-${PRECACHE_MANIFEST.version}`;
+const PAGES_CACHE = `${CACHE_PREFIX}-pages`;
+const ASSETS_CACHE = `${CACHE_PREFIX}-assets`;
+const STATE_CACHE = `${CACHE_PREFIX}-state`;
+
+const OFFLINE_URL = PRECACHE_MANIFEST.entries.find((entry) => entry.url === '/offline').url;
+const CHANGES_URL = '/changes';
+const CHANGES_TOKEN_KEY = '/__sw/changes-cursor';
+
+// Runtime caches are trimmed oldest-first past these limits
+const RUNTIME_LIMITS = {
+  [PAGES_CACHE]: { maxEntries: 200, maxAgeSeconds: 30 * 24 * 60 * 60 },
+  [ASSETS_CACHE]: { maxEntries: 300, maxAgeSeconds: 30 * 24 * 60 * 60 },
+};
+const CACHED_AT_HEADER = 'sw-cached-at';
+
+const precacheUrls = new Set(PRECACHE_MANIFEST.entries.map((entry) => new URL(entry.url, self.location).href));
 
 self.addEventListener('install', (event) => {
   event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then((cache) => {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
-      })
+    caches.open(PRECACHE_NAME)
+      .then((cache) => cache.addAll(PRECACHE_MANIFEST.entries.map((entry) => entry.url)))
+      .then(() => self.skipWaiting())
   );
 });
 
-self.addEventListener('fetch', (event) => {
-  event.respondWith(
-    caches.match(event.request)
-      .then((response) => {
-        if (response) {
-          return response;
-        }
-        return fetch(event.request).then(
-          (response) => {
-            if (!response || response.status !== 200 || response.type !== 'basic') {
-              return response;
-            }
+self.addEventListener('activate', (event) => {
+  const keep = [PRECACHE_NAME, PAGES_CACHE, ASSETS_CACHE, STATE_CACHE];
+  event.waitUntil(
+    caches.keys()
+      .then((names) => Promise.all(
+        // Older precaches and the unversioned cache of the previous worker
+        names
+          .filter((name) => name.startsWith(CACHE_PREFIX) && !keep.includes(name))
+          .map((name) => caches.delete(name))
+      ))
+      .then(() => Promise.all(Object.keys(RUNTIME_LIMITS).map(trimCache)))
+      .then(() => self.clients.claim())
+  );
+});
 
-            const responseToCache = response.clone();
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+  const url = new URL(request.url);
 
-            caches.open(CACHE_NAME)
-              .then((cache) => {
-                cache.put(event.request, responseToCache);
-              });
+  if (precacheUrls.has(url.href)) {
+    event.respondWith(caches.match(request, { cacheName: PRECACHE_NAME }).then((cached) => cached || fetch(request)));
+    return;
+  }
+  if (url.origin !== self.location.origin) {
+    return;
+  }
+  if (url.pathname === '/' || url.pathname.startsWith('/tutorial/') || url.pathname.startsWith('/tag/')) {
+    event.respondWith(staleWhileRevalidate(event, PAGES_CACHE));
+    return;
+  }
+  if (url.pathname.startsWith('/static/')) {
+    event.respondWith(cacheFirst(request, ASSETS_CACHE));
+  }
+  // Everything else (admin, search, jobs, forms) always goes to the network
+});
 
-            return response;
-          }
-        );
-      })
-  );
+self.addEventListener('message', (event) => {
+  if (event.data && event.data.type === 'sync-tutorials') {
+    event.waitUntil(syncChanges());
+  }
 });
 
-self.addEventListener('activate', (event) => {
-  const cacheWhitelist = [CACHE_NAME];
-  event.waitUntil(
-    caches.keys().then((cacheNames) => {
-      return Promise.all(
-        cacheNames.map((cacheName) => {
-          if (cacheWhitelist.indexOf(cacheName) === -1) {
-            return caches.delete(cacheName);
-          }
+function stamp(response) {
+  // Cache Storage keeps no timestamps, so record one for age-based eviction
+  return response.blob().then((body) => {
+    const headers = new Headers(response.headers);
+    headers.set(CACHED_AT_HEADER, String(Date.now()));
+    return new Response(body, { status: response.status, statusText: response.statusText, headers });
+  });
+}
+
+function isFresh(response, cacheName) {
+  const cachedAt = Number(response.headers.get(CACHED_AT_HEADER) || 0);
+  return Date.now() - cachedAt < RUNTIME_LIMITS[cacheName].maxAgeSeconds * 1000;
+}
+
+function isStorable(response) {
+  // Pages carrying a flash message are sent with no-store
+  return response.ok && response.type === 'basic' && !response.redirected &&
+    !(response.headers.get('Cache-Control') || '').includes('no-store');
+}
+
+function putRuntime(cacheName, request, response) {
+  return Promise.all([caches.open(cacheName), stamp(response)])
+    .then(([cache, stamped]) => cache.put(request, stamped))
+    .then(() => trimCache(cacheName));
+}
+
+function trimCache(cacheName) {
+  const { maxEntries } = RUNTIME_LIMITS[cacheName];
+  return caches.open(cacheName).then((cache) =>
+    cache.keys().then((requests) =>
+      Promise.all(requests.map((request) => cache.match(request).then((response) => ({ request, response }))))
+        .then((entries) => {
+          const expired = entries.filter(({ response }) => !response || !isFresh(response, cacheName));
+          const live = entries.filter((entry) => !expired.includes(entry));
+          // keys() lists entries in insertion order, so the oldest come first
+          const overflow = live.slice(0, Math.max(0, live.length - maxEntries));
+          return Promise.all(expired.concat(overflow).map(({ request }) => cache.delete(request)));
         })
-      );
-    })
+    )
   );
-});
+}
+
+function staleWhileRevalidate(event, cacheName) {
+  const request = event.request;
+  // no-cache revalidates with the server (a cheap 304) instead of taking
+  // the copy the HTTP cache may still hold
+  const network = fetch(request, { cache: 'no-cache' })
+    .then((response) => {
+      if (isStorable(response)) {
+        event.waitUntil(putRuntime(cacheName, request, response.clone()));
+      }
+      return response;
+    });
+
+  return caches.match(request, { cacheName }).then((cached) => {
+    if (cached && isFresh(cached, cacheName)) {
+      event.waitUntil(network.catch(() => undefined));
+      return cached;
+    }
+    return network.catch(() => cached || caches.match(OFFLINE_URL, { cacheName: PRECACHE_NAME }));
+  });
+}
+
+function cacheFirst(request, cacheName) {
+  return caches.match(request, { cacheName }).then((cached) => {
+    if (cached && isFresh(cached, cacheName)) {
+      return cached;
+    }
+    return fetch(request).then((response) => {
+      if (isStorable(response)) {
+        putRuntime(cacheName, request, response.clone());
+      }
+      return response;
+    }).catch(() => cached || Response.error());
+  });
+}
+
+// Offline reading: fetch only the tutorials that changed since the last
+// sync and drop deleted ones, following the /changes feed. The first sync
+// only records the feed's current position.
+function syncChanges() {
+  return caches.open(STATE_CACHE).then((state) =>
+    state.match(CHANGES_TOKEN_KEY)
+      .then((saved) => (saved ? saved.text() : ''))
+      .then((cursor) => syncPage(state, cursor, 0))
+  ).catch((err) => console.log('Tutorial sync failed:', err));
+}
+
+function syncPage(state, cursor, fetched) {
+  const url = cursor ? `${CHANGES_URL}?cursor=${encodeURIComponent(cursor)}` : CHANGES_URL;
+  return fetch(url, { cache: 'no-store' })
+    .then((response) => response.json())
+    .then((feed) => caches.open(PAGES_CACHE).then((pages) => {
+      const updates = feed.changes.map((change) => {
+        if (change.deleted) {
+          return pages.delete(change.url);
+        }
+        return fetch(change.url, { cache: 'no-cache' }).then((response) => {
+          if (isStorable(response)) {
+            return stamp(response).then((stamped) => pages.put(change.url, stamped));
+          }
+          return pages.delete(change.url);
+        });
+      });
+      if (feed.changes.length) {
+        // The listing shows every tutorial, so any change alters it
+        updates.push(fetch('/', { cache: 'no-cache' }).then((response) =>
+          isStorable(response) ? stamp(response).then((stamped) => pages.put('/', stamped)) : undefined
+        ));
+      }
+      return Promise.all(updates)
+        .then(() => state.put(CHANGES_TOKEN_KEY, new Response(feed.cursor || '')))
+        .then(() => {
+          const total = fetched + feed.changes.length;
+          if (feed.has_more && total < RUNTIME_LIMITS[PAGES_CACHE].maxEntries) {
+            return syncPage(state, feed.cursor, total);
+          }
+          return trimCache(PAGES_CACHE);
+        });
+    }));
+}
@@ -0,0 +1,238 @@
+import argparse
+import json
+import re
+import time
+from cache import page_cache
+from database import db_connection, encode_cursor, decode_cursor, LISTING_COLUMNS, NOW_SQL
+
+MAX_TAGS = 8
+MAX_SUGGESTED_TAGS = 5
+MAX_TAG_LENGTH = 40
+SUGGEST_BATCH_SIZE = 500
+
+# Topics suggested from a tutorial's text: tag name -> phrases that point to
+# it. Phrases are matched as whole words, case-insensitively.
+TOPICS = {
+    'Active Directory': ['active directory', 'domain controller', 'ldap', 'ntds', 'gpo', 'bloodhound',
+                         'sharphound', 'dcsync', 'gmsa', 'laps', 'domain admin'],
+    'Kerberos': ['kerberos', 'kerberoast', 'kerberoasting', 'as-rep', 'asreproast', 'golden ticket',
+                 'silver ticket', 'tgt', 'tgs', 'constrained delegation', 'unconstrained delegation', 'rubeus'],
+    'ADCS': ['adcs', 'certificate services', 'certipy', 'esc1', 'esc8', 'pass-the-certificate', 'passthecert', 'pkinit'],
+    'Credential Dumping': ['credential dumping', 'credential dump', 'lsass', 'mimikatz', 'sam hashes', 'ntds.dit',
+                           'dpapi', 'lsa secrets', 'secretsdump', 'hashdump', 'lsassy', 'nanodump'],
+    'Password Attacks': ['password spraying', 'password spray', 'brute force', 'brute-force', 'hashcat',
+                         'john the ripper', 'hydra', 'wordlist', 'password cracking'],
+    'Lateral Movement': ['lateral movement', 'psexec', 'wmiexec', 'smbexec', 'pass-the-hash', 'pass the hash',
+                         'pass-the-ticket', 'winrm', 'evil-winrm'],
+    'NTLM Relay': ['ntlm relay', 'ntlmrelayx', 'smb relay', 'responder', 'llmnr', 'petitpotam', 'coercion'],
+    'Privilege Escalation': ['privilege escalation', 'privesc', 'suid', 'sudo', 'token impersonation',
+                             'seimpersonateprivilege', 'uac bypass', 'kernel exploit'],
+    'Pivoting': ['pivoting', 'port forwarding', 'tunneling', 'tunnelling', 'chisel', 'ligolo', 'socks proxy',
+                 'proxychains', 'sshuttle'],
+    'Network Scanning': ['nmap', 'port scan', 'port scanning', 'masscan', 'network scanning', 'service detection'],
+    'Enumeration': ['enumeration', 'enum4linux', 'smbclient', 'rpcclient', 'snmp', 'ldapsearch'],
+    'Web Exploitation': ['sql injection', 'sqli', 'xss', 'cross-site scripting', 'csrf', 'ssrf', 'file upload',
+                         'deserialization', 'burp suite', 'lfi', 'rfi', 'web application'],
+    'Persistence': ['persistence', 'scheduled task', 'backdoor', 'run key', 'startup folder', 'wmi subscription'],
+    'Defense Evasion': ['evasion', 'amsi', 'edr', 'antivirus', 'obfuscation', 'applocker', 'defender bypass'],
+    'Wireless': ['wireless', 'wi-fi', 'wifi', 'wpa2', 'handshake', 'aircrack-ng', 'deauthentication', 'evil twin'],
+    'Post Exploitation': ['post exploitation', 'post-exploitation', 'meterpreter', 'command and control', 'c2 framework'],
+    'Metasploit': ['metasploit', 'msfconsole', 'msfvenom'],
+    'NetExec': ['netexec', 'nxc', 'crackmapexec'],
+}
+# Where a phrase was found -> points per occurrence (body hits are capped)
+TITLE_POINTS = 4
+HEADING_POINTS = 2
+DESCRIPTION_POINTS = 2
+BODY_POINTS = 1
+MAX_BODY_POINTS = 3
+SUGGEST_THRESHOLD = 4
+# Site categories that say nothing about the topic
+IGNORED_CATEGORIES = {'uncategorized', 'uncategorised', 'blog', 'news', 'general', 'featured', 'articles', 'posts'}
+
+_TOPIC_PATTERNS = {
+    name: re.compile(r'(?<![\w-])(?:' + '|'.join(re.escape(phrase) for phrase in phrases) + r')(?![\w-])')
+    for name, phrases in TOPICS.items()
+}
+
+def tag_slug(name):
+    slug = re.sub(r'[^\w\s-]', '', name.lower())
+    return re.sub(r'[-\s]+', '-', slug).strip('-')
+
+def normalize_tag(name):
+    # Returns the display name to store, or None if nothing usable is left
+    name = ' '.join((name or '').split())[:MAX_TAG_LENGTH].strip()
+    return name if tag_slug(name) else None
+
+def parse_tags(text):
+    # Comma-separated input from the admin forms, de-duplicated by slug
+    names = []
+    seen = set()
+    for part in (text or '').split(','):
+        name = normalize_tag(part)
+        if name and tag_slug(name) not in seen:
+            seen.add(tag_slug(name))
+            names.append(name)
+    return names[:MAX_TAGS]
+
+def suggest_tags(title, headings=(), description='', body_text='', categories=(), limit=MAX_SUGGESTED_TAGS):
+    # Scores every topic on where its phrases appear; the title and headings
+    # count for more than passing mentions in the body. The source site's own
+    # categories are kept when they name a topic, or are added as tags of
+    # their own otherwise.
+    title = (title or '').lower()
+    headings = ' \n'.join(headings).lower()
+    description = (description or '').lower()
+    body_text = (body_text or '').lower()
+    scores = {}
+    for name, pattern in _TOPIC_PATTERNS.items():
+        score = (TITLE_POINTS * len(pattern.findall(title))
+                 + HEADING_POINTS * len(pattern.findall(headings))
+                 + DESCRIPTION_POINTS * len(pattern.findall(description))
+                 + BODY_POINTS * min(len(pattern.findall(body_text)), MAX_BODY_POINTS))
+        if score >= SUGGEST_THRESHOLD:
+            scores[name] = score
+    
+    topics_by_slug = {tag_slug(name): name for name in TOPICS}
+    for category in categories:
+        name = normalize_tag(category)
+        if name is None or name.lower() in IGNORED_CATEGORIES:
+            continue
+        # A category naming a known topic counts towards it
+        name = topics_by_slug.get(tag_slug(name), name)
+        scores[name] = scores.get(name, 0) + SUGGEST_THRESHOLD
+    
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [name for name, _ in ranked[:limit]]
+
+def toc_headings(toc_json):
+    return [entry['text'] for entry in json.loads(toc_json or '[]')]
+
+def suggest_for_tutorial(row):
+    # Suggestions from a stored row's title, description and outline; used
+    # by the edit form and the CLI, so no HTML is parsed
+    return suggest_tags(row['title'], toc_headings(row['toc_json']), row['description'])
+
+def set_tutorial_tags(conn, tutorial_id, names):
+    # Replaces a tutorial's tags, creating any that do not exist yet. Returns
+    # True if anything changed. The caller commits and bumps updated_at.
+    wanted = {}
+    for name in names:
+        name = normalize_tag(name)
+        if name:
+            wanted.setdefault(tag_slug(name), name)
+    current = {row['slug']: row['id'] for row in conn.execute(
+        'SELECT t.id, t.slug FROM tutorial_tags tt JOIN tags t ON t.id = tt.tag_id WHERE tt.tutorial_id = ?',
+        (tutorial_id,)
+    )}
+    removed = [current[slug] for slug in current if slug not in wanted]
+    added = [(slug, name) for slug, name in wanted.items() if slug not in current]
+    if removed:
+        conn.executemany('DELETE FROM tutorial_tags WHERE tutorial_id = ? AND tag_id = ?',
+                         [(tutorial_id, tag_id) for tag_id in removed])
+    for slug, name in added:
+        conn.execute('INSERT INTO tags (name, slug) VALUES (?, ?) ON CONFLICT (slug) DO NOTHING', (name, slug))
+        # created_at is copied so tag pages can page on (created_at, id)
+        # without reading the tutorials table
+        conn.execute(
+            '''INSERT INTO tutorial_tags (tag_id, tutorial_id, created_at)
+               SELECT (SELECT id FROM tags WHERE slug = ?), id, created_at FROM tutorials WHERE id = ?''',
+            (slug, tutorial_id)
+        )
+    return bool(removed or added)
+
+def tags_for_tutorials(conn, tutorial_ids):
+    # {tutorial id: [tag rows]} for one page of cards, in a single query
+    tags = {tutorial_id: [] for tutorial_id in tutorial_ids}
+    if not tags:
+        return tags
+    rows = conn.execute(
+        f'''SELECT tt.tutorial_id, t.name, t.slug FROM tutorial_tags tt JOIN tags t ON t.id = tt.tag_id
+            WHERE tt.tutorial_id IN ({', '.join('?' * len(tags))})
+            ORDER BY t.tutorial_count DESC, t.name''',
+        list(tags)
+    ).fetchall()
+    for row in rows:
+        tags[row['tutorial_id']].append(row)
+    return tags
+
+def popular_tags(conn, limit=20):
+    return conn.execute(
+        'SELECT name, slug, tutorial_count FROM tags WHERE tutorial_count > 0 ORDER BY tutorial_count DESC, name LIMIT ?',
+        (limit,)
+    ).fetchall()
+
+def get_tag(conn, slug):
+    return conn.execute('SELECT id, name, slug, tutorial_count FROM tags WHERE slug = ?', (slug,)).fetchone()
+
+# The same (created_at, id) cursors as the home page, read from the
+# (tag_id, created_at, tutorial_id) index so a page touches only its rows
+def fetch_tag_page(conn, tag_id, cursor=None, limit=24):
+    columns = ', '.join('t.' + column.strip() for column in LISTING_COLUMNS.split(','))
+    position = decode_cursor(cursor)
+    if position:
+        rows = conn.execute(
+            f'''SELECT {columns} FROM tutorial_tags tt JOIN tutorials t ON t.id = tt.tutorial_id
+                WHERE tt.tag_id = ? AND (tt.created_at, tt.tutorial_id) < (?, ?)
+                ORDER BY tt.created_at DESC, tt.tutorial_id DESC LIMIT ?''',
+            (tag_id, position[0], position[1], limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f'''SELECT {columns} FROM tutorial_tags tt JOIN tutorials t ON t.id = tt.tutorial_id
+                WHERE tt.tag_id = ?
+                ORDER BY tt.created_at DESC, tt.tutorial_id DESC LIMIT ?''',
+            (tag_id, limit + 1)
+        ).fetchall()
+    
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def tag_cursor_exists(conn, tag_id, position):
+    # Like database.cursor_row_exists(), for a row carrying this tag
+    return conn.execute(
+        'SELECT 1 FROM tutorial_tags WHERE tutorial_id = ? AND tag_id = ? AND created_at = ?',
+        (position[1], tag_id, position[0])
+    ).fetchone() is not None
+
+def tag_untagged(batch_size=SUGGEST_BATCH_SIZE):
+    # Gives tutorials without any tags the suggested ones. Returns the number
+    # of tutorials tagged.
+    tagged = 0
+    last_id = 0
+    while True:
+        with db_connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, title, description, toc_json FROM tutorials
+                   WHERE id > ? AND NOT EXISTS (SELECT 1 FROM tutorial_tags WHERE tutorial_id = tutorials.id)
+                   ORDER BY id LIMIT ?''',
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if set_tutorial_tags(conn, row['id'], suggest_for_tutorial(row)):
+                    conn.execute(f'UPDATE tutorials SET updated_at = {NOW_SQL} WHERE id = ?', (row['id'],))
+                    tagged += 1
+            conn.commit()
+        last_id = rows[-1]['id']
+    if tagged:
+        page_cache.clear()
+    return tagged
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage tutorial tags.')
+    parser.add_argument('--list', action='store_true', help='list tags by number of tutorials')
+    parser.add_argument('--suggest', action='store_true', help='tag every untagged tutorial with its suggested tags')
+    args = parser.parse_args()
+    
+    if args.suggest:
+        start = time.perf_counter()
+        count = tag_untagged()
+        print(f"Tagged {count} tutorials in {time.perf_counter() - start:.2f}s")
+    if args.list:
+        with db_connection() as conn:
+            for tag in popular_tags(conn, limit=-1):
+                print(f"{tag['tutorial_count']:6}  {tag['name']}  (/tag/{tag['slug']})")
+    if not args.suggest and not args.list:
+        parser.print_help()